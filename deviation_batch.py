@@ -0,0 +1,115 @@
+# deviation_batch.py
+import numpy as np
+
+# ---------- batch deviation scoring ----------
+# Vectorized _compute_deviation_repwise over many sessions at once. Sessions are
+# passed as one ragged array: `values` holds every session's rep averages back to
+# back and session i is values[offsets[i]:offsets[i + 1]]. Every step mirrors
+# the scalar function operation for operation (including numpy.percentile's
+# interpolation), so the results are bit-for-bit identical to calling it per
+# session.
+
+def pack_ragged(rep_lists):
+    """(values, offsets) for a list of rep_averages lists."""
+    counts = np.fromiter((len(r) for r in rep_lists), dtype=np.intp, count=len(rep_lists))
+    offsets = np.zeros(len(rep_lists) + 1, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+    values = np.fromiter((float(x) for r in rep_lists for x in r), dtype=np.float64, count=int(offsets[-1]))
+    return values, offsets
+
+def pack_opt_ranges(opt_ranges):
+    """(opt_min, opt_max) float arrays from (min, max) pairs; a pair that does not
+    convert to floats (e.g. (None, None)) becomes (0, 180) like the scalar version."""
+    lo = np.empty(len(opt_ranges), dtype=np.float64)
+    hi = np.empty(len(opt_ranges), dtype=np.float64)
+    for i, r in enumerate(opt_ranges):
+        try:
+            lo[i], hi[i] = float(r[0]), float(r[1])
+        except Exception:
+            lo[i], hi[i] = 0.0, 180.0
+    return lo, hi
+
+def _lerp(a, b, t):
+    # numpy.percentile's linear interpolation, reproduced for identical rounding
+    diff = b - a
+    out = a + diff * t
+    hi = t >= 0.5
+    out[hi] = (b - diff * (1 - t))[hi]
+    return out
+
+def _segment_percentile(sorted_values, starts, n, q):
+    virtual = (n - 1) * (q / 100.0)
+    prev = np.floor(virtual)
+    gamma = virtual - prev
+    prev = prev.astype(np.intp)
+    nxt = np.minimum(prev + 1, n - 1)
+    return _lerp(sorted_values[starts + prev], sorted_values[starts + nxt], gamma)
+
+def compute_deviation_batch(values, offsets, opt_min, opt_max, cap_percent=200.0):
+    """Scores every session; opt_min/opt_max are per-session arrays (or scalars).
+    Returns a dict of per-session arrays: deviation (what _compute_deviation_repwise
+    returns), inlier_frac, spread and distance_to_band. Sessions that take the
+    distance-to-band early exit report spread 0, as do empty sessions."""
+    offsets = np.asarray(offsets, dtype=np.intp)
+    m = len(offsets) - 1
+    # Python's max(0.0, min(x, 180.0)) turns NaN into 0; np.clip would keep it
+    reps = np.clip(np.nan_to_num(np.asarray(values, dtype=np.float64), nan=0.0), 0.0, 180.0)
+    n = np.diff(offsets)
+    nonempty = n > 0
+    starts = offsets[:-1]
+
+    opt_min_f = np.clip(np.nan_to_num(np.broadcast_to(np.asarray(opt_min, dtype=np.float64), (m,)), nan=0.0), 0.0, 180.0)
+    opt_max_f = np.clip(np.nan_to_num(np.broadcast_to(np.asarray(opt_max, dtype=np.float64), (m,)), nan=0.0), 0.0, 180.0)
+    opt_width = opt_max_f - opt_min_f
+    opt_width = np.where(opt_width <= 0.0, 1.0, opt_width)
+
+    rep_min = np.zeros(m)
+    rep_max = np.zeros(m)
+    if reps.size:
+        # reduceat over the non-empty starts: empty sessions have zero length, so
+        # each slice still ends where the next non-empty session begins
+        rep_min[nonempty] = np.minimum.reduceat(reps, starts[nonempty])
+        rep_max[nonempty] = np.maximum.reduceat(reps, starts[nonempty])
+    rep_range = rep_max - rep_min
+
+    seg = np.repeat(np.arange(m), n)
+    inside = (reps >= opt_min_f[seg]) & (reps <= opt_max_f[seg])
+    inliers = np.bincount(seg, weights=inside, minlength=m)
+    inlier_frac = np.divide(inliers, n, out=np.zeros(m), where=nonempty)
+
+    distance = np.where(rep_max < opt_min_f, opt_min_f - rep_max,
+                        np.where(rep_min > opt_max_f, rep_min - opt_max_f, 0.0))
+    outside = nonempty & (distance > 0.0)
+
+    # spread: IQR for 4+ reps (0 -> min(0.01, range)), the range for 2-3 reps
+    # (with 3 reps sorted[-2] - sorted[1] is always 0, so the scalar falls back
+    # to the range), 0 for a single rep
+    spread = np.where((n == 2) | (n == 3), rep_range, 0.0)
+    big = n >= 4
+    if big.any():
+        sorted_reps = reps[np.lexsort((reps, seg))]
+        nb = n[big]
+        iqr = (_segment_percentile(sorted_reps, starts[big], nb, 75.0) -
+               _segment_percentile(sorted_reps, starts[big], nb, 25.0))
+        spread[big] = np.where(iqr <= 0.0, np.minimum(0.01, rep_range[big]), iqr)
+
+    base_dev = (spread / opt_width) * 100.0
+    multiplier = 1.0 + (1.0 - inlier_frac)
+    deviation = base_dev * multiplier
+    extra = ((rep_range - opt_width) / opt_width) * 100.0
+    deviation = np.where(rep_range > opt_width, np.maximum(deviation, extra), deviation)
+
+    deviation = np.where(outside, (distance / opt_width) * 100.0, deviation)
+    deviation = np.minimum(np.maximum(deviation, 0.0), float(cap_percent))
+    deviation[~nonempty] = 0.0
+    spread[outside | ~nonempty] = 0.0
+    # Python's round() is correctly rounded; numpy.round is not always the same
+    deviation = np.fromiter((round(d, 2) for d in deviation.tolist()), dtype=np.float64, count=m)
+    return {"deviation": deviation, "inlier_frac": inlier_frac, "spread": spread, "distance_to_band": distance}
+
+def score_sessions(rep_lists, opt_ranges, cap_percent=200.0):
+    """Convenience wrapper: deviation percentages for lists of rep averages and
+    matching (min, max) ranges, as a plain list of floats."""
+    values, offsets = pack_ragged(rep_lists)
+    lo, hi = pack_opt_ranges(opt_ranges)
+    return compute_deviation_batch(values, offsets, lo, hi, cap_percent)["deviation"].tolist()
@@ -0,0 +1,317 @@
+# exercise_defs.py
+# Exercise definitions, file persistence and session-history helpers. Pure
+# Python + numpy: the login and therapist/patient pages import this at startup,
+# while exercise_tracker (OpenCV + MediaPipe) is only imported once a set starts.
+import json
+import os
+import sys
+import threading
+from collections import namedtuple
+from datetime import datetime
+import numpy as np
+
+# Default optimal ranges (degrees)
+OPTIMAL_RANGES = {
+    "squat": (60, 180),
+    "pushup": (80, 160),
+    "curl": (20, 170),
+    "raise": (15, 95)
+}
+
+EXERCISES_FILE = "exercises.json"
+DB_FILE = "database.json"
+
+# ---------- utilities for file persistence ----------
+def ensure_exercises_file():
+    if not os.path.exists(EXERCISES_FILE):
+        with open(EXERCISES_FILE, "w") as f:
+            json.dump({"custom_exercises": {}}, f, indent=4)
+
+def load_custom_exercises():
+    """Custom exercise definitions from exercises.json, parsed once per change of
+    the file. The dict is shared between callers: treat it as read-only."""
+    ensure_exercises_file()
+    return _exercises_cache.get().get("custom_exercises", {})
+
+def save_custom_exercise(name, joint_limits, trajectory=None):
+    """`trajectory` is the reference-motion descriptor from save_trajectory(), if any."""
+    ensure_exercises_file()
+    with open(EXERCISES_FILE, "r") as f:
+        data = json.load(f)
+    data.setdefault("custom_exercises", {})
+    # preserve any existing metadata if present (therapist code may add default_sets/optimal_range later)
+    data["custom_exercises"][name] = data["custom_exercises"].get(name, {})
+    data["custom_exercises"][name].setdefault("joints", joint_limits)
+    data["custom_exercises"][name]["joints"] = joint_limits
+    data["custom_exercises"][name]["created"] = datetime.utcnow().isoformat()
+    if trajectory is not None:
+        data["custom_exercises"][name]["trajectory"] = trajectory
+    with open(EXERCISES_FILE, "w") as f:
+        json.dump(data, f, indent=4)
+    _exercises_cache.invalidate()
+
+    # update DB snapshot (through the repository, so a pending debounced write
+    # cannot overwrite it)
+    from rehab_db import load_db, save_db
+    db = load_db()
+    db.setdefault("exercises", {})
+    # copy joint_limits (therapist UI populates default_sets/optimal_range afterwards)
+    db["exercises"][name] = db["exercises"].get(name, {})
+    db["exercises"][name]["joints"] = joint_limits
+    db["exercises"][name]["created"] = datetime.utcnow().isoformat()
+    if trajectory is not None:
+        db["exercises"][name]["trajectory"] = trajectory
+    save_db(db)
+    _definitions.clear()
+
+# ---------- recorded reference motions ----------
+# The full joint-angle trajectory of a recording is kept next to the JSON files
+# as a compressed float32 .npz (t: seconds since recording started, angles:
+# frames x joints); the exercise definition only stores a small descriptor.
+TRAJECTORY_DIR = "trajectories"
+
+def save_trajectory(name, t, angles, joints):
+    safe = "".join(c if c.isalnum() or c in "_.-" else "_" for c in name)
+    os.makedirs(TRAJECTORY_DIR, exist_ok=True)
+    path = os.path.join(TRAJECTORY_DIR, f"{safe}.npz")
+    np.savez_compressed(path, t=np.asarray(t, dtype=np.float32), angles=np.asarray(angles, dtype=np.float32))
+    return {"file": path, "joints": list(joints), "frames": int(len(t)),
+            "duration": float(round(float(t[-1] - t[0]), 3)) if len(t) else 0.0}
+
+def load_trajectory(custom_def):
+    """(t, angles, joints) of a custom exercise's reference motion, or None."""
+    traj = custom_def.get("trajectory") if isinstance(custom_def, dict) else None
+    if not traj or not os.path.exists(traj.get("file", "")):
+        return None
+    with np.load(traj["file"]) as z:
+        return z["t"], z["angles"], traj["joints"]
+
+# ---------- session history ----------
+def apply_set_entry(db, username, ex, entry, custom=False):
+    """Counts an already built angle_stats entry into a patient's completed totals
+    (and sets_completed for custom exercises) and appends it to the history."""
+    patient = db.setdefault("patients", {}).setdefault(username, {})
+    comp = patient.setdefault("completed", {})
+    comp[ex] = comp.get(ex, 0) + int(entry.get('reps', 0))
+
+    if custom:
+        patient.setdefault("sets_completed", {})
+        patient["sets_completed"][ex] = patient["sets_completed"].get(ex, 0) + 1
+
+    patient.setdefault("angle_stats", {}).setdefault(ex, []).append(entry)
+    return entry
+
+def append_set_result(db, username, ex, stats, ex_meta=None, custom=False):
+    """Adds one finished set (start_exercise stats) to a patient's completed totals
+    and angle_stats history in `db`; the caller saves. Returns the new entry."""
+    ex_meta = ex_meta or {}
+    patient = db.setdefault("patients", {}).setdefault(username, {})
+
+    # snapshot current assigned/sets info (sets_completed including this set)
+    patient_assigned_reps = None
+    patient_assigned_sets = patient.get("assigned_sets", {}).get(ex, None)
+    exercise_default_sets = ex_meta.get("default_sets", None)
+    sets_done = patient.get("sets_completed", {}).get(ex, 0) + (1 if custom else 0)
+
+    entry = {
+        "timestamp": stats.get('timestamp'),
+        "reps": int(stats.get('reps', 0)),
+        "rep_averages": stats.get('rep_averages', []),
+        "overall_avg": stats.get('overall_avg', 0.0),
+        "angle_min": stats.get('angle_min', 0.0),
+        "angle_max": stats.get('angle_max', 0.0),
+        "range_avg_low": stats.get('range_avg_low', 0.0),
+        "range_avg_high": stats.get('range_avg_high', 0.0),
+        "rep_min": stats.get('rep_min', 0.0),
+        "rep_max": stats.get('rep_max', 0.0),
+        "rep_range": stats.get('rep_range', 0.0),
+        "opt_range": stats.get('opt_range', (0,0)),
+        "deviation_percent": stats.get('deviation_percent', 0.0),
+        "assigned_reps_snapshot": patient_assigned_reps,
+        "assigned_sets_snapshot": patient_assigned_sets,
+        "exercise_default_sets_snapshot": exercise_default_sets,
+        "sets_completed_snapshot": sets_done,
+        "landmark_file": stats.get('landmark_file')
+    }
+    return apply_set_entry(db, username, ex, entry, custom)
+
+# ---------- joint definitions ----------
+JOINT_TRIPLES = {
+    "LEFT_ELBOW": ("LEFT_SHOULDER", "LEFT_ELBOW", "LEFT_WRIST"),
+    "RIGHT_ELBOW": ("RIGHT_SHOULDER", "RIGHT_ELBOW", "RIGHT_WRIST"),
+    "LEFT_SHOULDER": ("LEFT_HIP", "LEFT_SHOULDER", "LEFT_ELBOW"),
+    "RIGHT_SHOULDER": ("RIGHT_HIP", "RIGHT_SHOULDER", "RIGHT_ELBOW"),
+    "LEFT_KNEE": ("LEFT_HIP", "LEFT_KNEE", "LEFT_ANKLE"),
+    "RIGHT_KNEE": ("RIGHT_HIP", "RIGHT_KNEE", "RIGHT_ANKLE"),
+    "LEFT_HIP": ("LEFT_SHOULDER", "LEFT_HIP", "LEFT_KNEE"),
+    "RIGHT_HIP": ("RIGHT_SHOULDER", "RIGHT_HIP", "RIGHT_KNEE")
+}
+
+# MediaPipe Pose landmark order (mp.solutions.pose.PoseLandmark), kept here so
+# the joint tables do not need mediapipe to be imported
+LANDMARK_NAMES = (
+    "NOSE", "LEFT_EYE_INNER", "LEFT_EYE", "LEFT_EYE_OUTER", "RIGHT_EYE_INNER", "RIGHT_EYE",
+    "RIGHT_EYE_OUTER", "LEFT_EAR", "RIGHT_EAR", "MOUTH_LEFT", "MOUTH_RIGHT", "LEFT_SHOULDER",
+    "RIGHT_SHOULDER", "LEFT_ELBOW", "RIGHT_ELBOW", "LEFT_WRIST", "RIGHT_WRIST", "LEFT_PINKY", "RIGHT_PINKY",
+    "LEFT_INDEX", "RIGHT_INDEX", "LEFT_THUMB", "RIGHT_THUMB", "LEFT_HIP", "RIGHT_HIP", "LEFT_KNEE",
+    "RIGHT_KNEE", "LEFT_ANKLE", "RIGHT_ANKLE", "LEFT_HEEL", "RIGHT_HEEL", "LEFT_FOOT_INDEX",
+    "RIGHT_FOOT_INDEX"
+)
+LANDMARK_INDEX = {n: i for i, n in enumerate(LANDMARK_NAMES)}
+NUM_LANDMARKS = len(LANDMARK_NAMES)
+
+# ---------- helper to pick primary joint (largest range) ----------
+def pick_primary_joint_from_limits(joint_limits):
+    if not joint_limits:
+        return None
+    best = None
+    best_range = -1.0
+    for j, (mn, mx) in joint_limits.items():
+        rng = mx - mn
+        if rng > best_range:
+            best = j
+            best_range = rng
+    return best
+
+# ---------- cached exercise definitions ----------
+class JsonFileCache:
+    """Parsed contents of a JSON file, re-read only when the file's mtime or size
+    changes (missing file -> `default`). Writers in this process call invalidate()."""
+    def __init__(self, path, default=None):
+        self.path = path
+        self.default = default
+        self._key = None
+        self._data = None
+        self._lock = threading.Lock()
+
+    def _stat_key(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def get(self):
+        with self._lock:
+            key = self._stat_key()
+            if key is None:
+                self._key, self._data = None, None
+                return self.default
+            if key != self._key:
+                with open(self.path, "r") as f:
+                    self._data = json.load(f)
+                self._key = key
+            return self._data
+
+    def invalidate(self):
+        with self._lock:
+            self._key = None
+
+_exercises_cache = JsonFileCache(EXERCISES_FILE, default={})
+
+ExerciseDef = namedtuple("ExerciseDef", "name meta joints primary_joint opt_range")
+
+def _valid_joints(joints):
+    # only JOINT_TRIPLES joints with a numeric (min, max) pair can be tracked
+    out = {}
+    for j, lim in (joints or {}).items() if isinstance(joints, dict) else ():
+        try:
+            mn, mx = float(lim[0]), float(lim[1])
+        except (TypeError, ValueError, IndexError):
+            continue
+        if j in JOINT_TRIPLES:
+            out[j] = [mn, mx]
+    return out
+
+def _exercise_opt_range(meta):
+    # optimal_range format (therapist UI stores): {"joint": "LEFT_ELBOW", "min": 20, "max": 150}
+    ex_opt = meta.get("optimal_range")
+    if isinstance(ex_opt, dict) and "min" in ex_opt and "max" in ex_opt:
+        try:
+            return float(ex_opt.get("min")), float(ex_opt.get("max"))
+        except (TypeError, ValueError):
+            return None
+    return None
+
+_definitions = {}
+
+def exercise_definition(name):
+    """ExerciseDef for `name`: exercises.json first, then the DB's exercises
+    snapshot, then the built-ins (meta None). opt_range is the exercise-level
+    default (custom optimal_range, else the built-in range, else (None, None)).
+    Built once per definition and reused until the source file changes."""
+    meta = load_custom_exercises().get(name)
+    if meta is None:
+        # the DB snapshot comes from the shared repository (whichever storage is
+        # configured), so this does not parse database.json a second time
+        from rehab_db import load_db
+        meta = load_db().get("exercises", {}).get(name)
+    if not isinstance(meta, dict):
+        meta = None
+    cached = _definitions.get(name)
+    if cached is not None and cached.meta is meta:
+        return cached
+    d = _definitions[name] = definition_from_meta(name, meta)
+    return d
+
+def definition_from_meta(name, meta):
+    """ExerciseDef built from an already looked-up definition dict (or None)."""
+    if not isinstance(meta, dict):
+        meta = None
+    joints = _valid_joints(meta.get("joints")) if meta else {}
+    opt_range = _exercise_opt_range(meta) if meta else None
+    if opt_range is None:
+        opt_range = OPTIMAL_RANGES.get(name.lower(), (None, None))
+    return ExerciseDef(name, meta, joints, pick_primary_joint_from_limits(joints), opt_range)
+
+def invalidate_exercise_cache():
+    """For code that writes exercises.json / the DB's exercises itself."""
+    _exercises_cache.invalidate()
+    _definitions.clear()
+
+def resolve_opt_range(patient, ex, custom_def):
+    # same precedence as patient_page.launch(): patient override, exercise optimal_range, built-in
+    per_patient = (patient.get("custom_optimal") or {}).get(ex)
+    if per_patient and isinstance(per_patient, list) and len(per_patient) == 2:
+        return tuple(per_patient)
+    # a malformed optimal_range falls through to the defaults, as in _exercise_opt_range
+    ex_opt = _exercise_opt_range(custom_def) if isinstance(custom_def, dict) else None
+    if ex_opt is not None:
+        return ex_opt
+    if ex in OPTIMAL_RANGES:
+        return OPTIMAL_RANGES.get(ex, (0, 0))
+    return (None, None)
+
+# ---------- tracker session ----------
+_prewarm_thread = None
+
+def _prewarm(previous, camera_index, camera):
+    if previous is not None:
+        previous.join()
+    try:
+        from exercise_tracker import get_session
+        get_session(camera_index).warm(camera=camera)
+    except Exception:
+        pass  # nothing to do here; the first set reports it (no camera, missing model, ...)
+
+def prewarm_tracker(camera_index=0, camera=False):
+    """Imports the tracker and warms the shared TrackerSession (Pose graph, and the
+    camera if `camera`) on a background thread; start_exercise then picks up the
+    warm session. Calls are chained, so a later call only adds what is missing."""
+    global _prewarm_thread
+    _prewarm_thread = threading.Thread(target=_prewarm, args=(_prewarm_thread, camera_index, camera),
+                                       name="tracker-prewarm", daemon=True)
+    _prewarm_thread.start()
+    return _prewarm_thread
+
+def wait_for_prewarm(timeout=None):
+    if _prewarm_thread is not None:
+        _prewarm_thread.join(timeout)
+
+def release_tracker_session():
+    """release_session() if the tracker was ever imported; logging out without
+    having started a set must not pull in OpenCV/MediaPipe just to free nothing."""
+    wait_for_prewarm()
+    tracker = sys.modules.get("exercise_tracker")
+    if tracker is not None:
+        tracker.release_session()
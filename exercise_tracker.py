@@ -2,75 +2,28 @@
 import cv2
 import mediapipe as mp
 import numpy as np
-import time
 import json
 import os
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
 from datetime import datetime
+from frame_sources import CameraSource, open_frame_source
+from tracker_pipeline import run_frames, run_pipelined
+from roi_crop import RoiCropper
+from inference_scheduler import AdaptiveScheduler
+from session_stats import StreamingAngleStats
+from rep_detector import detector_for
+from landmark_log import LandmarkWriter, landmark_capture_path
+from stage_timer import clock, make_timer
+from exercise_defs import (OPTIMAL_RANGES, EXERCISES_FILE, DB_FILE, ensure_exercises_file, load_custom_exercises,
+                           save_custom_exercise, TRAJECTORY_DIR, save_trajectory, load_trajectory,
+                           append_set_result, exercise_definition, JOINT_TRIPLES, LANDMARK_NAMES, LANDMARK_INDEX,
+                           NUM_LANDMARKS, pick_primary_joint_from_limits)
 
 mp_drawing = mp.solutions.drawing_utils
 mp_pose = mp.solutions.pose
 
-# Default optimal ranges (degrees)
-OPTIMAL_RANGES = {
-    "squat": (60, 180),
-    "pushup": (80, 160),
-    "curl": (20, 170),
-    "raise": (15, 95)
-}
-
-EXERCISES_FILE = "exercises.json"
-DB_FILE = "database.json"
-
-# ---------- utilities for file persistence ----------
-def ensure_exercises_file():
-    if not os.path.exists(EXERCISES_FILE):
-        with open(EXERCISES_FILE, "w") as f:
-            json.dump({"custom_exercises": {}}, f, indent=4)
-
-def load_custom_exercises():
-    ensure_exercises_file()
-    with open(EXERCISES_FILE, "r") as f:
-        return json.load(f).get("custom_exercises", {})
-
-def save_custom_exercise(name, joint_limits):
-    ensure_exercises_file()
-    with open(EXERCISES_FILE, "r") as f:
-        data = json.load(f)
-    data.setdefault("custom_exercises", {})
-    # preserve any existing metadata if present (therapist code may add default_sets/optimal_range later)
-    data["custom_exercises"][name] = data["custom_exercises"].get(name, {})
-    data["custom_exercises"][name].setdefault("joints", joint_limits)
-    data["custom_exercises"][name]["joints"] = joint_limits
-    data["custom_exercises"][name]["created"] = datetime.utcnow().isoformat()
-    with open(EXERCISES_FILE, "w") as f:
-        json.dump(data, f, indent=4)
-
-    # update DB snapshot
-    if os.path.exists(DB_FILE):
-        with open(DB_FILE, "r") as f:
-            db = json.load(f)
-    else:
-        db = {}
-    db.setdefault("exercises", {})
-    # copy joint_limits (therapist UI populates default_sets/optimal_range afterwards)
-    db["exercises"][name] = db["exercises"].get(name, {})
-    db["exercises"][name]["joints"] = joint_limits
-    db["exercises"][name]["created"] = datetime.utcnow().isoformat()
-    with open(DB_FILE, "w") as f:
-        json.dump(db, f, indent=4)
-
-# ---------- joint definitions ----------
-JOINT_TRIPLES = {
-    "LEFT_ELBOW": ("LEFT_SHOULDER", "LEFT_ELBOW", "LEFT_WRIST"),
-    "RIGHT_ELBOW": ("RIGHT_SHOULDER", "RIGHT_ELBOW", "RIGHT_WRIST"),
-    "LEFT_SHOULDER": ("LEFT_HIP", "LEFT_SHOULDER", "LEFT_ELBOW"),
-    "RIGHT_SHOULDER": ("RIGHT_HIP", "RIGHT_SHOULDER", "RIGHT_ELBOW"),
-    "LEFT_KNEE": ("LEFT_HIP", "LEFT_KNEE", "LEFT_ANKLE"),
-    "RIGHT_KNEE": ("RIGHT_HIP", "RIGHT_KNEE", "RIGHT_ANKLE"),
-    "LEFT_HIP": ("LEFT_SHOULDER", "LEFT_HIP", "LEFT_KNEE"),
-    "RIGHT_HIP": ("RIGHT_SHOULDER", "RIGHT_HIP", "RIGHT_KNEE")
-}
-
 # ---------- math helpers ----------
 def _angle(a, b, c):
     a = np.array(a); b = np.array(b); c = np.array(c)
@@ -81,20 +34,75 @@ def _angle(a, b, c):
     return angle
 
 def _land(landmarks, lm_name):
-    p = landmarks[mp_pose.PoseLandmark[lm_name].value]
+    p = landmarks[LANDMARK_INDEX[lm_name]]
     return (p.x, p.y, p.z, p.visibility)
 
-def _range_average_low_high(samples, low_pct=0.3):
-    n = len(samples)
-    if n == 0:
-        return 0.0, 0.0
-    k = max(1, int(np.ceil(n * low_pct)))
-    s_sorted = sorted(samples)
-    low_group = s_sorted[:k]
-    high_group = s_sorted[-k:]
-    avg_low = float(np.mean(low_group)) if low_group else float(np.min(samples))
-    avg_high = float(np.mean(high_group)) if high_group else float(np.max(samples))
-    return avg_low, avg_high
+# ---------- vectorized joint-angle engine ----------
+JOINT_NAMES = list(JOINT_TRIPLES.keys())
+JOINT_INDEX = {j: i for i, j in enumerate(JOINT_NAMES)}
+
+def _mirror_index():
+    # landmark order of the mirror image: every LEFT_* swaps with its RIGHT_* twin
+    swap = lambda n: n.replace("LEFT", "\0").replace("RIGHT", "LEFT").replace("\0", "RIGHT")
+    return [LANDMARK_INDEX[swap(n)] for n in LANDMARK_NAMES]
+
+MIRROR_INDEX = _mirror_index()
+
+def _triple_index_arrays():
+    idx = np.array([[LANDMARK_INDEX[n] for n in JOINT_TRIPLES[j]] for j in JOINT_NAMES],
+                   dtype=np.intp)
+    return idx[:, 0].copy(), idx[:, 1].copy(), idx[:, 2].copy()
+
+TRIPLE_A, TRIPLE_B, TRIPLE_C = _triple_index_arrays()
+
+def _angles_batch(pts, idx_a, idx_b, idx_c, out=None):
+    # same math as _angle(), applied to every (a, b, c) index triple at once
+    b = pts[..., idx_b, :]
+    ab = pts[..., idx_a, :] - b
+    cb = pts[..., idx_c, :] - b
+    radians = np.arctan2(cb[..., 1], cb[..., 0]) - np.arctan2(ab[..., 1], ab[..., 0])
+    angles = np.abs(radians * 180.0 / np.pi, out=out)
+    np.subtract(360.0, angles, out=angles, where=angles > 180)
+    return angles
+
+def joint_angle_series(landmarks, w, h):
+    """(frames, 33, >=2) normalized landmarks -> (frames, len(JOINT_NAMES)) angles,
+    same values as JointAngleEngine / _angle for each frame."""
+    pts = np.asarray(landmarks)[..., :2].astype(np.float64) * np.array([w, h], dtype=np.float64)
+    return _angles_batch(pts, TRIPLE_A, TRIPLE_B, TRIPLE_C)
+
+class JointAngleEngine:
+    """Copies a frame's landmarks into preallocated arrays and computes every
+    JOINT_TRIPLES angle (pixel space, same values as _angle) in one batched call."""
+    def __init__(self):
+        self.landmarks = np.zeros((NUM_LANDMARKS, 4), dtype=np.float64)
+        self.angles = np.zeros(len(JOINT_NAMES), dtype=np.float64)
+        self._pts = np.zeros((NUM_LANDMARKS, 2), dtype=np.float64)
+        self._scale = np.ones(2, dtype=np.float64)
+
+    def load(self, landmarks, mirror=False):
+        """`mirror` turns landmarks of an unflipped frame into those of its mirror
+        image (x -> 1 - x, left/right swapped), the view the tracker works in."""
+        rows = [(p.x, p.y, p.z, p.visibility) for p in landmarks]
+        if mirror:
+            self.landmarks[:] = [rows[i] for i in MIRROR_INDEX]
+            np.subtract(1.0, self.landmarks[:, 0], out=self.landmarks[:, 0])
+        else:
+            self.landmarks[:] = rows
+        return self.landmarks
+
+    def compute(self, landmarks, w, h, mirror=False):
+        self.load(landmarks, mirror)
+        return self.compute_loaded(w, h)
+
+    def compute_loaded(self, w, h):
+        self._scale[0] = w
+        self._scale[1] = h
+        np.multiply(self.landmarks[:, :2], self._scale, out=self._pts)
+        return _angles_batch(self._pts, TRIPLE_A, TRIPLE_B, TRIPLE_C, out=self.angles)
+
+    def angle(self, joint):
+        return float(self.angles[JOINT_INDEX[joint]])
 
 def _iqr(values):
     if not values:
@@ -170,385 +178,506 @@ def _compute_deviation_repwise(rep_averages, opt_min, opt_max, cap_percent=200.0
     deviation = min(max(deviation, 0.0), float(cap_percent))
     return float(round(deviation, 2))
 
-# ---------- main exercise recording for therapist (custom exercise) ----------
-def record_custom_exercise(session_name, camera_index=0, countdown_seconds=3):
-    cap = cv2.VideoCapture(camera_index)
-    if not cap.isOpened():
-        print("Error: cannot open camera")
-        return {}
-
-    joint_samples = {j: [] for j in JOINT_TRIPLES.keys()}
-
-    with mp_pose.Pose(min_detection_confidence=0.6, min_tracking_confidence=0.6) as pose:
-        start_t = time.time()
-        collecting = False
-        countdown_start = None
-
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            frame = cv2.flip(frame, 1)
-            h, w = frame.shape[:2]
-            img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            img.flags.writeable = False
-            res = pose.process(img)
-            img.flags.writeable = True
-            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-
-            if countdown_start is None:
-                countdown_start = time.time()
-
-            elapsed = time.time() - countdown_start
-            remaining = countdown_seconds - int(elapsed)
-            if remaining > 0:
-                cv2.putText(img, f"Starting in {remaining}", (w//2 - 140, h//2),
-                            cv2.FONT_HERSHEY_SIMPLEX, 3.0, (0, 255, 255), 6)
-                cv2.putText(img, "Get ready", (w//2 - 100, h//2 + 80),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1.0, (200, 200, 200), 2)
+# ---------- warm Pose / camera session manager ----------
+POSE_OPTIONS = {"min_detection_confidence": 0.6, "min_tracking_confidence": 0.6}
+IDLE_TIMEOUT_SECONDS = 300.0
+
+class TrackerSession:
+    """Keeps one pre-warmed Pose graph and one open camera alive across sets and
+    exercises. Released explicitly (logout) or after `idle_timeout` seconds unused."""
+    def __init__(self, camera_index=0, idle_timeout=IDLE_TIMEOUT_SECONDS):
+        self.camera_index = camera_index
+        self.idle_timeout = idle_timeout
+        self._pose = None
+        self._camera = None
+        self._lock = threading.RLock()
+        self._idle_timer = None
+        self._in_use = 0
+
+    def warm(self, camera=True):
+        with self._lock:
+            if self._pose is None:
+                self._pose = mp_pose.Pose(**POSE_OPTIONS)
+                # first process() initialises the graph's calculators; pay it now, not on frame one
+                self._pose.process(np.zeros((256, 256, 3), dtype=np.uint8))
+            if camera and (self._camera is None or not self._camera.isOpened()):
+                self._camera = CameraSource(self.camera_index, buffer_size=1)
+            if not self._in_use:
+                self._arm_idle_timer()
+        return self
+
+    @contextmanager
+    def use(self, camera=True):
+        """Lends (pose, camera_source) for one set; camera_source is None when camera=False."""
+        with self._lock:
+            self._cancel_idle_timer()
+            self._in_use += 1
+            try:
+                self.warm(camera=camera)
+            except Exception:
+                self._in_use -= 1
+                raise
+            pose, cam = self._pose, (self._camera if camera else None)
+        try:
+            yield pose, cam
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                if not self._in_use:
+                    self._arm_idle_timer()
+
+    def release(self):
+        with self._lock:
+            self._cancel_idle_timer()
+            if self._camera is not None:
+                self._camera.release()
+                self._camera = None
+            if self._pose is not None:
+                self._pose.close()
+                self._pose = None
+
+    def _release_if_idle(self):
+        with self._lock:
+            if not self._in_use:
+                self.release()
+
+    def _arm_idle_timer(self):
+        self._cancel_idle_timer()
+        if self.idle_timeout:
+            self._idle_timer = threading.Timer(self.idle_timeout, self._release_if_idle)
+            self._idle_timer.daemon = True
+            self._idle_timer.start()
+
+    def _cancel_idle_timer(self):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session(camera_index=0):
+    """Shared TrackerSession used by start_exercise/record_custom_exercise."""
+    global _session
+    with _session_lock:
+        if _session is None or _session.camera_index != camera_index:
+            if _session is not None:
+                _session.release()
+            _session = TrackerSession(camera_index)
+        return _session
+
+def release_session():
+    """Frees the shared Pose graph and camera (call on logout)."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.release()
+            _session = None
+
+@contextmanager
+def _pose_and_source(camera_index, source, session):
+    # session=None -> shared warm session for camera sets; session=False -> old per-call behaviour
+    if session is None and source is None:
+        session = get_session(camera_index)
+    if session:
+        with session.use(camera=source is None) as (pose, cam):
+            if source is None:
+                yield pose, cam
             else:
-                collecting = True
-                cv2.putText(img, f"Recording '{session_name}'", (10, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-
-            if collecting and res.pose_landmarks:
-                lm = res.pose_landmarks.landmark
-
-                def px(name):
-                    p = _land(lm, name)
-                    return (p[0]*w, p[1]*h)
+                # recorded media must not inherit tracking state from the previous set
+                pose.reset()
+                src = open_frame_source(source)
+                try:
+                    yield pose, src
+                finally:
+                    src.release()
+        return
+    src = open_frame_source(camera_index if source is None else source)
+    try:
+        with mp_pose.Pose(**POSE_OPTIONS) as pose:
+            yield pose, src
+    finally:
+        src.release()
+
+# ---------- pose detection (full frame or ROI crop) ----------
+def _make_cropper(roi):
+    if not roi:
+        return None
+    if isinstance(roi, RoiCropper):
+        return roi
+    if roi is True:
+        return RoiCropper()
+    return RoiCropper(max_side=int(roi))
+
+class RgbBuffer:
+    """Reusable model-input buffer: BGR frames are converted into the same RGB
+    array every time instead of a new one. One per inference thread."""
+    def __init__(self):
+        self.buf = None
+
+    def convert(self, bgr):
+        buf = self.buf
+        if buf is None or buf.shape != bgr.shape:
+            buf = self.buf = np.empty(bgr.shape, dtype=np.uint8)
+        buf.flags.writeable = True
+        cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=buf)
+        # read-only input lets the model take the array by reference
+        buf.flags.writeable = False
+        return buf
+
+def _detect_pose(pose, frame, cropper=None, timer=None, key=None, rgb=None):
+    """Runs the model on a BGR frame, or on its ROI crop when a cropper is given,
+    and returns pose_landmarks in full-frame coords. The frame itself is never
+    modified, so overlays can be drawn straight onto it. `rgb` is an optional
+    RgbBuffer; with a StageTimer the colour conversion and model run are timed."""
+    if rgb is None:
+        rgb = RgbBuffer()
+    t0 = clock()
+    if cropper is None:
+        img = rgb.convert(frame)
+        if timer is not None:
+            t0 = timer.add("color", t0, key)
+        pose_landmarks = pose.process(img).pose_landmarks
+        if timer is not None:
+            timer.add("pose", t0, key)
+        return pose_landmarks
+
+    h, w = frame.shape[:2]
+    crop, box = cropper.crop(frame)
+    img = rgb.convert(crop)
+    if timer is not None:
+        t0 = timer.add("color", t0, key)
+    pose_landmarks = pose.process(img).pose_landmarks
+    if pose_landmarks is None and box is not None:
+        # lost the patient inside the crop: retry this frame on the full image
+        box = None
+        pose_landmarks = pose.process(rgb.convert(frame)).pose_landmarks
+    if pose_landmarks is not None:
+        cropper.map_back(pose_landmarks.landmark, box, w, h)
+        cropper.update(pose_landmarks.landmark, w, h)
+    else:
+        cropper.reset()
+    if timer is not None:
+        timer.add("pose", t0, key)
+    return pose_landmarks
 
-                for j, triple in JOINT_TRIPLES.items():
-                    try:
-                        a = px(triple[0]); b = px(triple[1]); c = px(triple[2])
-                        ang = _angle(a, b, c)
-                        ang = float(ang % 180.0)
-                        ang = max(0.0, min(ang, 180.0))
-                        joint_samples[j].append(ang)
-                    except Exception:
-                        pass
+def _make_scheduler(adaptive, tracker):
+    if not adaptive:
+        return None
+    if isinstance(adaptive, AdaptiveScheduler):
+        return adaptive
+    joints = [JOINT_INDEX[tracker.joint]] if tracker.joint in JOINT_INDEX else None
+    return AdaptiveScheduler(joints=joints)
+
+def _open_capture(capture, ex_name, w, h, src, adaptive=False):
+    # "adaptive": predicted frames are not recorded, so replay cannot reproduce the set
+    path = capture if isinstance(capture, (str, os.PathLike)) else landmark_capture_path("session", ex_name)
+    return LandmarkWriter(path, meta={"exercise": ex_name, "width": w, "height": h,
+                                      "fps": getattr(src, "fps", None), "mirrored": True,
+                                      "adaptive": adaptive})
 
-                mp_drawing.draw_landmarks(img, res.pose_landmarks, mp_pose.POSE_CONNECTIONS)
-            else:
-                if not collecting:
-                    pass
-                else:
-                    cv2.putText(img, "No person detected - get visible", (10, 60),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+# ---------- main exercise recording for therapist (custom exercise) ----------
+RECORD_SECONDS = 30
+
+class _SampleBuffer:
+    """Preallocated (frames x joints) angle buffer for a recording; sized from the
+    source fps and doubled only if the camera delivers more frames than that."""
+    def __init__(self, capacity, width):
+        self.t = np.empty(capacity, dtype=np.float64)
+        self.data = np.empty((capacity, width), dtype=np.float64)
+        self.n = 0
+
+    def next_row(self, t):
+        if self.n == len(self.t):
+            self.t = np.concatenate([self.t, np.empty_like(self.t)])
+            self.data = np.concatenate([self.data, np.empty_like(self.data)])
+        self.t[self.n] = t
+        row = self.data[self.n]
+        self.n += 1
+        return row
+
+    def frames(self):
+        return self.t[:self.n], self.data[:self.n]
+
+def record_custom_exercise(session_name, camera_index=0, countdown_seconds=3, source=None, headless=False,
+                           pipelined=False, session=None, roi=False):
+    engine = JointAngleEngine()
+    state = {"start_t": None, "collecting": False}
+    cropper = _make_cropper(roi)
+    rgb = RgbBuffer()
+    # headless recording only needs angles: mirror the landmarks instead of the pixels
+    mirror_landmarks = headless
+
+    with _pose_and_source(camera_index, source, session) as (pose, src):
+        if not src.isOpened():
+            print("Error: cannot open camera")
+            return {}
+        samples = _SampleBuffer(int((countdown_seconds + RECORD_SECONDS + 1) * src.fps), len(JOINT_NAMES))
+
+        def infer(frame, now):
+            h, w = frame.shape[:2]
+            pose_landmarks = _detect_pose(pose, frame, cropper, rgb=rgb)
 
-            cv2.imshow("Record Custom Exercise - RehabAI", img)
+            if state["start_t"] is None:
+                state["start_t"] = now
 
-            key = cv2.waitKey(5) & 0xFF
-            if key == 27:
-                break
-            if time.time() - start_t > (countdown_seconds + 30):
-                break
+            elapsed = now - state["start_t"]
+            remaining = countdown_seconds - int(elapsed)
+            if remaining <= 0:
+                state["collecting"] = True
+            collecting = state["collecting"]
+
+            if collecting and pose_landmarks:
+                row = samples.next_row(elapsed)
+                np.mod(engine.compute(pose_landmarks.landmark, w, h, mirror_landmarks), 180.0, out=row)
+                np.clip(row, 0.0, 180.0, out=row)
+            return frame, pose_landmarks, remaining, collecting, elapsed
+
+        def render(item):
+            frame, pose_landmarks, remaining, collecting, elapsed = item
+            if not headless:
+                _draw_record_overlay(frame, pose_landmarks, session_name, remaining, collecting)
+                cv2.imshow("Record Custom Exercise - RehabAI", frame)
+
+                key = cv2.waitKey(1 if pipelined else 5) & 0xFF
+                if key == 27:
+                    return False
+            return elapsed <= (countdown_seconds + RECORD_SECONDS)
+
+        if pipelined:
+            run_pipelined(src, infer, render, mirror=not mirror_landmarks, pace=None if headless else src.fps)
+        else:
+            run_frames(src, infer, render, mirror=not mirror_landmarks)
 
-    cap.release()
-    cv2.destroyAllWindows()
+    if not headless:
+        cv2.destroyAllWindows()
 
+    t, angles = samples.frames()
     joint_limits = {}
-    for j, samples in joint_samples.items():
-        if samples:
-            mn = float(round(min(samples), 2))
-            mx = float(round(max(samples), 2))
+    if len(t):
+        for j, lo, hi in zip(JOINT_NAMES, angles.min(axis=0).tolist(), angles.max(axis=0).tolist()):
+            mn = float(round(lo, 2))
+            mx = float(round(hi, 2))
             if mn == mx:
                 mn = max(0.0, mn - 1.0)
                 mx = min(180.0, mx + 1.0)
             joint_limits[j] = [mn, mx]
 
     if joint_limits:
-        save_custom_exercise(session_name, joint_limits)
+        save_custom_exercise(session_name, joint_limits, save_trajectory(session_name, t, angles, JOINT_NAMES))
     return joint_limits
 
-# ---------- helper to pick primary joint (largest range) ----------
-def pick_primary_joint_from_limits(joint_limits):
-    if not joint_limits:
-        return None
-    best = None
-    best_range = -1.0
-    for j, (mn, mx) in joint_limits.items():
-        rng = mx - mn
-        if rng > best_range:
-            best = j
-            best_range = rng
-    return best
-
-# ---------- start exercise (supports custom exercises by name) ----------
-def start_exercise(ex_name, target_reps=None, camera_index=0, opt_range=None):
-    ex = ex_name.lower()
-
-    custom_exs = load_custom_exercises()
-    custom_def = None
-    if ex_name in custom_exs:
-        custom_def = custom_exs[ex_name]
+def _draw_record_overlay(img, pose_landmarks, session_name, remaining, collecting):
+    h, w = img.shape[:2]
+    if remaining > 0:
+        cv2.putText(img, f"Starting in {remaining}", (w//2 - 140, h//2),
+                    cv2.FONT_HERSHEY_SIMPLEX, 3.0, (0, 255, 255), 6)
+        cv2.putText(img, "Get ready", (w//2 - 100, h//2 + 80),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.0, (200, 200, 200), 2)
     else:
-        if os.path.exists(DB_FILE):
-            with open(DB_FILE, "r") as f:
-                db = json.load(f)
-            if "exercises" in db and ex_name in db["exercises"]:
-                custom_def = db["exercises"][ex_name]
+        cv2.putText(img, f"Recording '{session_name}'", (10, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
 
-    joint_limits = {}
-    primary_joint = None
-    exercise_opt_range = None
-
-    if custom_def and isinstance(custom_def, dict):
-        joint_limits = custom_def.get("joints", {})
-        primary_joint = pick_primary_joint_from_limits(joint_limits)
-        # If the custom exercise defines an optimal_range, use it as opt_range fallback
-        # optimal_range format (therapist UI stores): {"joint": "LEFT_ELBOW", "min": 20, "max": 150}
-        ex_opt = custom_def.get("optimal_range")
-        if isinstance(ex_opt, dict) and "min" in ex_opt and "max" in ex_opt:
-            try:
-                exercise_opt_range = (float(ex_opt.get("min")), float(ex_opt.get("max")))
-            except Exception:
-                exercise_opt_range = None
+    if collecting and pose_landmarks:
+        mp_drawing.draw_landmarks(img, pose_landmarks, mp_pose.POSE_CONNECTIONS)
+    elif collecting:
+        cv2.putText(img, "No person detected - get visible", (10, 60),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
 
+# ---------- start exercise (supports custom exercises by name) ----------
+def _resolve_exercise(ex_name, opt_range=None):
+    d = exercise_definition(ex_name)
     if opt_range is None:
-        if exercise_opt_range is not None:
-            opt_range = exercise_opt_range
-        elif ex in OPTIMAL_RANGES:
-            opt_range = OPTIMAL_RANGES.get(ex, (0, 0))
-        else:
-            opt_range = (None, None)
-
-    cap = cv2.VideoCapture(camera_index)
-    if not cap.isOpened():
-        print("Error: cannot open camera")
-        return {
-            'reps': 0,
-            'rep_averages': [],
-            'overall_avg': 0.0,
-            'angle_min': 0.0,
-            'angle_max': 0.0,
-            'range_avg_low': 0.0,
-            'range_avg_high': 0.0,
-            'rep_min': 0.0,
-            'rep_max': 0.0,
-            'rep_range': 0.0,
-            'opt_range': opt_range,
-            'deviation_percent': 0.0,
-            'timestamp': datetime.utcnow().isoformat()
-        }
-
-    counter = 0
-    stage = None
-    last_time = time.time()
-    cooldown = 0.4
-
-    rep_angles = []
-    rep_averages = []
-    all_angles = []
-
-    with mp_pose.Pose(min_detection_confidence=0.6, min_tracking_confidence=0.6) as pose:
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            frame = cv2.flip(frame, 1)
-            h, w = frame.shape[:2]
-            img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            img.flags.writeable = False
-            res = pose.process(img)
-            img.flags.writeable = True
-            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-
-            angle_value = None
-            feedback = ""
-            info = ""
-
-            if res.pose_landmarks:
-                lm = res.pose_landmarks.landmark
+        opt_range = d.opt_range
+    return d.joints, d.primary_joint, opt_range, d.meta
 
-                def px(name):
-                    p = _land(lm, name)
-                    return (p[0]*w, p[1]*h)
-
-                try:
-                    if primary_joint:
-                        triple = JOINT_TRIPLES.get(primary_joint)
-                        if triple:
-                            a = px(triple[0]); b = px(triple[1]); c = px(triple[2])
-                            angle_value = _angle(a, b, c)
-                            info = f"{primary_joint} angle: {int(angle_value)}"
-
-                            jlim = joint_limits.get(primary_joint)
-                            if jlim and isinstance(jlim, list) and len(jlim) == 2:
-                                lim_min, lim_max = jlim
-                            else:
-                                lim_min, lim_max = None, None
-
-                            if lim_min is not None and lim_max is not None:
-                                if angle_value > (lim_max - 5):
-                                    if stage == "down":
-                                        stage = "up"
-                                if angle_value < (lim_min + 5):
-                                    if stage == "up":
-                                        if (time.time() - last_time) > cooldown:
-                                            counter += 1
-                                            last_time = time.time()
-                                            if rep_angles:
-                                                rep_avg = float(np.mean(rep_angles))
-                                                rep_averages.append(rep_avg)
-                                                rep_angles = []
-                                        stage = "down"
-                                if stage is None:
-                                    mid = (lim_min + lim_max) / 2.0
-                                    stage = "up" if angle_value > mid else "down"
-
-                                try:
-                                    if lim_min < lim_max:
-                                        if angle_value < lim_min:
-                                            feedback = "Go higher!"
-                                        elif angle_value > lim_max:
-                                            feedback = "Go lower!"
-                                        else:
-                                            feedback = "Good form!"
-                                except Exception:
-                                    feedback = ""
-                            else:
-                                omn, omx = opt_range if opt_range else (None, None)
-                                try:
-                                    if omn is not None and omx is not None:
-                                        if angle_value < omn:
-                                            feedback = "Go higher!"
-                                        elif angle_value > omx:
-                                            feedback = "Go lower!"
-                                        else:
-                                            feedback = "Good form!"
-                                except Exception:
-                                    feedback = ""
-                    else:
-                        # built-in fallback logic (unchanged)
-                        if ex == "squat":
-                            hip = px("LEFT_HIP"); knee = px("LEFT_KNEE"); ankle = px("LEFT_ANKLE")
-                            angle_value = _angle(hip, knee, ankle)
-                            if angle_value > 160:
-                                stage = "up"
-                            if angle_value < 95 and stage == "up":
-                                stage = "down"
-                            if angle_value > 140 and stage == "down" and (time.time()-last_time) > cooldown:
-                                counter += 1
-                                last_time = time.time()
-                                if rep_angles:
-                                    rep_avg = float(np.mean(rep_angles))
-                                    rep_averages.append(rep_avg)
-                                    rep_angles = []
-                                stage = "up"
-                            info = f"Knee angle: {int(angle_value)}"
-
-                        elif ex == "pushup":
-                            shoulder = px("LEFT_SHOULDER"); elbow = px("LEFT_ELBOW"); wrist = px("LEFT_WRIST")
-                            angle_value = _angle(shoulder, elbow, wrist)
-                            if angle_value > 150:
-                                stage = "up"
-                            if angle_value < 90 and stage == "up":
-                                stage = "down"
-                            if angle_value > 140 and stage == "down" and (time.time()-last_time) > cooldown:
-                                counter += 1
-                                last_time = time.time()
-                                if rep_angles:
-                                    rep_avg = float(np.mean(rep_angles))
-                                    rep_averages.append(rep_avg)
-                                    rep_angles = []
-                                stage = "up"
-                            info = f"Elbow angle: {int(angle_value)}"
-
-                        elif ex == "curl":
-                            shoulder = px("LEFT_SHOULDER"); elbow = px("LEFT_ELBOW"); wrist = px("LEFT_WRIST")
-                            angle_value = _angle(shoulder, elbow, wrist)
-                            if angle_value > 150:
-                                stage = "down"
-                            if angle_value < 60 and stage == "down" and (time.time()-last_time) > cooldown:
-                                counter += 1
-                                last_time = time.time()
-                                if rep_angles:
-                                    rep_avg = float(np.mean(rep_angles))
-                                    rep_averages.append(rep_avg)
-                                    rep_angles = []
-                                stage = "up"
-                            info = f"Elbow angle: {int(angle_value)}"
-
-                        elif ex == "raise" or ex == "lateral raise":
-                            hip = px("LEFT_HIP"); shoulder = px("LEFT_SHOULDER"); elbow = px("LEFT_ELBOW")
-                            angle_value = _angle(hip, shoulder, elbow)
-                            if angle_value < 30:
-                                stage = "down"
-                            if angle_value > 75 and stage == "down" and (time.time()-last_time) > cooldown:
-                                counter += 1
-                                last_time = time.time()
-                                if rep_angles:
-                                    rep_avg = float(np.mean(rep_angles))
-                                    rep_averages.append(rep_avg)
-                                    rep_angles = []
-                                stage = "up"
-                            info = f"Shoulder raise angle: {int(angle_value)}"
-
-                        else:
-                            info = "Unknown exercise"
-                except Exception:
-                    info = "Landmarks not fully visible"
-
-                if angle_value is not None:
-                    angle_value = float(angle_value % 180.0)
-                    angle_value = max(0.0, min(angle_value, 180.0))
-
-                    all_angles.append(angle_value)
-                    rep_angles.append(angle_value)
+def _empty_stats(opt_range):
+    return {
+        'reps': 0,
+        'rep_averages': [],
+        'overall_avg': 0.0,
+        'angle_min': 0.0,
+        'angle_max': 0.0,
+        'range_avg_low': 0.0,
+        'range_avg_high': 0.0,
+        'rep_min': 0.0,
+        'rep_max': 0.0,
+        'rep_range': 0.0,
+        'opt_range': opt_range,
+        'deviation_percent': 0.0,
+        'timestamp': datetime.utcnow().isoformat()
+    }
 
-                    opt_min, opt_max = opt_range
+# immutable per-frame view handed from the inference stage to the overlay
+TrackerView = namedtuple("TrackerView", "ex_name counter angle_value info feedback")
+
+class RepTracker:
+    """Rep counting, form feedback and angle bookkeeping for one start_exercise session.
+    Times are whatever clock the frame source reports (seconds)."""
+    def __init__(self, ex_name, joint_limits=None, primary_joint=None, opt_range=(None, None), detector=None,
+                 custom_def=None):
+        self.ex_name = ex_name
+        self.ex = ex_name.lower()
+        self.joint_limits = joint_limits or {}
+        self.primary_joint = primary_joint
+        self.opt_range = opt_range
+        self.engine = JointAngleEngine()
+        if detector is None:
+            detector = detector_for(ex_name, custom_def, primary_joint, self.joint_limits)
+        self.detector = detector
+
+        # joint whose angle drives counting / feedback (None for unknown exercises)
+        if detector is not None:
+            self.joint = detector.joint
+            self.label = detector.label
+        else:
+            self.joint = primary_joint
+            self.label = f"{primary_joint} angle"
+        self.joint_index = JOINT_INDEX.get(self.joint) if self.joint else None
+
+        self.counter = 0
+        self.last_time = None
+
+        # running per-session / per-rep statistics (constant memory, see session_stats.py)
+        self.stats = StreamingAngleStats(low_pct=0.3)
+
+        self.angle_value = None
+        self.feedback = ""
+        self.info = ""
+
+    def snapshot(self):
+        return TrackerView(self.ex_name, self.counter, self.angle_value, self.info, self.feedback)
+
+    def _start(self, now):
+        if self.last_time is None:
+            self.last_time = now
+            if self.detector is not None:
+                self.detector.start(now)
+
+    def _close_rep(self, now):
+        self.counter += 1
+        self.last_time = now
+        self.stats.close_rep()
+
+    def process(self, landmarks, w, h, now, mirror=False):
+        """Feeds one frame's pose landmarks (None when nobody was detected);
+        `mirror` for landmarks of an unflipped frame (see JointAngleEngine.load)."""
+        self._start(now)
+        self.angle_value = None
+        self.feedback = ""
+        self.info = ""
+        if landmarks is None:
+            return None
+        self.engine.compute(landmarks, w, h, mirror)
+        return self._update(now)
+
+    def process_array(self, landmarks, w, h, now):
+        """process() for a (33, 4) x/y/z/visibility array already in the mirrored
+        view (a capture file row or a network packet), or None."""
+        if landmarks is None:
+            return self.process(None, w, h, now)
+        self._start(now)
+        self.engine.landmarks[:] = landmarks
+        self.engine.compute_loaded(w, h)
+        return self._update(now)
+
+    def process_angles(self, now):
+        """Feeds a frame whose joint angles were written straight into engine.angles
+        (e.g. predicted by the adaptive scheduler instead of inferred). Predicted
+        angles drive rep detection and feedback but are not added to the stats."""
+        self._start(now)
+        return self._update(now, predicted=True)
+
+    def _limit_feedback(self, angle_value):
+        # custom exercises: form feedback against the recorded joint limits (or raw opt_range)
+        jlim = self.joint_limits.get(self.primary_joint)
+        if jlim and isinstance(jlim, list) and len(jlim) == 2:
+            lim_min, lim_max = jlim
+            if lim_min < lim_max:
+                if angle_value < lim_min:
+                    return "Go higher!"
+                elif angle_value > lim_max:
+                    return "Go lower!"
+                return "Good form!"
+            return ""
+        omn, omx = self.opt_range if self.opt_range else (None, None)
+        if omn is not None and omx is not None:
+            if angle_value < omn:
+                return "Go higher!"
+            elif angle_value > omx:
+                return "Go lower!"
+            return "Good form!"
+        return ""
+
+    def _update(self, now, predicted=False):
+        angle_value = None
+        feedback = ""
+        info = ""
+
+        try:
+            if self.joint_index is not None:
+                angle_value = float(self.engine.angles[self.joint_index])
+                info = f"{self.label}: {int(angle_value)}"
+                detector = self.detector
+                if detector is not None and detector.update(angle_value, now):
+                    self._close_rep(now)
+                if self.primary_joint:
                     try:
-                        if opt_min is not None and opt_max is not None:
-                            opt_min_f = float(opt_min)
-                            opt_max_f = float(opt_max)
-                            opt_min_f = max(0.0, min(opt_min_f, 180.0))
-                            opt_max_f = max(0.0, min(opt_max_f, 180.0))
-                            if opt_min_f < opt_max_f:
-                                if angle_value < opt_min_f:
-                                    feedback = "Go higher!"
-                                elif angle_value > opt_max_f:
-                                    feedback = "Go lower!"
-                                else:
-                                    feedback = "Good form!"
+                        feedback = self._limit_feedback(angle_value)
                     except Exception:
-                        pass
-
-                mp_drawing.draw_landmarks(img, res.pose_landmarks, mp_pose.POSE_CONNECTIONS)
-                cv2.putText(img, f"{ex_name.upper()}  Reps: {counter}", (10, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-                if angle_value is not None:
-                    cv2.putText(img, info, (10, 60),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
-                    if feedback:
-                        cv2.putText(img, feedback, (10, 100),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 200, 255), 2)
-            else:
-                cv2.putText(img, "No person detected", (10, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-
-            cv2.imshow("RehabAI Exercise Tracker", img)
-
-            if target_reps is not None and counter >= target_reps:
-                break
+                        feedback = ""
+            elif not self.primary_joint:
+                info = "Unknown exercise"
+        except Exception:
+            info = "Landmarks not fully visible"
+
+        if angle_value is not None:
+            if not predicted:
+                angle_value = float(angle_value % 180.0)
+            angle_value = max(0.0, min(angle_value, 180.0))
+
+            # extrapolated guesses stay out of the stored min/max/deviation
+            if not predicted:
+                self.stats.add(angle_value)
+
+            opt_min, opt_max = self.opt_range
+            try:
+                if opt_min is not None and opt_max is not None:
+                    opt_min_f = float(opt_min)
+                    opt_max_f = float(opt_max)
+                    opt_min_f = max(0.0, min(opt_min_f, 180.0))
+                    opt_max_f = max(0.0, min(opt_max_f, 180.0))
+                    if opt_min_f < opt_max_f:
+                        if angle_value < opt_min_f:
+                            feedback = "Go higher!"
+                        elif angle_value > opt_max_f:
+                            feedback = "Go lower!"
+                        else:
+                            feedback = "Good form!"
+            except Exception:
+                pass
 
-            key = cv2.waitKey(5) & 0xFF
-            if key == 27:
-                break
+        self.angle_value = angle_value
+        self.feedback = feedback
+        self.info = info
+        return angle_value
 
-    cap.release()
-    cv2.destroyAllWindows()
+    def summary(self):
+        return summarize_session(self.stats, self.counter, self.opt_range)
 
-    if rep_angles:
-        rep_averages.append(float(np.mean(rep_angles)))
+def summarize_session(st, reps, opt_range):
+    """Stats dict (the start_exercise result) from a StreamingAngleStats and a rep count."""
+    rep_averages = list(st.rep_averages)
+    pending = st.pending_rep_average()
+    if pending is not None:
+        rep_averages.append(pending)
 
-    norm_angles = [float(a % 180.0) for a in all_angles] if all_angles else []
-    norm_angles = [max(0.0, min(a, 180.0)) for a in norm_angles]
-    overall_avg = float(round(np.mean(norm_angles), 2)) if norm_angles else 0.0
-    angle_min = float(round(min(norm_angles), 2)) if norm_angles else 0.0
-    angle_max = float(round(max(norm_angles), 2)) if norm_angles else 0.0
+    # angles were normalised to [0, 180) when added, so no re-clamping pass is needed
+    overall_avg = float(round(st.mean(), 2)) if st.count else 0.0
+    angle_min = float(round(st.min, 2)) if st.count else 0.0
+    angle_max = float(round(st.max, 2)) if st.count else 0.0
 
-    range_avg_low, range_avg_high = _range_average_low_high(norm_angles, low_pct=0.3)
+    range_avg_low, range_avg_high = st.low_high_averages()
     range_avg_low = float(round(range_avg_low, 2))
     range_avg_high = float(round(range_avg_high, 2))
 
@@ -560,7 +689,7 @@ def start_exercise(ex_name, target_reps=None, camera_index=0, opt_range=None):
     deviation = _compute_deviation_repwise(rep_averages, opt_min, opt_max, cap_percent=200.0)
 
     return {
-        'reps': int(counter),
+        'reps': int(reps),
         'rep_averages': [float(round(a, 2)) for a in rep_averages],
         'overall_avg': overall_avg,
         'angle_min': angle_min,
@@ -574,3 +703,129 @@ def start_exercise(ex_name, target_reps=None, camera_index=0, opt_range=None):
         'deviation_percent': float(round(deviation, 2)),
         'timestamp': datetime.utcnow().isoformat()
     }
+
+def _draw_timing_overlay(img, timer):
+    cv2.putText(img, timer.overlay_text(), (10, img.shape[0] - 12),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.55, (255, 255, 255), 1)
+
+def _draw_tracker_overlay(img, pose_landmarks, view):
+    if pose_landmarks:
+        mp_drawing.draw_landmarks(img, pose_landmarks, mp_pose.POSE_CONNECTIONS)
+        cv2.putText(img, f"{view.ex_name.upper()}  Reps: {view.counter}", (10, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+        if view.angle_value is not None:
+            cv2.putText(img, view.info, (10, 60),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+            if view.feedback:
+                cv2.putText(img, view.feedback, (10, 100),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 200, 255), 2)
+    else:
+        cv2.putText(img, "No person detected", (10, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+
+def start_exercise(ex_name, target_reps=None, camera_index=0, opt_range=None, source=None, headless=False,
+                   pipelined=False, session=None, roi=False, adaptive=False, capture=None, profile=False):
+    """Runs one set. `source` may be a camera index, video path, image directory,
+    FrameSource or iterable of BGR frames (defaults to camera_index); `headless`
+    skips all drawing and window calls; `pipelined` runs capture, inference and
+    display on separate threads joined by bounded drop-oldest queues. Camera sets
+    reuse the shared warm TrackerSession unless `session` is given (False = none).
+    `roi` (True, a max crop side in pixels, or a RoiCropper) runs the model on a
+    crop around the previous frame's landmarks. `adaptive` (True or an
+    AdaptiveScheduler) skips inference while the tracked joint moves slowly and
+    adds frames_total/frames_inferred/inference_fraction to the stats. `capture`
+    (a path, or True for an auto-named file under landmarks/) records every
+    inferred frame's landmarks via a background LandmarkWriter; the file is
+    returned as stats['landmark_file'] (marked "adaptive" when predicted frames
+    are missing from it, which replay then refuses). `profile` (True, a JSONL path for per-frame
+    spans, or a StageTimer) times every stage of the loop, shows an FPS/latency
+    overlay and adds a per-stage summary as stats['timing']."""
+    joint_limits, primary_joint, opt_range, custom_def = _resolve_exercise(ex_name, opt_range)
+    tracker = RepTracker(ex_name, joint_limits, primary_joint, opt_range, custom_def=custom_def)
+    cropper = _make_cropper(roi)
+    scheduler = _make_scheduler(adaptive, tracker)
+    timer = make_timer(profile)
+    rgb = RgbBuffer()
+    # headless sets only need angles: mirror the landmarks instead of the pixels
+    mirror_landmarks = headless
+    last = {"pose_landmarks": None}
+    writer = {"w": None}
+
+    with _pose_and_source(camera_index, source, session) as (pose, src):
+        if not src.isOpened():
+            print("Error: cannot open camera")
+            return _empty_stats(opt_range)
+
+        def infer(frame, now):
+            if target_reps is not None and tracker.counter >= target_reps:
+                return None
+            if scheduler is not None and not scheduler.should_infer(now):
+                t0 = clock()
+                scheduler.predict(now, tracker.engine.angles)
+                tracker.process_angles(now)
+                if timer is not None:
+                    timer.add("logic", t0, now)
+                return frame, last["pose_landmarks"], tracker.snapshot(), now
+
+            h, w = frame.shape[:2]
+            pose_landmarks = _detect_pose(pose, frame, cropper, timer, now, rgb)
+            t0 = clock()
+            tracker.process(pose_landmarks.landmark if pose_landmarks else None, w, h, now, mirror_landmarks)
+            if capture:
+                if writer["w"] is None:
+                    writer["w"] = _open_capture(capture, ex_name, w, h, src, adaptive=scheduler is not None)
+                writer["w"].append(now, tracker.engine.landmarks if pose_landmarks else None)
+            if scheduler is not None:
+                scheduler.observe(tracker.engine.angles if pose_landmarks else None, now)
+                last["pose_landmarks"] = pose_landmarks
+            if timer is not None:
+                timer.add("logic", t0, now)
+            return frame, pose_landmarks, tracker.snapshot(), now
+
+        def render(item):
+            if item is None:
+                return False
+            frame, pose_landmarks, view, now = item
+            if not headless:
+                t0 = clock()
+                _draw_tracker_overlay(frame, pose_landmarks, view)
+                if timer is not None:
+                    _draw_timing_overlay(frame, timer)
+                cv2.imshow("RehabAI Exercise Tracker", frame)
+                if timer is not None:
+                    timer.add("draw", t0, now)
+
+            keep_going = target_reps is None or view.counter < target_reps
+            if keep_going and not headless:
+                t0 = clock()
+                key = cv2.waitKey(1 if pipelined else 5) & 0xFF
+                if timer is not None:
+                    timer.add("wait_key", t0, now)
+                keep_going = key != 27
+            if timer is not None:
+                timer.end_frame(now)
+            return keep_going
+
+        try:
+            if pipelined:
+                run_pipelined(src, infer, render, mirror=not mirror_landmarks,
+                              pace=None if headless else src.fps, timer=timer)
+            else:
+                run_frames(src, infer, render, mirror=not mirror_landmarks, timer=timer)
+        finally:
+            if writer["w"] is not None:
+                writer["w"].close()
+            if timer is not None:
+                timer.close()
+
+    if not headless:
+        cv2.destroyAllWindows()
+
+    stats = tracker.summary()
+    if scheduler is not None:
+        stats.update(scheduler.stats())
+    if writer["w"] is not None:
+        stats['landmark_file'] = writer["w"].path
+    if timer is not None:
+        stats['timing'] = timer.summary()
+    return stats
@@ -0,0 +1,134 @@
+# frame_sources.py
+import os
+import time
+import cv2
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".bmp")
+DEFAULT_FPS = 30.0
+
+# ---------- frame sources ----------
+# Every source yields (ok, frame_bgr, timestamp_seconds) from read().
+# Timestamps drive rep cooldowns, so recorded media uses media time
+# (frame index / fps) and can be processed faster than real time.
+class FrameSource:
+    """Base class for anything the tracker can pull BGR frames from."""
+    live = False
+    # True when every read() returns a fresh array the tracker may modify in place
+    owns_frames = False
+    fps = DEFAULT_FPS
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        return False, None, 0.0
+
+    def release(self):
+        pass
+
+    def __iter__(self):
+        while self.isOpened():
+            ok, frame, ts = self.read()
+            if not ok:
+                break
+            yield frame, ts
+
+class CameraSource(FrameSource):
+    live = True
+    owns_frames = True
+
+    def __init__(self, camera_index=0, buffer_size=None):
+        self.cap = cv2.VideoCapture(camera_index)
+        if buffer_size and self.cap.isOpened():
+            # keep the driver queue short so frames are fresh after an idle gap between sets
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if self.cap.isOpened() else 0.0
+        self.fps = fps if fps and fps > 1.0 else DEFAULT_FPS
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        ret, frame = self.cap.read()
+        return ret, frame, time.monotonic()
+
+    def release(self):
+        self.cap.release()
+
+class VideoFileSource(FrameSource):
+    owns_frames = True
+    def __init__(self, path):
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if self.cap.isOpened() else 0.0
+        self.fps = fps if fps and fps > 1.0 else DEFAULT_FPS
+        self.index = 0
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        ret, frame = self.cap.read()
+        ts = self.index / self.fps
+        self.index += 1
+        return ret, frame, ts
+
+    def release(self):
+        self.cap.release()
+
+class ImageSequenceSource(FrameSource):
+    owns_frames = True
+    def __init__(self, directory, fps=DEFAULT_FPS):
+        self.directory = directory
+        self.fps = fps
+        self.files = sorted(f for f in os.listdir(directory) if f.lower().endswith(IMAGE_EXTS))
+        self.index = 0
+
+    def isOpened(self):
+        return self.index < len(self.files)
+
+    def read(self):
+        while self.index < len(self.files):
+            frame = cv2.imread(os.path.join(self.directory, self.files[self.index]))
+            ts = self.index / self.fps
+            self.index += 1
+            if frame is not None:
+                return True, frame, ts
+        return False, None, 0.0
+
+class IterableSource(FrameSource):
+    """Wraps an in-memory iterable of BGR frames (or (frame, timestamp) pairs)."""
+    def __init__(self, frames, fps=DEFAULT_FPS):
+        self.fps = fps
+        self._it = iter(frames)
+        self.index = 0
+        self._done = False
+
+    def isOpened(self):
+        return not self._done
+
+    def read(self):
+        try:
+            item = next(self._it)
+        except StopIteration:
+            self._done = True
+            return False, None, 0.0
+        if isinstance(item, tuple):
+            frame, ts = item
+        else:
+            frame, ts = item, self.index / self.fps
+        self.index += 1
+        return True, frame, ts
+
+def open_frame_source(source=0):
+    """Builds a FrameSource from a camera index, a video file, an image directory,
+    an existing FrameSource or any iterable of frames."""
+    if isinstance(source, FrameSource):
+        return source
+    if isinstance(source, int):
+        return CameraSource(source)
+    if isinstance(source, (str, os.PathLike)):
+        if os.path.isdir(source):
+            return ImageSequenceSource(source)
+        return VideoFileSource(os.fspath(source))
+    return IterableSource(source)
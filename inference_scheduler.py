@@ -0,0 +1,69 @@
+# inference_scheduler.py
+import numpy as np
+
+# ---------- adaptive pose-inference rate ----------
+# After every inferred frame the angular velocity of the tracked joints is
+# measured against the previous inferred frame. Slow movement earns a budget of
+# skipped frames (up to max_skip); fast movement, or losing the patient, drops
+# the budget to zero. Skipped frames get joint angles extrapolated linearly from
+# the last two inferred frames, so rep counting and cooldowns see one continuous
+# angle stream.
+class AdaptiveScheduler:
+    """Decides per frame whether to run pose inference and predicts the joint
+    angles of frames it skips."""
+    def __init__(self, max_skip=3, slow_dps=45.0, fast_dps=240.0, joints=None):
+        self.max_skip = int(max_skip)
+        self.slow_dps = float(slow_dps)
+        self.fast_dps = float(fast_dps)
+        self.joints = joints  # indices into the angle vector to watch (None = all)
+        self.last_angles = None
+        self.last_t = None
+        self.velocity = None
+        self.skip_left = 0
+        self.frames = 0
+        self.inferred = 0
+
+    def should_infer(self, now):
+        self.frames += 1
+        if self.skip_left > 0 and self.last_angles is not None:
+            self.skip_left -= 1
+            return False
+        self.inferred += 1
+        return True
+
+    def observe(self, angles, now):
+        """Records the angles of an inferred frame (None when nobody was detected)."""
+        if angles is None:
+            self.last_angles = None
+            self.velocity = None
+            self.skip_left = 0
+            return
+        if self.last_angles is not None and now > self.last_t:
+            velocity = (angles - self.last_angles) / (now - self.last_t)
+        else:
+            velocity = np.zeros_like(angles)
+        self.velocity = velocity
+        self.last_angles = np.array(angles, dtype=np.float64)
+        self.last_t = now
+
+        watched = velocity if self.joints is None else velocity[self.joints]
+        speed = float(np.max(np.abs(watched))) if watched.size else 0.0
+        if self.fast_dps > self.slow_dps:
+            frac = (self.fast_dps - speed) / (self.fast_dps - self.slow_dps)
+        else:
+            frac = 0.0 if speed > self.slow_dps else 1.0
+        self.skip_left = int(round(self.max_skip * min(1.0, max(0.0, frac))))
+
+    def predict(self, now, out):
+        """Writes extrapolated angles for a skipped frame into `out`."""
+        np.multiply(self.velocity, now - self.last_t, out=out)
+        out += self.last_angles
+        np.clip(out, 0.0, 180.0, out=out)
+        return out
+
+    def stats(self):
+        return {
+            'frames_total': int(self.frames),
+            'frames_inferred': int(self.inferred),
+            'inference_fraction': float(round(self.inferred / self.frames, 4)) if self.frames else 1.0
+        }
@@ -0,0 +1,124 @@
+# landmark_loadgen.py
+# Loopback load generator for landmark_service.py: many concurrent client
+# sessions streaming synthetic landmarks in real time, reporting throughput and
+# rep-event latency as JSON.
+#   python landmark_loadgen.py [--sessions 200] [--seconds 10] [--fps 30] [--exercise curl]
+#                              [--host 127.0.0.1] [--port 8765] [--spawn-server]
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+from landmark_service import (LandmarkService, JSON_MSG, encode_frame, encode_json, read_message)
+from tracker_bench import synthetic_stream, FRAME_W, FRAME_H
+
+def stream_arrays(exercise, seconds, fps, seed):
+    """Synthetic stream as (33, 4) float32 arrays (None for dropped frames)."""
+    out = []
+    for lm in synthetic_stream(exercise, seconds, fps, seed=seed):
+        if lm is None:
+            out.append(None)
+        else:
+            out.append(np.array([(p.x, p.y, p.z, p.visibility) for p in lm.landmark], dtype=np.float32))
+    return out
+
+async def run_client(host, port, exercise, frames, fps, patient=None, realtime=True):
+    """One session: streams `frames` at `fps` and collects the server's events.
+    Rep latency is measured from sending a frame to receiving the rep it completed."""
+    reader, writer = await asyncio.open_connection(host, port)
+    sent_at = {}
+    result = {"reps": 0, "feedback_events": 0, "rep_latency": [], "summary": None, "error": None}
+
+    async def receive():
+        while True:
+            msg = await read_message(reader)
+            if msg is None:
+                return
+            kind, ev = msg
+            if kind != JSON_MSG:
+                continue
+            if ev["type"] == "rep":
+                result["reps"] = ev["count"]
+                if ev["t"] in sent_at:
+                    result["rep_latency"].append(time.perf_counter() - sent_at[ev["t"]])
+            elif ev["type"] == "feedback":
+                result["feedback_events"] += 1
+            elif ev["type"] == "summary":
+                result["summary"] = ev["stats"]
+                return
+            elif ev["type"] == "error":
+                result["error"] = ev["message"]
+                return
+
+    receiver = asyncio.ensure_future(receive())
+    writer.write(encode_json({"type": "start", "patient": patient, "exercise": exercise,
+                              "width": FRAME_W, "height": FRAME_H}))
+    t0 = time.perf_counter()
+    for i, lm in enumerate(frames):
+        t = i / fps
+        if realtime:
+            delay = t0 + t - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        sent_at[t] = time.perf_counter()
+        writer.write(encode_frame(t, lm))
+        await writer.drain()
+        if receiver.done():
+            break
+    writer.write(encode_json({"type": "end"}))
+    await writer.drain()
+    await receiver
+    writer.close()
+    return result
+
+async def run_load(host, port, sessions, seconds, fps, exercise, realtime=True):
+    streams = [stream_arrays(exercise, seconds, fps, seed) for seed in range(min(sessions, 8))]
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*[
+        run_client(host, port, exercise, streams[i % len(streams)], fps, realtime=realtime)
+        for i in range(sessions)])
+    wall = time.perf_counter() - t0
+    lat = np.array([x for r in results for x in r["rep_latency"]]) * 1000.0
+    frames = sessions * int(seconds * fps)
+    return {
+        "sessions": sessions,
+        "frames": frames,
+        "wall_s": round(wall, 3),
+        "frames_per_s": round(frames / wall, 1) if wall else None,
+        "errors": sum(1 for r in results if r["error"] or r["summary"] is None),
+        "reps_per_session": sorted({r["reps"] for r in results}),
+        "rep_latency_ms": {"p50": round(float(np.percentile(lat, 50)), 3),
+                           "p95": round(float(np.percentile(lat, 95)), 3),
+                           "p99": round(float(np.percentile(lat, 99)), 3)} if lat.size else None,
+    }
+
+async def _main(args):
+    server = None
+    if args.spawn_server:
+        service = LandmarkService(persist=False)
+        server = await asyncio.start_server(service.handle, args.host, args.port)
+    try:
+        report = await run_load(args.host, args.port, args.sessions, args.seconds, args.fps, args.exercise,
+                                realtime=not args.flood)
+    finally:
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+            service.close()
+    print(json.dumps(report, indent=2))
+
+def main():
+    ap = argparse.ArgumentParser(description="Load generator for the landmark-ingest service.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--sessions", type=int, default=200)
+    ap.add_argument("--seconds", type=float, default=10.0)
+    ap.add_argument("--fps", type=float, default=30.0)
+    ap.add_argument("--exercise", default="curl", choices=["squat", "curl", "raise"])
+    ap.add_argument("--flood", action="store_true", help="send as fast as possible instead of in real time")
+    ap.add_argument("--spawn-server", action="store_true", help="run a non-persisting service in this process")
+    args = ap.parse_args()
+    asyncio.run(_main(args))
+
+if __name__ == "__main__":
+    main()
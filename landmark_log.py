@@ -0,0 +1,182 @@
+# landmark_log.py
+import json
+import os
+import queue
+import re
+import threading
+from datetime import datetime
+import numpy as np
+
+# ---------- compact binary landmark capture ----------
+# File layout (little endian, memory-mappable):
+#   [0, HEADER_SIZE)  b"RHLM" + uint32 version + uint32 json length + JSON metadata, zero padded
+#   records           RECORD_DTYPE rows: float64 timestamp + float32[33, 4] (x, y, z, visibility)
+# Landmarks are full-frame normalized coordinates of the mirrored frame, exactly
+# what the tracker used; frames without a detection are stored as NaN rows so
+# timestamps (and therefore cooldowns) stay complete.
+MAGIC = b"RHLM"
+VERSION = 1
+HEADER_SIZE = 4096
+NUM_LANDMARKS = 33
+RECORD_DTYPE = np.dtype([("t", "<f8"), ("lm", "<f4", (NUM_LANDMARKS, 4))])
+CHUNK_FRAMES = 64
+LANDMARKS_DIR = "landmarks"
+# capture is opt-in; only the newest KEEP_CAPTURES files per patient are kept
+#   REHABAI_CAPTURE_LANDMARKS  1/true/yes/on to record each set (default off)
+#   REHABAI_LANDMARK_KEEP      captures kept per patient (default 50, 0 = keep all)
+CAPTURE_ENV = "REHABAI_CAPTURE_LANDMARKS"
+KEEP_ENV = "REHABAI_LANDMARK_KEEP"
+KEEP_CAPTURES = 50
+
+def _safe(s):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", str(s))
+
+def capture_enabled():
+    return os.environ.get(CAPTURE_ENV, "").strip().lower() in ("1", "true", "yes", "on")
+
+def captures_to_keep():
+    try:
+        return max(0, int(os.environ.get(KEEP_ENV, KEEP_CAPTURES)))
+    except ValueError:
+        return KEEP_CAPTURES
+
+def landmark_capture_path(username, ex_name, base_dir=None):
+    """Default capture file for one set, in a landmarks/ folder next to the DB."""
+    base = base_dir if base_dir is not None else LANDMARKS_DIR
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    return os.path.join(base, _safe(username), f"{_safe(ex_name)}_{stamp}.lmk")
+
+def prune_captures(username, keep=None, base_dir=None):
+    """Deletes all but the `keep` newest capture files of a patient (default
+    REHABAI_LANDMARK_KEEP). Sessions whose file is gone are re-scored from their
+    stored rep averages. Returns the removed paths."""
+    keep = captures_to_keep() if keep is None else keep
+    if not keep:
+        return []
+    folder = os.path.join(base_dir if base_dir is not None else LANDMARKS_DIR, _safe(username))
+    try:
+        names = [n for n in os.listdir(folder) if n.endswith(".lmk")]
+    except FileNotFoundError:
+        return []
+    paths = sorted((os.path.join(folder, n) for n in names), key=os.path.getmtime)
+    removed = []
+    for path in paths[:-keep]:
+        try:
+            os.remove(path)
+            removed.append(path)
+        except FileNotFoundError:
+            pass
+    return removed
+
+class LandmarkWriter:
+    """Buffers per-frame landmarks into fixed-size chunks and appends them to disk
+    from a background thread, so the frame loop never waits on file I/O."""
+    def __init__(self, path, meta=None, chunk_frames=CHUNK_FRAMES):
+        self.path = path
+        self.meta = dict(meta or {})
+        self.meta.setdefault("created", datetime.utcnow().isoformat())
+        self.chunk_frames = chunk_frames
+        self.frames = 0
+        self._chunk = np.empty(chunk_frames, dtype=RECORD_DTYPE)
+        self._fill = 0
+        self._queue = queue.Queue()
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._f = open(path, "wb")
+        self._f.write(_encode_header(self.meta))
+        self._thread = threading.Thread(target=self._run, name="landmark-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, t, landmarks):
+        """Records one frame; `landmarks` is a (33, 4) array or None (not detected)."""
+        row = self._chunk[self._fill]
+        row["t"] = t
+        if landmarks is None:
+            row["lm"] = np.nan
+        else:
+            row["lm"] = landmarks
+        self._fill += 1
+        self.frames += 1
+        if self._fill == self.chunk_frames:
+            self._queue.put(self._chunk)
+            self._chunk = np.empty(self.chunk_frames, dtype=RECORD_DTYPE)
+            self._fill = 0
+
+    def close(self):
+        if self._f is None:
+            return
+        if self._fill:
+            self._queue.put(self._chunk[:self._fill])
+            self._fill = 0
+        self._queue.put(None)
+        self._thread.join()
+        self._f.close()
+        self._f = None
+
+    def _run(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            self._f.write(chunk.tobytes())
+            self._f.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _encode_header(meta):
+    body = json.dumps(meta).encode("utf-8")
+    if 12 + len(body) > HEADER_SIZE:
+        raise ValueError("landmark file metadata too large")
+    head = MAGIC + np.array([VERSION, len(body)], dtype="<u4").tobytes() + body
+    return head + b"\0" * (HEADER_SIZE - len(head))
+
+def read_meta(path):
+    with open(path, "rb") as f:
+        head = f.read(HEADER_SIZE)
+    if head[:4] != MAGIC:
+        raise ValueError(f"{path} is not a landmark capture file")
+    version, length = np.frombuffer(head[4:12], dtype="<u4")
+    if version != VERSION:
+        raise ValueError(f"unsupported landmark file version {version}")
+    return json.loads(head[12:12 + int(length)].decode("utf-8"))
+
+class LandmarkSession:
+    """Read-only, memory-mapped view of one capture file. Nothing is loaded until
+    it is indexed; a partially written trailing record is ignored."""
+    def __init__(self, path):
+        self.path = path
+        self.meta = read_meta(path)
+        n = max(0, (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize)
+        if n:
+            self.records = np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(n,))
+        else:
+            self.records = np.empty(0, dtype=RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def timestamps(self):
+        return self.records["t"]
+
+    @property
+    def landmarks(self):
+        return self.records["lm"]
+
+    def detected(self):
+        """Boolean mask of frames that have landmarks."""
+        return ~np.isnan(self.records["lm"][:, 0, 0])
+
+    def chunks(self, size=4096):
+        """Yields (timestamps, landmarks) slices without touching the rest of the file."""
+        for i in range(0, len(self.records), size):
+            part = self.records[i:i + size]
+            yield part["t"], part["lm"]
+
+def open_session(path):
+    return LandmarkSession(path)
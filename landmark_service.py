@@ -0,0 +1,194 @@
+# landmark_service.py
+# Central landmark-ingest service: thin client stations run the pose model and
+# stream per-frame landmarks here; this box does rep counting, feedback,
+# deviation scoring and persistence, one RepTracker per connection.
+#   python landmark_service.py [--host 127.0.0.1] [--port 8765] [--no-persist]
+import argparse
+import asyncio
+import json
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from exercise_defs import (DB_FILE, NUM_LANDMARKS, OPTIMAL_RANGES, definition_from_meta, load_custom_exercises,
+                           resolve_opt_range)
+from rehab_db import Repository, store_from_env
+
+# ---------- wire format ----------
+# Every message is a 4-byte big-endian length followed by that many bytes; the
+# first byte of the body is the message type:
+#   b"J" + UTF-8 JSON    control messages and events, both directions
+#   b"F" + FRAME_STRUCT  one frame, client -> server
+# Client: {"type": "start", "patient", "exercise", "target_reps", "width", "height"},
+#         frames..., {"type": "end"}
+# Server: {"type": "ready"}, {"type": "rep", "count", "t"},
+#         {"type": "feedback", "text", "t"} (on change), {"type": "summary", "stats"},
+#         {"type": "error", "message"}
+# Frame: float64 timestamp (seconds), uint8 detected, float32[33, 4] mirrored-view
+# normalized landmarks (x, y, z, visibility); ignored when detected == 0.
+FRAME_STRUCT = struct.Struct("<dB")
+LANDMARK_BYTES = NUM_LANDMARKS * 4 * 4
+MAX_MESSAGE = 1 << 20
+JSON_MSG = b"J"
+FRAME_MSG = b"F"
+
+def encode_json(obj):
+    body = JSON_MSG + json.dumps(obj).encode("utf-8")
+    return struct.pack(">I", len(body)) + body
+
+def encode_frame(t, landmarks):
+    """Frame message for a (33, 4) landmark array, or None when nothing was detected."""
+    if landmarks is None:
+        body = FRAME_MSG + FRAME_STRUCT.pack(t, 0) + bytes(LANDMARK_BYTES)
+    else:
+        body = FRAME_MSG + FRAME_STRUCT.pack(t, 1) + np.asarray(landmarks, dtype="<f4").tobytes()
+    return struct.pack(">I", len(body)) + body
+
+async def read_message(reader):
+    """(kind, payload) where payload is a dict for JSON messages or
+    (t, landmarks or None) for frames; None at end of stream."""
+    try:
+        head = await reader.readexactly(4)
+    except asyncio.IncompleteReadError:
+        return None
+    (n,) = struct.unpack(">I", head)
+    if n == 0 or n > MAX_MESSAGE:
+        raise ValueError(f"bad message length {n}")
+    body = await reader.readexactly(n)
+    kind = body[:1]
+    if kind == JSON_MSG:
+        return kind, json.loads(body[1:].decode("utf-8"))
+    if kind == FRAME_MSG:
+        if n != 1 + FRAME_STRUCT.size + LANDMARK_BYTES:
+            raise ValueError("bad frame size")
+        t, detected = FRAME_STRUCT.unpack_from(body, 1)
+        lm = None
+        if detected:
+            lm = np.frombuffer(body, dtype="<f4", count=NUM_LANDMARKS * 4,
+                               offset=1 + FRAME_STRUCT.size).reshape(NUM_LANDMARKS, 4)
+        return kind, (t, lm)
+    raise ValueError(f"unknown message type {kind!r}")
+
+# ---------- service ----------
+class LandmarkService:
+    """asyncio TCP server; each connection is one set. Rep/feedback logic is the
+    same RepTracker start_exercise uses, fed with the client's landmarks."""
+    def __init__(self, db_file=DB_FILE, persist=True):
+        self.db_file = db_file
+        self.repo = Repository(db_file, store=store_from_env(db_file))
+        self.persist = persist
+        self.sessions = 0
+        self.active = 0
+        self.frames = 0
+        # DB writes are blocking file I/O: one background thread, so they are also serialized
+        self._db_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="landmark-service-db")
+
+    async def handle(self, reader, writer):
+        self.sessions += 1
+        self.active += 1
+        try:
+            await self._run_session(reader, writer)
+        except (ValueError, KeyError, TypeError) as e:
+            writer.write(encode_json({"type": "error", "message": str(e)}))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.active -= 1
+            try:
+                await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _run_session(self, reader, writer):
+        msg = await read_message(reader)
+        if msg is None:
+            return
+        kind, start = msg
+        if kind != JSON_MSG or start.get("type") != "start":
+            raise ValueError("expected a start message")
+        ex = start["exercise"]
+        w, h = int(start["width"]), int(start["height"])
+        target_reps = start.get("target_reps")
+        # reads exercises.json / the DB: keep it off the event loop
+        joint_limits, primary_joint, opt_range, custom_def = await asyncio.get_running_loop().run_in_executor(
+            None, self._resolve, start.get("patient"), ex, start.get("opt_range"))
+        from exercise_tracker import RepTracker
+        tracker = RepTracker(ex, joint_limits, primary_joint, opt_range, custom_def=custom_def)
+        writer.write(encode_json({"type": "ready", "joint": tracker.joint, "opt_range": opt_range}))
+
+        last_feedback = ""
+        while True:
+            msg = await read_message(reader)
+            if msg is None:
+                break
+            kind, payload = msg
+            if kind == JSON_MSG:
+                if payload.get("type") == "end":
+                    break
+                continue
+            t, lm = payload
+            self.frames += 1
+            reps = tracker.counter
+            tracker.process_array(lm, w, h, t)
+            if tracker.counter != reps:
+                writer.write(encode_json({"type": "rep", "count": tracker.counter, "t": t}))
+            if tracker.feedback != last_feedback:
+                last_feedback = tracker.feedback
+                writer.write(encode_json({"type": "feedback", "text": last_feedback, "t": t}))
+            if writer.transport.get_write_buffer_size() > 65536:
+                await writer.drain()
+            if target_reps is not None and tracker.counter >= target_reps:
+                break
+
+        stats = tracker.summary()
+        if self.persist and start.get("patient"):
+            await asyncio.get_running_loop().run_in_executor(
+                self._db_writer, self._persist, start["patient"], ex, stats)
+        writer.write(encode_json({"type": "summary", "stats": stats}))
+
+    def _resolve(self, username, ex, opt_range):
+        # the tracker (cv2/mediapipe) is only loaded once the first session starts,
+        # here on the executor rather than on the event loop
+        import exercise_tracker
+        # the definition comes from this service's database (--db), like the opt_range
+        db = self.repo.load_db()
+        d = definition_from_meta(ex, load_custom_exercises().get(ex) or db.get("exercises", {}).get(ex))
+        # same opt_range precedence as a set started from the patient page
+        if opt_range is None and username:
+            opt_range = resolve_opt_range(db.get("patients", {}).get(username, {}), ex, d.meta)
+        return d.joints, d.primary_joint, tuple(opt_range) if opt_range is not None else d.opt_range, d.meta
+
+    def _persist(self, username, ex, stats):
+        ex_meta = load_custom_exercises().get(ex, {})
+        self.repo.record_set(username, ex, stats, ex_meta, custom=ex not in OPTIMAL_RANGES)
+
+    def close(self):
+        """Waits for queued DB writes, then writes the database out and closes its
+        session log (see Repository.close)."""
+        self._db_writer.shutdown(wait=True)
+        self.repo.close()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_MESSAGE)
+        async with server:
+            await server.serve_forever()
+
+def main():
+    ap = argparse.ArgumentParser(description="Landmark-ingest service for thin client stations.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--db", default=DB_FILE)
+    ap.add_argument("--no-persist", action="store_true", help="do not write finished sets to the DB")
+    args = ap.parse_args()
+    service = LandmarkService(args.db, persist=not args.no_persist)
+    print(f"listening on {args.host}:{args.port}")
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+if __name__ == "__main__":
+    main()
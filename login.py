@@ -1,15 +1,10 @@
 # login.py
 import tkinter as tk
 from tkinter import messagebox
-import json
 from patient_page import patient_window
 from therapist_page import therapist_window
-
-DB = "database.json"
-
-def load_db():
-    with open(DB, "r") as f:
-        return json.load(f)
+from exercise_defs import prewarm_tracker
+from rehab_db import load_db
 
 def main():
     root = tk.Tk()
@@ -38,6 +33,8 @@ def main():
 
     tk.Button(root, text="Login", width=18, command=do_login).pack(pady=12)
 
+    # load MediaPipe and build the Pose graph while the user types, once the window is up
+    root.after_idle(prewarm_tracker)
     root.mainloop()
 
 if __name__ == "__main__":
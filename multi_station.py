@@ -0,0 +1,155 @@
+# multi_station.py
+# Several cameras on one workstation: one worker process per camera index, each
+# with its own Pose model and capture device, and a single coordinator (this
+# process) that owns database.json and persists every finished set.
+#   python multi_station.py 0:alice:squat:10 1:bob:curl [--headless] [--no-capture]
+import argparse
+import multiprocessing
+import queue
+from exercise_defs import DB_FILE, OPTIMAL_RANGES, load_custom_exercises, resolve_opt_range
+from rehab_db import Repository, store_from_env
+from landmark_log import landmark_capture_path
+
+# ---------- worker side ----------
+def _station_worker(camera_index, jobs, results, headless):
+    """Runs in its own process: sets for one camera, one after another, on a warm
+    per-process TrackerSession. Every finished set is sent back as a message."""
+    from exercise_tracker import start_exercise, release_session
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            try:
+                stats = start_exercise(job["exercise"], target_reps=job.get("target_reps"),
+                                       camera_index=camera_index, opt_range=job.get("opt_range"),
+                                       source=job.get("source"), headless=headless, capture=job.get("capture"))
+                results.put(("set", camera_index, job, stats))
+            except Exception as e:
+                results.put(("error", camera_index, job, repr(e)))
+    finally:
+        release_session()
+        results.put(("stopped", camera_index, None, None))
+
+# ---------- coordinator ----------
+class StationCoordinator:
+    """Starts a worker process per camera on first use, hands it sets and is the
+    only writer of the DB. Workers share nothing but the two queues."""
+    def __init__(self, db_file=DB_FILE, capture=True, headless=False):
+        self.db_file = db_file
+        self.repo = Repository(db_file, store=store_from_env(db_file))
+        self.capture = capture
+        self.headless = headless
+        self._ctx = multiprocessing.get_context("spawn")  # cv2/mediapipe threads do not survive fork
+        self.results = self._ctx.Queue()
+        self.workers = {}
+        self.pending = 0
+
+    def _custom_def(self, db, ex):
+        return load_custom_exercises().get(ex) or db.get("exercises", {}).get(ex)
+
+    def submit(self, camera_index, username, ex, target_reps=None, source=None):
+        """Queues one set of `ex` for `username` on a camera (starting its station)."""
+        db = self.repo.load_db()
+        patient = db.get("patients", {}).get(username, {})
+        if target_reps is None and ex in OPTIMAL_RANGES:
+            target_reps = patient.get("assigned", {}).get(ex) or None
+        job = {"username": username, "exercise": ex, "target_reps": target_reps, "source": source,
+               "opt_range": resolve_opt_range(patient, ex, self._custom_def(db, ex)),
+               "capture": landmark_capture_path(username, ex) if self.capture else None}
+        w = self.workers.get(camera_index)
+        if w is None:
+            jobs = self._ctx.Queue()
+            proc = self._ctx.Process(target=_station_worker, name=f"station-{camera_index}",
+                                     args=(camera_index, jobs, self.results, self.headless), daemon=True)
+            proc.start()
+            w = self.workers[camera_index] = {"proc": proc, "jobs": jobs, "outstanding": 0}
+        w["jobs"].put(job)
+        w["outstanding"] += 1
+        self.pending += 1
+
+    def _persist(self, job, stats):
+        ex = job["exercise"]
+        return self.repo.record_set(job["username"], ex, stats, self._custom_def(self.repo.load_db(), ex) or {},
+                                    custom=ex not in OPTIMAL_RANGES)
+
+    def _station_lost(self, cam, events, on_event):
+        # a station stopped (or crashed) with sets still queued: report them as failed
+        w = self.workers.pop(cam, None)
+        if w is None or not w["outstanding"]:
+            return
+        self.pending -= w["outstanding"]
+        event = ("error", cam, None, f"station stopped with {w['outstanding']} set(s) unfinished")
+        events.append(event)
+        if on_event is not None:
+            on_event(*event)
+
+    def drain(self, on_event=None):
+        """Collects results until every submitted set has finished, persisting each
+        set as soon as it arrives. on_event(kind, camera_index, job, payload) is
+        called for every set and error. Returns the (kind, camera, job, payload) list."""
+        events = []
+        while self.pending:
+            try:
+                kind, cam, job, payload = self.results.get(timeout=0.5)
+            except queue.Empty:
+                for cam in [c for c, w in self.workers.items() if not w["proc"].is_alive()]:
+                    self._station_lost(cam, events, on_event)
+                continue
+            if kind == "stopped":
+                self._station_lost(cam, events, on_event)
+                continue
+            self.workers[cam]["outstanding"] -= 1
+            self.pending -= 1
+            if kind == "set":
+                self._persist(job, payload)
+            events.append((kind, cam, job, payload))
+            if on_event is not None:
+                on_event(kind, cam, job, payload)
+        return events
+
+    def close(self):
+        for w in self.workers.values():
+            w["jobs"].put(None)
+        for w in self.workers.values():
+            w["proc"].join()
+        self.workers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _parse_station(arg):
+    # camera:patient:exercise[:reps]
+    parts = arg.split(":")
+    if len(parts) not in (3, 4) or not parts[0].isdigit():
+        raise argparse.ArgumentTypeError(f"expected camera:patient:exercise[:reps], got {arg!r}")
+    reps = int(parts[3]) if len(parts) == 4 else None
+    return int(parts[0]), parts[1], parts[2], reps
+
+def main():
+    ap = argparse.ArgumentParser(description="Run exercise sets on several cameras at once.")
+    ap.add_argument("stations", nargs="+", type=_parse_station, help="camera:patient:exercise[:reps] (repeatable)")
+    ap.add_argument("--db", default=DB_FILE)
+    ap.add_argument("--headless", action="store_true", help="no preview windows")
+    ap.add_argument("--no-capture", action="store_true", help="do not keep landmark captures")
+    args = ap.parse_args()
+
+    def report(kind, cam, job, payload):
+        if kind == "set":
+            print(f"camera {cam}: {job['username']} {job['exercise']} -> {payload['reps']} reps, "
+                  f"deviation {payload['deviation_percent']}%")
+        elif job is None:
+            print(f"camera {cam}: {payload}")
+        else:
+            print(f"camera {cam}: {job['username']} {job['exercise']} failed: {payload}")
+
+    with StationCoordinator(args.db, capture=not args.no_capture, headless=args.headless) as coord:
+        for cam, username, ex, reps in args.stations:
+            coord.submit(cam, username, ex, reps)
+        coord.drain(report)
+
+if __name__ == "__main__":
+    main()
@@ -2,43 +2,13 @@
 import tkinter as tk
 from tkinter import messagebox, scrolledtext, simpledialog
 import json
-from exercise_tracker import start_exercise, OPTIMAL_RANGES, load_custom_exercises
+from exercise_defs import OPTIMAL_RANGES, load_custom_exercises, exercise_definition, release_tracker_session, \
+    prewarm_tracker, wait_for_prewarm
+from landmark_log import capture_enabled, landmark_capture_path, prune_captures
+from rehab_db import patient, flush as flush_db, record_set, add_message
 from datetime import datetime
 import os
 
-DB = "database.json"
-EX_FILE = "exercises.json"
-
-def load_db():
-    if not os.path.exists(DB):
-        with open(DB, "w") as f:
-            json.dump({"therapists": {}, "patients": {}}, f, indent=4)
-    with open(DB, "r") as f:
-        return json.load(f)
-
-def save_db(db):
-    with open(DB, "w") as f:
-        json.dump(db, f, indent=4)
-
-def _ensure_patient_structure(db, username):
-    p = db["patients"].setdefault(username, {})
-    p.setdefault("messages", {})
-    p["messages"].setdefault("from_therapist", [])
-    p["messages"].setdefault("from_patient", [])
-    p.setdefault("assigned", {})
-    p.setdefault("assigned_sets", {})
-    p.setdefault("sets_completed", {})
-    p.setdefault("completed", {})
-    p.setdefault("angle_stats", {})
-    return p
-
-def load_exercises_file():
-    if not os.path.exists(EX_FILE):
-        with open(EX_FILE, "w") as f:
-            json.dump({"custom_exercises": {}}, f, indent=4)
-    with open(EX_FILE, "r") as f:
-        return json.load(f)
-
 def patient_window(username, login_window):
     try:
         login_window.destroy()
@@ -48,6 +18,8 @@ def patient_window(username, login_window):
     win = tk.Tk()
     win.title(f"Patient - {username}")
     win.geometry("760x820")
+    # load the Pose model while they pick an exercise; the camera only opens when a set starts
+    prewarm_tracker()
 
     tk.Label(win, text=f"Patient: {username}", font=("Arial", 16)).pack(pady=8)
     tk.Label(win, text="Your assigned exercises:", font=("Arial", 12)).pack()
@@ -72,15 +44,13 @@ def patient_window(username, login_window):
     box_canvas.bind_all("<MouseWheel>", on_mousewheel)
 
     def refresh_assigned():
-        db = load_db()
-        _ensure_patient_structure(db, username)
-        assigned = db["patients"][username].get("assigned", {})
-        custom_opt = db["patients"][username].get("custom_optimal", {})
-        assigned_sets = db["patients"][username].get("assigned_sets", {})
-        sets_completed = db["patients"][username].get("sets_completed", {})
-        # load custom exercises file to show exercise-level defaults & optimal ranges
-        ex_file = load_exercises_file()
-        custom_exs = ex_file.get("custom_exercises", {})
+        pdata = patient(username)
+        assigned = pdata.get("assigned", {})
+        custom_opt = pdata.get("custom_optimal", {})
+        assigned_sets = pdata.get("assigned_sets", {})
+        sets_completed = pdata.get("sets_completed", {})
+        # custom exercises (cached, re-read only when exercises.json changes) for exercise-level defaults
+        custom_exs = load_custom_exercises()
         for w in list(box_frame.winfo_children()):
             w.destroy()
 
@@ -114,10 +84,9 @@ def patient_window(username, login_window):
     refresh_assigned()
 
     def launch(ex):
-        db = load_db()
-        _ensure_patient_structure(db, username)
+        pdata = patient(username)
         if ex in built_in:
-            assigned = db["patients"][username].get("assigned", {})
+            assigned = pdata.get("assigned", {})
             target = assigned.get(ex, 0)
             if target == 0:
                 messagebox.showwarning("Not assigned", f"{ex.capitalize()} is not assigned by your therapist.")
@@ -132,69 +101,30 @@ def patient_window(username, login_window):
             #reps_input = int(target_str)
             reps_input = 10  # default for custom exercises
 
-        db2 = load_db()
-        _ensure_patient_structure(db2, username)
         # determine opt_range precedence:
         # 1) per-patient custom_optimal for exercise name if exists
         # 2) exercise's stored optimal_range (exercise-level) if exists
         # 3) built-in fallback
-        per_patient_custom = db2["patients"][username].get("custom_optimal", {}).get(ex)
-        ex_file = load_exercises_file()
-        ex_meta = ex_file.get("custom_exercises", {}).get(ex, {})
-        ex_opt = ex_meta.get("optimal_range")
-        opt_range = None
+        per_patient_custom = pdata.get("custom_optimal", {}).get(ex)
+        ex_meta = load_custom_exercises().get(ex, {})
         if per_patient_custom and isinstance(per_patient_custom, list) and len(per_patient_custom) == 2:
             opt_range = tuple(per_patient_custom)
-        elif ex_opt and isinstance(ex_opt, dict) and "min" in ex_opt and "max" in ex_opt:
-            opt_range = (float(ex_opt["min"]), float(ex_opt["max"]))
         else:
-            if ex in OPTIMAL_RANGES:
-                opt_range = OPTIMAL_RANGES.get(ex, (0,0))
-            else:
-                opt_range = (None, None)
-
-        stats = start_exercise(ex, target_reps=reps_input, opt_range=opt_range)
-
-        db3 = load_db()
-        _ensure_patient_structure(db3, username)
-
-        comp = db3["patients"][username].setdefault("completed", {})
-        comp[ex] = comp.get(ex, 0) + int(stats.get('reps', 0))
-
-        if ex not in built_in:
-            db3["patients"][username].setdefault("sets_completed", {})
-            db3["patients"][username]["sets_completed"][ex] = db3["patients"][username]["sets_completed"].get(ex, 0) + 1
-
-        ag = db3["patients"][username].setdefault("angle_stats", {})
-        ex_hist = ag.setdefault(ex, [])
-
-        # snapshot current assigned/sets info
-        patient_assigned_reps = None
-        patient_assigned_sets = db3["patients"][username].get("assigned_sets", {}).get(ex, None)
-        exercise_default_sets = ex_meta.get("default_sets", None)
-        sets_done = db3["patients"][username].get("sets_completed", {}).get(ex, 0)
-
-        ex_hist.append({
-            "timestamp": stats.get('timestamp'),
-            "reps": int(stats.get('reps', 0)),
-            "rep_averages": stats.get('rep_averages', []),
-            "overall_avg": stats.get('overall_avg', 0.0),
-            "angle_min": stats.get('angle_min', 0.0),
-            "angle_max": stats.get('angle_max', 0.0),
-            "range_avg_low": stats.get('range_avg_low', 0.0),
-            "range_avg_high": stats.get('range_avg_high', 0.0),
-            "rep_min": stats.get('rep_min', 0.0),
-            "rep_max": stats.get('rep_max', 0.0),
-            "rep_range": stats.get('rep_range', 0.0),
-            "opt_range": stats.get('opt_range', (0,0)),
-            "deviation_percent": stats.get('deviation_percent', 0.0),
-            "assigned_reps_snapshot": patient_assigned_reps,
-            "assigned_sets_snapshot": patient_assigned_sets,
-            "exercise_default_sets_snapshot": exercise_default_sets,
-            "sets_completed_snapshot": sets_done
-        })
-
-        save_db(db3)
+            opt_range = exercise_definition(ex).opt_range
+
+        # REHABAI_CAPTURE_LANDMARKS=1 keeps each set's raw landmark stream
+        # (landmarks/<patient>/...) so its stats can be recomputed later
+        capture = landmark_capture_path(username, ex) if capture_enabled() else None
+        # the tracker was imported and warmed in the background since login
+        wait_for_prewarm()
+        from exercise_tracker import start_exercise
+        stats = start_exercise(ex, target_reps=reps_input, opt_range=opt_range, capture=capture)
+
+        # with JSON storage a single append to the patient's session log
+        record_set(username, ex, stats, ex_meta, custom=ex not in built_in)
+        pdata = patient(username)
+        if capture:
+            prune_captures(username)
 
         deviation = stats.get('deviation_percent', 0.0)
         guidance = "No optimal range set."
@@ -214,9 +144,9 @@ def patient_window(username, login_window):
                 else:
                     guidance = "High inconsistency — slow down and control your reps."
 
-        assigned_sets_for_ex = db3["patients"][username].get("assigned_sets", {}).get(ex, None)
+        assigned_sets_for_ex = pdata.get("assigned_sets", {}).get(ex, None)
         exercise_default = ex_meta.get("default_sets", None)
-        sets_done = db3["patients"][username].get("sets_completed", {}).get(ex, 0)
+        sets_done = pdata.get("sets_completed", {}).get(ex, 0)
         sets_message = ""
         if assigned_sets_for_ex is not None:
             remaining = max(0, assigned_sets_for_ex - sets_done)
@@ -243,8 +173,7 @@ def patient_window(username, login_window):
     def add_custom_buttons():
         custom_panel = tk.LabelFrame(win, text="Custom Exercises", padx=8, pady=8)
         custom_panel.pack(pady=8, fill="x", padx=10)
-        ex_file = load_exercises_file()
-        custom_exs = ex_file.get("custom_exercises", {})
+        custom_exs = load_custom_exercises()
         if not custom_exs:
             tk.Label(custom_panel, text="No custom exercises available.").pack(anchor="w")
             return
@@ -269,10 +198,9 @@ def patient_window(username, login_window):
     def load_messages_into_display():
         chat_display.configure(state='normal')
         chat_display.delete('1.0', tk.END)
-        db = load_db()
-        _ensure_patient_structure(db, username)
-        msgs_t = db["patients"][username]["messages"].get("from_therapist", [])
-        msgs_p = db["patients"][username]["messages"].get("from_patient", [])
+        pdata = patient(username)
+        msgs_t = pdata["messages"].get("from_therapist", [])
+        msgs_p = pdata["messages"].get("from_patient", [])
         combined = []
         for m in msgs_t:
             combined.append(("Therapist", m.get("timestamp", ""), m.get("text", "")))
@@ -290,11 +218,8 @@ def patient_window(username, login_window):
         text = patient_msg_ent.get().strip()
         if not text:
             return
-        db = load_db()
-        _ensure_patient_structure(db, username)
         entry = {"timestamp": datetime.utcnow().isoformat(), "text": text}
-        db["patients"][username]["messages"]["from_patient"].append(entry)
-        save_db(db)
+        add_message(username, "from_patient", entry)
         patient_msg_ent.delete(0, tk.END)
         load_messages_into_display()
         messagebox.showinfo("Sent", "Your message was sent to your therapist.")
@@ -302,10 +227,9 @@ def patient_window(username, login_window):
     tk.Button(send_frame, text="Send", command=send_patient_message).pack(side="right", padx=(6,0))
 
     def popup_view_messages():
-        db = load_db()
-        _ensure_patient_structure(db, username)
-        msgs_t = db["patients"][username]["messages"].get("from_therapist", [])
-        msgs_p = db["patients"][username]["messages"].get("from_patient", [])
+        pdata = patient(username)
+        msgs_t = pdata["messages"].get("from_therapist", [])
+        msgs_p = pdata["messages"].get("from_patient", [])
         top = tk.Toplevel(win)
         top.title("All Messages (popup)")
         top.geometry("640x420")
@@ -325,16 +249,15 @@ def patient_window(username, login_window):
     tk.Button(msg_frame, text="View Messages (Popup)", command=popup_view_messages).pack(pady=(0,8))
 
     def view_my_progress():
-        db = load_db()
-        _ensure_patient_structure(db, username)
-        comp = db["patients"][username].get("completed", {})
-        assigned = db["patients"][username].get("assigned", {})
-        assigned_sets = db["patients"][username].get("assigned_sets", {})
-        sets_completed = db["patients"][username].get("sets_completed", {})
+        pdata = patient(username)
+        comp = pdata.get("completed", {})
+        assigned = pdata.get("assigned", {})
+        assigned_sets = pdata.get("assigned_sets", {})
+        sets_completed = pdata.get("sets_completed", {})
         text = ""
         for ex in built_in:
             text += f"{ex.capitalize()}: Completed reps={comp.get(ex,0)} Assigned reps={assigned.get(ex,0)}\n"
-            hist = db["patients"][username].get("angle_stats", {}).get(ex, [])
+            hist = pdata.get("angle_stats", {}).get(ex, [])
             if hist:
                 last = hist[-1]
                 ts = last.get('timestamp', '')
@@ -343,15 +266,14 @@ def patient_window(username, login_window):
             else:
                 text += "  No sessions recorded yet.\n"
 
-        ex_file = load_exercises_file()
-        custom_exs = ex_file.get("custom_exercises", {})
+        custom_exs = load_custom_exercises()
         if custom_exs:
             text += "\nCustom Exercises:\n"
             for name, meta in custom_exs.items():
                 a_sets = assigned_sets.get(name, meta.get("default_sets", 0))
                 s_done = sets_completed.get(name, 0)
-                text += f"{name}: Sets completed={s_done} Assigned sets={db['patients'][username].get('assigned_sets', {}).get(name, 'none')} Default sets={meta.get('default_sets', 0)}\n"
-                hist = db["patients"][username].get("angle_stats", {}).get(name, [])
+                text += f"{name}: Sets completed={s_done} Assigned sets={pdata.get('assigned_sets', {}).get(name, 'none')} Default sets={meta.get('default_sets', 0)}\n"
+                hist = pdata.get("angle_stats", {}).get(name, [])
                 if hist:
                     last = hist[-1]
                     ts = last.get('timestamp', '')
@@ -365,6 +287,12 @@ def patient_window(username, login_window):
     tk.Button(win, text="View My Progress", width=30, command=view_my_progress).pack(pady=8)
 
     def logout():
+        release_tracker_session()
+        try:
+            flush_db()
+        except OSError as e:
+            messagebox.showerror("Save failed", f"Your latest changes could not be saved:\n{e}\n\nPlease try again.")
+            return
         win.destroy()
         import login
         login.main()
@@ -0,0 +1,407 @@
+# rehab_db.py
+# The one place the pages get the patient/therapist database from. Keeps a
+# parsed copy in memory and only re-reads it when another process changed it
+# (database.json mtime/size, SQLite's data_version or the shard files' mtimes),
+# so the many load_db() calls of one UI action share a single parse. save_db() only marks the JSON
+# database dirty; a background flusher coalesces the changes of a burst of UI
+# actions into one atomic rewrite of database.json, merged with the file's
+# current version if another process wrote it in the meantime.
+#   REHABAI_FLUSH_DELAY     seconds of quiet before writing (default 0.25, 0 = write in save_db)
+#   REHABAI_FLUSH_DEADLINE  longest a change may stay unwritten (default 2)
+#   REHABAI_DURABILITY      fsync (default) or replace: atomic, but without fsync
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from exercise_defs import DB_FILE, append_set_result
+from session_log import CURSOR_KEY, default_log, log_dir_for
+import sharded_store
+import sqlite_store
+
+def ensure_patient_structure(db, username):
+    p = db["patients"].setdefault(username, {})
+    p.setdefault("messages", {})
+    p["messages"].setdefault("from_therapist", [])
+    p["messages"].setdefault("from_patient", [])
+    p.setdefault("assigned", {})
+    p.setdefault("assigned_sets", {})
+    p.setdefault("sets_completed", {})
+    p.setdefault("completed", {})
+    p.setdefault("angle_stats", {})
+    return p
+
+FLUSH_DELAY = 0.25
+FLUSH_DEADLINE = 2.0
+DURABILITY_MODES = ("fsync", "replace")
+
+logger = logging.getLogger(__name__)
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+# ---------- merging concurrent writes ----------
+# patient fields that folding the session log writes (see apply_set_entry)
+LOG_FIELDS = ("angle_stats", "completed", "sets_completed")
+_MISSING = object()
+
+def _merge_value(ours, theirs, base):
+    # a side that left the value as it was in `base` takes the other side's
+    # version; dicts merge key by key, lists both sides only appended to keep
+    # both appends; anything else changed on both sides keeps ours
+    if theirs == base or ours == theirs:
+        return ours
+    if ours == base:
+        return theirs
+    if isinstance(ours, dict) and isinstance(theirs, dict):
+        base = base if isinstance(base, dict) else {}
+        out = {}
+        for k in list(ours) + [k for k in theirs if k not in ours]:
+            v = _merge_value(ours.get(k, _MISSING), theirs.get(k, _MISSING), base.get(k, _MISSING))
+            if v is not _MISSING:
+                out[k] = v
+        return out
+    if isinstance(ours, list) and isinstance(theirs, list):
+        base = base if isinstance(base, list) else []
+        if ours[:len(base)] == base and theirs[:len(base)] == base:
+            mine = ours[len(base):]
+            return ours + [x for x in theirs[len(base):] if x not in mine]
+    return ours
+
+def merge_db(ours, theirs, base):
+    """Three-way merge of two versions of database.json that both started from
+    `base`: what only one side changed is kept, and so are both sides' appended
+    messages. A patient's session-log results (LOG_FIELDS and the log cursor) come
+    from the side that folded more of the log, so no logged set is lost or applied twice."""
+    merged = _merge_value(ours, theirs, base)
+    ours_c, theirs_c = ours.get(CURSOR_KEY, {}), theirs.get(CURSOR_KEY, {})
+    for username in set(ours_c) | set(theirs_c):
+        if ours_c.get(username, 0) == theirs_c.get(username, 0):
+            continue
+        src = ours if ours_c.get(username, 0) > theirs_c.get(username, 0) else theirs
+        p = merged.get("patients", {}).get(username)
+        src_p = src.get("patients", {}).get(username)
+        if p is None or src_p is None:
+            continue
+        for field in LOG_FIELDS:
+            if field in src_p:
+                p[field] = src_p[field]
+        merged.setdefault(CURSOR_KEY, {})[username] = src[CURSOR_KEY][username]
+    return merged
+
+class Repository:
+    """Cached database access. load_db() hands out the same dict until the data
+    changes on disk, so callers that modify it must save_db() (or invalidate()).
+
+    With JSON storage save_db() marks the database dirty and the write happens on
+    a background thread `flush_delay` seconds after the last change, but never
+    later than `flush_deadline` seconds after the first unwritten one. Each write
+    is a temp file + os.replace; durability "fsync" also syncs the file and its
+    directory. flush() writes pending changes now (logout, exit) and raises if
+    that fails; a failed background write is logged, kept in `write_error` and
+    retried, with the changes still pending. If another process wrote
+    database.json meanwhile, the write is merged with its version (merge_db)
+    instead of replacing it."""
+    def __init__(self, path=DB_FILE, store=None, log=None, flush_delay=None, flush_deadline=None,
+                 durability=None):
+        # absolute: a pending write must not follow a later os.chdir()
+        self.path = os.path.abspath(path)
+        self.store = store
+        if log is None and store is None:
+            log = default_log(log_dir_for(path))
+        self.log = log
+        self.flush_delay = _env_float("REHABAI_FLUSH_DELAY", FLUSH_DELAY) if flush_delay is None else flush_delay
+        self.flush_deadline = (_env_float("REHABAI_FLUSH_DEADLINE", FLUSH_DEADLINE)
+                               if flush_deadline is None else flush_deadline)
+        durability = durability or os.environ.get("REHABAI_DURABILITY", "fsync")
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"durability must be one of {DURABILITY_MODES}, not {durability!r}")
+        self.durability = durability
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        self._db = None
+        self._file_key = None
+        self._base_text = None
+        self._stale = False
+        self._log_key = None
+        self._version = None
+        self._dirty_since = None
+        self._last_change = None
+        self._writing = False
+        self._flusher = None
+        self.write_error = None
+        self.parses = 0
+        self.writes = 0
+
+    def _stat_key(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def load_db(self):
+        if self.store is None and self.pending() and self._stat_key() != self._file_key:
+            # another process wrote database.json while ours has unwritten changes:
+            # merge them now, so this view does not miss the other process's changes
+            self.flush()
+        with self._lock:
+            if self.store is not None:
+                version = self.store.data_version()
+                if self._db is None or version != self._version:
+                    self._db = self.store.load_db()
+                    self._version = version
+                    self.parses += 1
+                return self._db
+            key = self._stat_key()
+            if key is None:
+                with open(self.path, "w") as f:
+                    json.dump({"therapists": {}, "patients": {}}, f, indent=4)
+                key = self._stat_key()
+            if self._db is None or ((key != self._file_key or self._stale) and not self.pending()):
+                with open(self.path, "r") as f:
+                    text = f.read()
+                self._db = json.loads(text)
+                # kept as the merge base should another process write before our next flush
+                self._base_text = text
+                self._file_key, self._stale = key, False
+                self._log_key = None
+                self.parses += 1
+            log_key = self.log.state()
+            if log_key != self._log_key:
+                # sets saved since the last full write are still in the append-only session log;
+                # folding is idempotent (per-patient seq cursor), so only new records are applied
+                self.log.fold_pending(self._db)
+                self._log_key = log_key
+            return self._db
+
+    def save_db(self, db=None):
+        """Marks `db` (default: the cached dict) as the current database. SQLite
+        writes the changed patients right away; JSON storage schedules a flush."""
+        with self._lock:
+            db = self._db if db is None else db
+            if self.store is not None:
+                self.store.save_db(db)
+                self._db, self._version = db, self.store.data_version()
+                return
+            self._db = db
+            now = time.monotonic()
+            if self._dirty_since is None:
+                self._dirty_since = now
+            self._last_change = now
+            if self.flush_delay > 0:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(target=self._flush_loop, name="rehab-db-flush", daemon=True)
+                    self._flusher.start()
+                    atexit.register(self.flush)
+                self._changed.notify()
+                return
+        self.flush()
+
+    mark_dirty = save_db
+
+    def pending(self):
+        """True while changes are not yet (completely) written to database.json."""
+        with self._lock:
+            return self._dirty_since is not None or self._writing
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                while True:
+                    if self._dirty_since is None:
+                        self._changed.wait()
+                        continue
+                    due = min(self._last_change + self.flush_delay, self._dirty_since + self.flush_deadline)
+                    wait = due - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._changed.wait(wait)
+            try:
+                self.flush()
+            except Exception as e:
+                # flush() left the changes pending: retried here, and an explicit
+                # flush() (logout, exit) raises if the write still fails
+                self.write_error = e
+                logger.exception("database write to %s failed, retrying", self.path)
+                time.sleep(max(self.flush_delay, 0.5))
+
+    def flush(self):
+        """Writes pending changes now. Returns True if anything was written."""
+        if self.store is not None:
+            return False
+        with self._write_lock:
+            with self._lock:
+                if self._dirty_since is None:
+                    return False
+                # the C encoder runs without releasing the GIL, so this is a consistent
+                # snapshot even if a UI thread keeps modifying the dict meanwhile
+                text = json.dumps(self._db)
+                dirty_since, last_change = self._dirty_since, self._last_change
+                self._writing = True
+                self._dirty_since = self._last_change = None
+                file_key, base_text, stale = self._file_key, self._base_text, self._stale
+            try:
+                snapshot = json.loads(text)
+                merged = self._stat_key() != file_key or stale
+                if merged and base_text is not None and os.path.exists(self.path):
+                    with open(self.path, "r") as f:
+                        written = merge_db(snapshot, json.load(f), json.loads(base_text))
+                else:
+                    written, merged = snapshot, False
+                self._write_file(written)
+            except BaseException:
+                with self._lock:
+                    self._writing = False
+                    if self._dirty_since is None:
+                        self._dirty_since, self._last_change = dirty_since, last_change
+                raise
+            # database.json now holds every logged set the written version folded in
+            self.log.discard_folded(written)
+            with self._lock:
+                self._writing = False
+                # the cached dict is still our side; after a merge the next idle
+                # load_db() re-reads the file, and until then our snapshot is the base
+                self._base_text, self._stale = text, merged
+                self._file_key, self._log_key = self._stat_key(), None
+                self.write_error = None
+                self.writes += 1
+            return True
+
+    def _write_file(self, db):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(db, f, indent=4)
+            if self.durability == "fsync":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        if self.durability == "fsync" and hasattr(os, "O_DIRECTORY"):
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def close(self):
+        """Writes pending changes and closes the session log. With JSON storage the
+        sets still in the log are written into database.json first (compaction)."""
+        if self.store is None:
+            with self._lock:
+                if self.log.patients():
+                    # load_db() folded them; a save writes them out and empties the log
+                    self.save_db(self.load_db())
+        self.flush()
+        if self.log is not None:
+            self.log.close()
+
+    def invalidate(self):
+        """Drops the cached dict (after flushing it) so the next load_db() re-reads."""
+        self.flush()
+        with self._lock:
+            self._db = None
+
+    def patient(self, username):
+        """The patient's dict (structure ensured) from the cached database."""
+        return ensure_patient_structure(self.load_db(), username)
+
+    def patient_names(self):
+        return list(self.load_db()["patients"].keys())
+
+    @staticmethod
+    def _saved(patients, username):
+        return isinstance(patients, sqlite_store.PatientMap) and patients.is_saved(username)
+
+    def add_message(self, username, direction, message):
+        """Appends one message ("from_therapist" / "from_patient") to the patient's
+        conversation and saves it; with SQLite that is a single row insert."""
+        with self._lock:
+            db = self.load_db()
+            p = ensure_patient_structure(db, username)
+            rows = hasattr(self.store, "add_message") and self._saved(db["patients"], username)
+            p["messages"].setdefault(direction, []).append(message)
+            if rows:
+                self.store.add_message(username, direction, message)
+                db["patients"].mark_saved(username)
+            else:
+                self.save_db(db)
+
+    def record_set(self, username, ex, stats, ex_meta=None, custom=False):
+        """Saves one finished set; returns its angle_stats entry. With JSON storage
+        this is a single append to the patient's session log."""
+        with self._lock:
+            db = self.load_db()
+            ensure_patient_structure(db, username)
+            if self.log is None:
+                patients = db["patients"]
+                # SQLite: insert the one session row (and the exercise's counters)
+                # instead of rewriting the patient's whole history
+                rows = hasattr(self.store, "append_session") and self._saved(patients, username)
+                entry = append_set_result(db, username, ex, stats, ex_meta, custom=custom)
+                if rows:
+                    p = patients[username]
+                    self.store.append_session(username, ex, entry, {f: p[f][ex] for f in ("completed", "sets_completed")
+                                                                    if ex in p.get(f, {})})
+                    patients.mark_saved(username)
+                else:
+                    self.save_db(db)
+                return entry
+            entry = append_set_result(db, username, ex, stats, ex_meta, custom=custom)
+            seq = self.log.append(username, ex, entry, custom=custom)
+            # the cached dict already contains this record (plus whatever another
+            # process may have logged for the patient in the meantime)
+            self.log.fold_into(db, username, applied=(seq,))
+            self._log_key = self.log.state()
+            return entry
+
+def store_from_env(json_path=DB_FILE):
+    """The store REHABAI_STORAGE selects for `json_path`: SqliteStore for "sqlite",
+    ShardedStore for "sharded", None for database.json itself."""
+    return sqlite_store.store_from_env(json_path) or sharded_store.store_from_env(json_path)
+
+_repo = None
+_repo_lock = threading.Lock()
+
+def repository():
+    """Shared Repository for database.json, or the store REHABAI_STORAGE selects."""
+    global _repo
+    with _repo_lock:
+        if _repo is None:
+            _repo = Repository(DB_FILE, store=store_from_env(DB_FILE))
+        return _repo
+
+def use_repository(repo):
+    """Replaces the shared Repository (e.g. with one on a scratch database);
+    returns the previous one so it can be put back."""
+    global _repo
+    with _repo_lock:
+        previous, _repo = _repo, repo
+        return previous
+
+def load_db():
+    return repository().load_db()
+
+def save_db(db=None):
+    repository().save_db(db)
+
+def flush():
+    """Writes any debounced changes now."""
+    if _repo is not None:
+        _repo.flush()
+
+def patient(username):
+    return repository().patient(username)
+
+def patient_names():
+    return repository().patient_names()
+
+def add_message(username, direction, message):
+    repository().add_message(username, direction, message)
+
+def record_set(username, ex, stats, ex_meta=None, custom=False):
+    return repository().record_set(username, ex, stats, ex_meta, custom)
@@ -0,0 +1,115 @@
+# rep_detector.py
+
+# ---------- data-driven rep detection ----------
+# Every exercise is counted by the same three-stage state machine, configured
+# by a plain dict (JSON friendly) spec:
+#
+#   joint     JOINT_TRIPLES key whose angle drives counting
+#   rest      "high" or "low": side of the range the patient starts/rests on
+#   reset     optional angle on the rest side; passing it (from any stage) resets
+#             the cycle. Goes to "armed" when counting at the peak, else "ready".
+#   peak      angle on the far side; passing it while "ready" arms the rep, or
+#             counts it directly when count_on == "peak"
+#   return    with count_on == "return": passing it back towards rest while
+#             "armed" counts the rep (the gap to `peak` is the hysteresis)
+#   count_on  "peak" or "return"
+#   cooldown  minimum seconds between counted reps
+#   cooldown_blocks_transition  True: an early rep leaves the stage untouched so
+#             it can still count once the cooldown is over; False: the stage
+#             resets anyway and the rep is dropped
+#   initial_split  optional angle deciding the first stage ("armed" on the peak side)
+#   label     text shown before the angle in the overlay
+#
+# "Passing" is strict (> or <), exactly like the original hand-written chains.
+IDLE, READY, ARMED = 0, 1, 2
+
+DEFAULT_COOLDOWN = 0.4
+CUSTOM_HYSTERESIS = 5.0
+
+BUILTIN_REP_SPECS = {
+    "squat": {"joint": "LEFT_KNEE", "rest": "high", "reset": 160, "peak": 95, "return": 140,
+              "count_on": "return", "label": "Knee angle"},
+    "pushup": {"joint": "LEFT_ELBOW", "rest": "high", "reset": 150, "peak": 90, "return": 140,
+               "count_on": "return", "label": "Elbow angle"},
+    "curl": {"joint": "LEFT_ELBOW", "rest": "high", "reset": 150, "peak": 60,
+             "count_on": "peak", "label": "Elbow angle"},
+    "raise": {"joint": "LEFT_SHOULDER", "rest": "low", "reset": 30, "peak": 75,
+              "count_on": "peak", "label": "Shoulder raise angle"}
+}
+BUILTIN_REP_SPECS["lateral raise"] = BUILTIN_REP_SPECS["raise"]
+
+def spec_from_joint_limits(joint, limits, hysteresis=CUSTOM_HYSTERESIS):
+    """Spec for a recorded custom exercise: count on the way back down after
+    getting within `hysteresis` degrees of the recorded max and min."""
+    lim_min, lim_max = limits
+    return {"joint": joint, "rest": "low", "peak": lim_max - hysteresis, "return": lim_min + hysteresis,
+            "count_on": "return", "cooldown_blocks_transition": False,
+            "initial_split": (lim_min + lim_max) / 2.0, "label": f"{joint} angle"}
+
+class RepDetector:
+    """Compiled rep-counting state machine. update() is the per-frame hot path."""
+    def __init__(self, spec):
+        self.spec = dict(spec)
+        self.joint = spec["joint"]
+        self.label = spec.get("label", f"{self.joint} angle")
+        # work on x = sign * angle so every rule reads "x > reset", "x < peak", "x > return"
+        self.sign = 1.0 if spec.get("rest", "high") == "high" else -1.0
+        self.has_reset = spec.get("reset") is not None
+        self.reset_x = self.sign * float(spec["reset"]) if self.has_reset else 0.0
+        self.peak_x = self.sign * float(spec["peak"])
+        self.count_on_peak = spec.get("count_on", "peak") == "peak"
+        self.return_x = self.sign * float(spec["return"]) if not self.count_on_peak else 0.0
+        self.reset_to = ARMED if self.count_on_peak else READY
+        self.cooldown = float(spec.get("cooldown", DEFAULT_COOLDOWN))
+        self.cooldown_blocks = bool(spec.get("cooldown_blocks_transition", True))
+        split = spec.get("initial_split")
+        self.split_x = self.sign * float(split) if split is not None else None
+        self.stage = IDLE
+        self.last_time = None
+        self.count = 0
+
+    def start(self, now):
+        """Cooldown reference for the first rep (the session's first frame)."""
+        if self.last_time is None:
+            self.last_time = now
+
+    def update(self, angle, now):
+        """Feeds one joint angle; returns True when this frame completes a rep."""
+        x = self.sign * angle
+        st = self.stage
+        counted = False
+        if self.has_reset and x > self.reset_x:
+            st = self.reset_to
+        if self.count_on_peak:
+            if x < self.peak_x and st == ARMED and (now - self.last_time) > self.cooldown:
+                counted = True
+                st = READY
+        else:
+            if x < self.peak_x and st == READY:
+                st = ARMED
+            if x > self.return_x and st == ARMED:
+                if (now - self.last_time) > self.cooldown:
+                    counted = True
+                    st = READY
+                elif not self.cooldown_blocks:
+                    st = READY
+        if st == IDLE and self.split_x is not None:
+            st = ARMED if x < self.split_x else READY
+        self.stage = st
+        if counted:
+            self.count += 1
+            self.last_time = now
+        return counted
+
+def detector_for(ex_name, custom_def=None, primary_joint=None, joint_limits=None):
+    """RepDetector for an exercise: an explicit "rep_spec" on the custom definition,
+    else one derived from the recorded joint limits, else the built-in spec."""
+    if isinstance(custom_def, dict) and isinstance(custom_def.get("rep_spec"), dict):
+        return RepDetector(custom_def["rep_spec"])
+    if primary_joint:
+        jlim = (joint_limits or {}).get(primary_joint)
+        if jlim and isinstance(jlim, list) and len(jlim) == 2:
+            return RepDetector(spec_from_joint_limits(primary_joint, jlim))
+        return None
+    spec = BUILTIN_REP_SPECS.get(ex_name.lower())
+    return RepDetector(spec) if spec else None
@@ -0,0 +1,150 @@
+# replay.py
+# Offline replay: rebuilds angle_stats entries from stored landmark captures.
+#   python replay.py [--db database.json] [--patient NAME] [--dry-run]
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+import numpy as np
+from exercise_defs import definition_from_meta, resolve_opt_range
+from exercise_tracker import (DB_FILE, JOINT_INDEX, joint_angle_series, summarize_session,
+                              load_custom_exercises, _compute_deviation_repwise)
+from rep_detector import detector_for
+from session_stats import StreamingAngleStats
+from landmark_log import open_session, read_meta
+from rehab_db import Repository, store_from_env
+from deviation_batch import score_sessions
+
+# fields of an angle_stats entry that a replay recomputes
+REPLAYED_FIELDS = ("reps", "rep_averages", "overall_avg", "angle_min", "angle_max", "range_avg_low",
+                   "range_avg_high", "rep_min", "rep_max", "rep_range", "opt_range", "deviation_percent")
+
+def replay_landmarks(timestamps, landmarks, w, h, ex_name, opt_range, custom_def=None):
+    """Runs a recorded stream (timestamps, (frames, 33, 4) landmarks with NaN rows for
+    missed detections) through the same angle -> rep detector -> session stats path as
+    start_exercise, with no camera, model or display. Returns the same stats dict."""
+    # the validated joints start_exercise tracks, so the primary joint (and rep
+    # count) match the live session
+    d = definition_from_meta(ex_name, custom_def)
+    joint_limits, primary_joint = d.joints, d.primary_joint
+    detector = detector_for(ex_name, d.meta, primary_joint, joint_limits)
+    joint = detector.joint if detector is not None else primary_joint
+
+    st = StreamingAngleStats(low_pct=0.3)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if joint not in JOINT_INDEX or len(timestamps) == 0:
+        return summarize_session(st, 0, opt_range)
+
+    lm = np.asarray(landmarks)
+    detected = ~np.isnan(lm[:, 0, 0])
+    raw = joint_angle_series(lm[detected], w, h)[:, JOINT_INDEX[joint]]
+
+    reps = 0
+    breaks = []
+    if detector is not None:
+        # cooldown is measured from the first frame of the set, detected or not
+        detector.start(float(timestamps[0]))
+        update = detector.update
+        for i, (a, t) in enumerate(zip(raw.tolist(), timestamps[detected].tolist())):
+            if update(a, t):
+                breaks.append(i)
+        reps = detector.count
+
+    st.add_many(np.clip(np.mod(raw, 180.0), 0.0, 180.0), breaks)
+    return summarize_session(st, reps, opt_range)
+
+def replay_file(path, ex_name, opt_range, custom_def=None):
+    s = open_session(path)
+    if s.meta.get("adaptive"):
+        # the predicted frames drove rep detection live but are not in the file
+        raise ValueError(f"{path} was captured with adaptive inference and cannot be replayed")
+    return replay_landmarks(s.timestamps, s.landmarks, s.meta["width"], s.meta["height"],
+                            ex_name, opt_range, custom_def)
+
+def has_capture(entry):
+    """True if the entry has a capture that replays to the live run's result; sets
+    captured with adaptive inference (or unreadable files) are re-scored from
+    their stored rep averages instead."""
+    path = entry.get("landmark_file")
+    if not path or not os.path.exists(path):
+        return False
+    try:
+        return not read_meta(path).get("adaptive", False)
+    except (OSError, ValueError):
+        return False
+
+def _apply(entry, updates):
+    # JSON round trip turns tuples into lists; compare like for like
+    before = json.loads(json.dumps({k: entry.get(k) for k in updates}))
+    entry.update(updates)
+    changed = before != json.loads(json.dumps(updates))
+    if changed:
+        entry["rescored"] = datetime.utcnow().isoformat()
+    return changed
+
+def rescore_entry(entry, ex, opt_range, custom_def=None):
+    """Recomputes one angle_stats entry in place. With a landmark capture the whole
+    pipeline is replayed; otherwise only the deviation is re-scored from the stored
+    rep averages. Returns True if the entry changed."""
+    if has_capture(entry):
+        stats = replay_file(entry["landmark_file"], ex, opt_range, custom_def)
+        return _apply(entry, {k: stats[k] for k in REPLAYED_FIELDS})
+    opt_min, opt_max = opt_range
+    deviation = _compute_deviation_repwise(entry.get("rep_averages", []), opt_min, opt_max, cap_percent=200.0)
+    return _apply(entry, {"opt_range": opt_range, "deviation_percent": deviation})
+
+def rescore_patient(db, username, custom_exs=None):
+    """Re-scores every stored session of one patient against the current ranges and
+    exercise definitions. Returns (sessions_seen, sessions_changed)."""
+    if custom_exs is None:
+        custom_exs = load_custom_exercises()
+    patient = db.get("patients", {}).get(username, {})
+    seen = changed = 0
+    for ex, hist in patient.get("angle_stats", {}).items():
+        custom_def = custom_exs.get(ex) or db.get("exercises", {}).get(ex)
+        opt_range = resolve_opt_range(patient, ex, custom_def)
+        # sessions without a capture only need their deviation: score them in one batch
+        stored = [e for e in hist if not has_capture(e)]
+        if stored:
+            deviations = score_sessions([e.get("rep_averages", []) for e in stored], [opt_range] * len(stored))
+            for entry, deviation in zip(stored, deviations):
+                changed += _apply(entry, {"opt_range": opt_range, "deviation_percent": deviation})
+        for entry in hist:
+            if has_capture(entry):
+                changed += rescore_entry(entry, ex, opt_range, custom_def)
+        seen += len(hist)
+    return seen, changed
+
+def rescore_database(db, patients=None, custom_exs=None):
+    if custom_exs is None:
+        custom_exs = load_custom_exercises()
+    seen = changed = 0
+    for username in (patients or list(db.get("patients", {}).keys())):
+        s, c = rescore_patient(db, username, custom_exs)
+        seen += s
+        changed += c
+    return seen, changed
+
+def main():
+    ap = argparse.ArgumentParser(description="Recompute stored session stats from landmark captures.")
+    ap.add_argument("--db", default=DB_FILE)
+    ap.add_argument("--patient", action="append", help="only this patient (repeatable)")
+    ap.add_argument("--dry-run", action="store_true", help="report only, do not write the DB")
+    args = ap.parse_args()
+
+    # through the repository: the configured storage, pending session-log records,
+    # and no lost update against a UI's debounced write
+    repo = Repository(args.db, store=store_from_env(args.db))
+    db = repo.load_db()
+    t0 = time.perf_counter()
+    seen, changed = rescore_database(db, args.patient)
+    dt = time.perf_counter() - t0
+    rate = seen / dt * 60.0 if dt > 0 else 0.0
+    print(f"re-scored {seen} sessions ({changed} changed) in {dt:.2f}s ({rate:.0f} sessions/min)")
+    if changed and not args.dry_run:
+        repo.save_db(db)
+        repo.flush()
+
+if __name__ == "__main__":
+    main()
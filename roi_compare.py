@@ -0,0 +1,77 @@
+# roi_compare.py
+# FPS / accuracy comparison of the ROI-crop pose path against the full-frame path.
+#   python roi_compare.py clip1.mp4 [clip2.mp4 ...] [--max-side 320] [--json out.json]
+import argparse
+import json
+import time
+import numpy as np
+import cv2
+from frame_sources import open_frame_source
+from exercise_tracker import mp_pose, POSE_OPTIONS, JOINT_NAMES, JointAngleEngine, RgbBuffer, _detect_pose, _make_cropper
+
+def _run_path(path, roi):
+    """Returns (per-frame joint angles with NaN rows where nothing was detected,
+    per-frame inference seconds, cropper)."""
+    src = open_frame_source(path)
+    cropper = _make_cropper(roi)
+    engine = JointAngleEngine()
+    rgb = RgbBuffer()
+    angles, times = [], []
+    with mp_pose.Pose(**POSE_OPTIONS) as pose:
+        for frame, _ts in src:
+            frame = cv2.flip(frame, 1)
+            h, w = frame.shape[:2]
+            t0 = time.perf_counter()
+            pose_landmarks = _detect_pose(pose, frame, cropper, rgb=rgb)
+            times.append(time.perf_counter() - t0)
+            if pose_landmarks:
+                angles.append(engine.compute(pose_landmarks.landmark, w, h).copy())
+            else:
+                angles.append(np.full(len(JOINT_NAMES), np.nan))
+    src.release()
+    return np.array(angles).reshape(-1, len(JOINT_NAMES)), np.array(times), cropper
+
+def compare_clip(path, roi=True):
+    full_angles, full_times, _ = _run_path(path, False)
+    roi_angles, roi_times, cropper = _run_path(path, roi)
+    both = ~np.isnan(full_angles[:, 0]) & ~np.isnan(roi_angles[:, 0])
+    err = np.abs(roi_angles[both] - full_angles[both])
+    report = {
+        "clip": path,
+        "frames": int(len(full_times)),
+        "full_fps": float(len(full_times) / full_times.sum()) if full_times.sum() else 0.0,
+        "roi_fps": float(len(roi_times) / roi_times.sum()) if roi_times.sum() else 0.0,
+        "full_detect_rate": float(np.mean(~np.isnan(full_angles[:, 0]))) if len(full_angles) else 0.0,
+        "roi_detect_rate": float(np.mean(~np.isnan(roi_angles[:, 0]))) if len(roi_angles) else 0.0,
+        "roi_refits": cropper.refits,
+        "joint_abs_err_mean": {},
+        "joint_abs_err_p95": {},
+    }
+    if err.size:
+        for i, j in enumerate(JOINT_NAMES):
+            report["joint_abs_err_mean"][j] = round(float(np.mean(err[:, i])), 3)
+            report["joint_abs_err_p95"][j] = round(float(np.percentile(err[:, i], 95)), 3)
+    return report
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare ROI-crop and full-frame pose inference on recorded clips.")
+    ap.add_argument("clips", nargs="+")
+    ap.add_argument("--max-side", type=int, default=0, help="downscale ROI crops to this longest side (0 = no downscale)")
+    ap.add_argument("--json", help="write the reports to this file")
+    args = ap.parse_args()
+
+    roi = args.max_side if args.max_side else True
+    reports = []
+    for clip in args.clips:
+        r = compare_clip(clip, roi)
+        reports.append(r)
+        errs = list(r["joint_abs_err_mean"].values())
+        print(f"{clip}: {r['frames']} frames | full {r['full_fps']:.1f} fps -> roi {r['roi_fps']:.1f} fps "
+              f"| detect {r['full_detect_rate']:.2%} / {r['roi_detect_rate']:.2%} "
+              f"| mean |err| {np.mean(errs) if errs else float('nan'):.2f} deg | refits {r['roi_refits']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# roi_crop.py
+import cv2
+
+# ---------- landmark-driven region of interest ----------
+# The crop box only moves when the body gets close to its edge (or shrinks a lot),
+# so MediaPipe's own frame-to-frame tracking sees a stable input between refits.
+class RoiCropper:
+    """Crops frames to a padded bounding box of the previous frame's landmarks and
+    maps landmarks found in the crop back to full-frame normalized coordinates."""
+    def __init__(self, pad=0.2, max_side=None, min_visibility=0.3, edge_margin=0.08, shrink_ratio=0.45):
+        self.pad = pad
+        self.max_side = max_side
+        self.min_visibility = min_visibility
+        self.edge_margin = edge_margin
+        self.shrink_ratio = shrink_ratio
+        self.box = None  # (x0, y0, x1, y1) in full-frame pixels
+        self._fit_body_area = 0.0
+        self.refits = 0
+
+    def reset(self):
+        self.box = None
+
+    def crop(self, frame):
+        """Returns (image_to_process, box); box is None when the full frame is used."""
+        if self.box is None:
+            return frame, None
+        x0, y0, x1, y1 = self.box
+        crop = frame[y0:y1, x0:x1]
+        cw, ch = x1 - x0, y1 - y0
+        if self.max_side and max(cw, ch) > self.max_side:
+            scale = self.max_side / float(max(cw, ch))
+            crop = cv2.resize(crop, (max(1, int(cw * scale)), max(1, int(ch * scale))),
+                              interpolation=cv2.INTER_AREA)
+        return crop, self.box
+
+    def map_back(self, landmarks, box, w, h):
+        # normalized coords are scale-free, so a downscaled crop maps back the same way
+        if box is None:
+            return
+        x0, y0, x1, y1 = box
+        cw, ch = x1 - x0, y1 - y0
+        for p in landmarks:
+            p.x = (x0 + p.x * cw) / w
+            p.y = (y0 + p.y * ch) / h
+            p.z = p.z * cw / w
+
+    def update(self, landmarks, w, h):
+        """Feeds full-frame landmarks (None = detection lost) and refits the box if needed."""
+        if landmarks is None:
+            self.box = None
+            return
+        xs = [p.x for p in landmarks if p.visibility >= self.min_visibility]
+        ys = [p.y for p in landmarks if p.visibility >= self.min_visibility]
+        if len(xs) < 4:
+            xs = [p.x for p in landmarks]
+            ys = [p.y for p in landmarks]
+        bx0 = max(0.0, min(xs)) * w
+        by0 = max(0.0, min(ys)) * h
+        bx1 = min(1.0, max(xs)) * w
+        by1 = min(1.0, max(ys)) * h
+        if bx1 <= bx0 or by1 <= by0:
+            self.box = None
+            return
+        if self.box is not None and not self._needs_refit(bx0, by0, bx1, by1, w, h):
+            return
+
+        pad = self.pad * max(bx1 - bx0, by1 - by0)
+        x0 = int(max(0, bx0 - pad))
+        y0 = int(max(0, by0 - pad))
+        x1 = int(min(w, bx1 + pad + 1))
+        y1 = int(min(h, by1 + pad + 1))
+        if x1 - x0 < 16 or y1 - y0 < 16:
+            self.box = None
+            return
+        self.box = (x0, y0, x1, y1)
+        self._fit_body_area = (bx1 - bx0) * (by1 - by0)
+        self.refits += 1
+
+    def _needs_refit(self, bx0, by0, bx1, by1, w, h):
+        x0, y0, x1, y1 = self.box
+        mx = self.edge_margin * (x1 - x0)
+        my = self.edge_margin * (y1 - y0)
+        # body near a box edge that could still grow towards the frame border
+        if (bx0 < x0 + mx and x0 > 0) or (by0 < y0 + my and y0 > 0) \
+                or (bx1 > x1 - mx and x1 < w) or (by1 > y1 - my and y1 < h):
+            return True
+        # patient stepped back: tighten the box again
+        return (bx1 - bx0) * (by1 - by0) < self.shrink_ratio * self._fit_body_area
@@ -0,0 +1,308 @@
+# session_log.py
+# Append-only per-patient log of finished sets (session_logs/<patient>.jsonl).
+# Saving a set appends one line instead of rewriting database.json; readers fold
+# the pending records into the loaded DB, and the next full save (or compact())
+# writes them into database.json and drops them from the log.
+#   python session_log.py compact [--db database.json] [--dir session_logs]
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from exercise_defs import DB_FILE, apply_set_entry
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+SESSION_LOG_DIR = "session_logs"
+FSYNC_INTERVAL = 0.5
+# top-level DB key: username -> seq of the last log record already in the DB
+CURSOR_KEY = "session_log"
+# held (across processes) around every append and log rewrite
+LOCK_FILE = ".lock"
+
+logger = logging.getLogger(__name__)
+
+def _safe(username):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", str(username))
+
+class SessionLog:
+    """Each append opens the patient's log, writes one line and closes it again,
+    under a lock file shared with other processes, so no process can append to a
+    log that another one is rewriting. fsync is batched on a background thread
+    every `fsync_interval` seconds (0 = fsync every append). Each record carries
+    a per-patient seq; the DB remembers the last seq it contains, so folding is
+    idempotent even if a compaction was interrupted."""
+    def __init__(self, directory=SESSION_LOG_DIR, fsync_interval=FSYNC_INTERVAL):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._last_seq = {}
+        self._dirty = set()
+        self._wake = threading.Event()
+        self._closed = False
+        self._syncer = None
+        if fsync_interval:
+            self._syncer = threading.Thread(target=self._sync_loop, name="session-log-fsync", daemon=True)
+            self._syncer.start()
+
+    def path(self, username):
+        return os.path.join(self.directory, f"{_safe(username)}.jsonl")
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, LOCK_FILE), "a+") as f:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                    else:
+                        f.seek(0)
+                        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    # ----- writing -----
+    def append(self, username, ex, entry, custom=False):
+        """Logs one finished set (an append_set_result entry). Returns its seq."""
+        with self._locked():
+            self._drop_torn_tail(username)
+            # the file's tail, not a cached value: another process may have appended
+            seq = max(time.time_ns(), self._tail_seq(username) + 1, self._last_seq.get(username, 0) + 1)
+            self._last_seq[username] = seq
+            line = json.dumps({"seq": seq, "patient": username, "ex": ex, "custom": bool(custom), "entry": entry})
+            with open(self.path(username), "a") as f:
+                f.write(line + "\n")
+                f.flush()
+                if not self.fsync_interval:
+                    os.fsync(f.fileno())
+            if self.fsync_interval:
+                self._dirty.add(username)
+                self._wake.set()
+            return seq
+
+    def _drop_torn_tail(self, username):
+        """Truncates a line left unfinished by a crash mid-append back to the last
+        newline, so the next record does not get glued onto it."""
+        try:
+            f = open(self.path(username), "r+b")
+        except FileNotFoundError:
+            return
+        with f:
+            end = size = f.seek(0, os.SEEK_END)
+            if not size:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            while end > 0:
+                start = max(0, end - 65536)
+                f.seek(start)
+                nl = f.read(end - start).rfind(b"\n")
+                if nl >= 0:
+                    end = start + nl + 1
+                    break
+                end = start
+            logger.warning("dropping %d bytes of a torn record at the end of %s", size - end, self.path(username))
+            f.truncate(end)
+
+    def _tail_seq(self, username):
+        try:
+            f = open(self.path(username), "rb")
+        except FileNotFoundError:
+            return 0
+        with f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - 65536))
+            lines = f.read().split(b"\n")
+        # lines[-1] is "" or a torn line, lines[0] may be cut off by the seek
+        for raw in reversed(lines[1:-1] if size > 65536 else lines[:-1]):
+            if raw:
+                try:
+                    return json.loads(raw)["seq"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+        last = 0
+        for rec, _ in self.iter_records(username):
+            last = rec["seq"]
+        return last
+
+    def _sync_loop(self):
+        while not self._closed:
+            self._wake.wait()
+            time.sleep(self.fsync_interval)
+            self.sync()
+
+    def sync(self):
+        """fsyncs every log written since the last sync."""
+        with self._locked():
+            self._wake.clear()
+            dirty, self._dirty = self._dirty, set()
+            for username in dirty:
+                try:
+                    with open(self.path(username), "a") as f:
+                        os.fsync(f.fileno())
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            self._closed = True
+            self._wake.set()
+
+    # ----- reading -----
+    def iter_records(self, username, offset=0):
+        """(record, next_offset) from byte `offset` on; pass next_offset back in to
+        resume. A torn last line (crash mid-append) is not returned, and a line that
+        does not decode is logged and skipped."""
+        try:
+            f = open(self.path(username), "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    return
+                offset += len(raw)
+                try:
+                    rec = json.loads(raw)
+                except ValueError:
+                    rec = None
+                if not isinstance(rec, dict) or "seq" not in rec:
+                    logger.warning("skipping an undecodable record in %s at byte %d", self.path(username), offset - len(raw))
+                    continue
+                yield rec, offset
+
+    def state(self):
+        """Changes whenever a log is appended to, truncated or created."""
+        try:
+            names = sorted(os.listdir(self.directory))
+        except FileNotFoundError:
+            return ()
+        out = []
+        for name in names:
+            if not name.endswith(".jsonl"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            out.append((name, st.st_size, st.st_mtime_ns))
+        return tuple(out)
+
+    def patients(self):
+        """Usernames with a non-empty log."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        out = []
+        for name in names:
+            if name.endswith(".jsonl") and os.path.getsize(os.path.join(self.directory, name)):
+                for rec, _ in self.iter_records(name[:-len(".jsonl")]):
+                    out.append(rec["patient"])
+                    break
+        return out
+
+    # ----- folding / compaction -----
+    def fold_into(self, db, username, applied=()):
+        """Applies the patient's records newer than the DB's cursor to `db`
+        (except the seqs in `applied`, already in it). Returns how many were applied."""
+        start = db.get(CURSOR_KEY, {}).get(username, 0)
+        done = start
+        n = 0
+        for rec, _ in self.iter_records(username):
+            if rec["seq"] <= start:
+                continue
+            done = max(done, rec["seq"])
+            if rec["seq"] in applied:
+                continue
+            apply_set_entry(db, username, rec["ex"], rec["entry"], rec.get("custom", False))
+            n += 1
+        if done != start:
+            db.setdefault(CURSOR_KEY, {})[username] = done
+        return n
+
+    def fold_pending(self, db):
+        """fold_into() for every patient with a log; the DB view a reader sees."""
+        return sum(self.fold_into(db, u) for u in self.patients())
+
+    def discard_folded(self, db):
+        """Drops log records that `db` (already written to disk) contains."""
+        cursors = db.get(CURSOR_KEY, {})
+        with self._locked():
+            for username in self.patients():
+                done = cursors.get(username, 0)
+                records = [rec for rec, _ in self.iter_records(username)]
+                keep = [rec for rec in records if rec["seq"] > done]
+                if len(keep) == len(records):
+                    continue
+                self._dirty.discard(username)
+                path = self.path(username)
+                tmp = path + ".tmp"
+                with open(tmp, "w") as out:
+                    out.writelines(json.dumps(rec) + "\n" for rec in keep)
+                    out.flush()
+                    os.fsync(out.fileno())
+                os.replace(tmp, path)
+
+def compact(db_file=DB_FILE, log=None):
+    """Folds every pending record into `db_file`, then empties the logs.
+    Returns the number of records folded."""
+    log = log or default_log(log_dir_for(db_file))
+    db = {"therapists": {}, "patients": {}}
+    if os.path.exists(db_file):
+        with open(db_file, "r") as f:
+            db = json.load(f)
+    n = log.fold_pending(db)
+    if n:
+        tmp = db_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(db, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, db_file)
+    log.discard_folded(db)
+    return n
+
+_logs = {}
+_log_lock = threading.Lock()
+
+def default_log(directory=SESSION_LOG_DIR):
+    """Shared SessionLog for a log directory (one per process, so seqs stay ordered)."""
+    key = os.path.abspath(directory)
+    with _log_lock:
+        if key not in _logs:
+            _logs[key] = SessionLog(directory)
+        return _logs[key]
+
+def log_dir_for(db_file):
+    """The session_logs/ folder next to a database file."""
+    return os.path.join(os.path.dirname(db_file), SESSION_LOG_DIR)
+
+def main():
+    ap = argparse.ArgumentParser(description="Maintain the append-only session logs.")
+    ap.add_argument("command", choices=["compact"])
+    ap.add_argument("--db", default=DB_FILE)
+    ap.add_argument("--dir", default=SESSION_LOG_DIR)
+    args = ap.parse_args()
+    log = SessionLog(args.dir, fsync_interval=0)
+    print(f"folded {compact(args.db, log)} logged sets into {args.db}")
+    log.close()
+
+if __name__ == "__main__":
+    main()
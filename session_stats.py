@@ -0,0 +1,116 @@
+# session_stats.py
+import math
+import numpy as np
+
+# ---------- constant-memory session statistics ----------
+# Replaces the per-frame angle lists start_exercise used to keep. Angles are
+# already normalised to [0, 180), so a fixed histogram with a running sum per
+# bin is enough to answer the low/high 30% group averages.
+#
+# Tolerances against the old exact path (sorted list + np.mean):
+#   overall_avg, angle_min, angle_max, rep averages: exact up to float summation
+#     order (~1e-12 deg), i.e. identical after the 2-decimal rounding in practice.
+#   range_avg_low / range_avg_high: only the one bin straddling the k-th sample is
+#     approximated by its own mean, so the error is below BIN_WIDTH (0.1 deg) and
+#     usually far smaller.
+ANGLE_MAX = 180.0
+BIN_WIDTH = 0.1
+NUM_BINS = int(ANGLE_MAX / BIN_WIDTH) + 1
+
+class StreamingAngleStats:
+    """Running mean/min/max, low/high group averages and per-rep means in O(1)
+    memory per frame (one float per finished rep)."""
+    def __init__(self, low_pct=0.3):
+        self.low_pct = low_pct
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.bin_counts = [0] * NUM_BINS
+        self.bin_sums = [0.0] * NUM_BINS
+        self.rep_total = 0.0
+        self.rep_count = 0
+        self.rep_averages = []
+
+    def add(self, angle):
+        self.count += 1
+        self.total += angle
+        if angle < self.min:
+            self.min = angle
+        if angle > self.max:
+            self.max = angle
+        i = int(angle / BIN_WIDTH)
+        if i >= NUM_BINS:
+            i = NUM_BINS - 1
+        elif i < 0:
+            i = 0
+        self.bin_counts[i] += 1
+        self.bin_sums[i] += angle
+        self.rep_total += angle
+        self.rep_count += 1
+
+    def add_many(self, values, rep_breaks=()):
+        """Bulk add() for a whole angle series (numpy array, frame order); close_rep()
+        happens just before each index listed in rep_breaks."""
+        v = np.asarray(values, dtype=np.float64)
+        if v.size:
+            self.count += int(v.size)
+            self.total += float(v.sum())
+            self.min = min(self.min, float(v.min()))
+            self.max = max(self.max, float(v.max()))
+            idx = np.clip((v / BIN_WIDTH).astype(np.intp), 0, NUM_BINS - 1)
+            counts = np.bincount(idx, minlength=NUM_BINS)
+            sums = np.bincount(idx, weights=v, minlength=NUM_BINS)
+            self.bin_counts = (np.array(self.bin_counts) + counts).tolist()
+            self.bin_sums = (np.array(self.bin_sums) + sums).tolist()
+        prev = 0
+        for b in rep_breaks:
+            self._add_rep_values(v[prev:b])
+            self.close_rep()
+            prev = b
+        self._add_rep_values(v[prev:])
+
+    def _add_rep_values(self, seg):
+        if seg.size:
+            self.rep_total += float(seg.sum())
+            self.rep_count += int(seg.size)
+
+    def close_rep(self):
+        """Ends the current rep; records its mean angle if it saw any frames."""
+        if self.rep_count:
+            self.rep_averages.append(self.rep_total / self.rep_count)
+            self.rep_total = 0.0
+            self.rep_count = 0
+
+    def pending_rep_average(self):
+        return self.rep_total / self.rep_count if self.rep_count else None
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def low_high_averages(self):
+        """Means of the lowest and highest ceil(count * low_pct) angles (at least
+        one), within BIN_WIDTH of sorting every sample (tests/test_session_stats.py)."""
+        n = self.count
+        if n == 0:
+            return 0.0, 0.0
+        k = max(1, int(math.ceil(n * self.low_pct)))
+        return (self._group_mean(k, range(NUM_BINS)),
+                self._group_mean(k, range(NUM_BINS - 1, -1, -1)))
+
+    def _group_mean(self, k, bins):
+        need = k
+        acc = 0.0
+        for i in bins:
+            c = self.bin_counts[i]
+            if not c:
+                continue
+            if c <= need:
+                acc += self.bin_sums[i]
+                need -= c
+            else:
+                acc += need * (self.bin_sums[i] / c)
+                need = 0
+            if not need:
+                break
+        return acc / k
@@ -0,0 +1,226 @@
+# sharded_store.py
+# Per-patient JSON files for the patient/therapist database (REHABAI_STORAGE=sharded).
+#   <dir>/index.json          patient names -> shard file, therapists, other top-level keys
+#   <dir>/exercises.json      the DB's exercises snapshot
+#   <dir>/patients/<name>.json one patient each (assignments, messages, angle_stats)
+# load_db() reads the two small files; a patient's shard is parsed the first time
+# that patient is looked up, and save_db() rewrites only the shards that changed.
+#   python sharded_store.py [--json database.json] [--dir db_shards] [--export out.json]
+import argparse
+import json
+import os
+import re
+import threading
+from sqlite_store import PatientMap, STORAGE_ENV, _digest
+
+SHARD_DIR = "db_shards"
+SHARD_DIR_ENV = "REHABAI_SHARD_DIR"
+INDEX_FILE = "index.json"
+EXERCISES_SHARD = "exercises.json"
+PATIENTS_SUBDIR = "patients"
+
+def _safe(username):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", str(username)) or "_"
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+# ---------- store ----------
+class ShardedStore:
+    """database.json-compatible storage split into one file per patient. Every
+    file is written to a temp file and os.replace()d (fsync'd unless fsync=False)."""
+    def __init__(self, directory=SHARD_DIR, fsync=True):
+        self.directory = directory
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        self._files = {}
+        self._index_digest = None
+        self._exercises_digest = None
+        os.makedirs(os.path.join(directory, PATIENTS_SUBDIR), exist_ok=True)
+
+    def close(self):
+        pass
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def data_version(self):
+        """Changes whenever any shard is written (a replaced patient file
+        updates the patients/ directory's mtime)."""
+        return (_stat_key(self._path(INDEX_FILE)), _stat_key(self._path(EXERCISES_SHARD)),
+                _stat_key(self._path(PATIENTS_SUBDIR)))
+
+    def _write_json(self, path, obj):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(obj, f, indent=4)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _read_json(self, path, default):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+
+    # ----- reads -----
+    def _read_index(self):
+        index = self._read_json(self._path(INDEX_FILE), {})
+        index.setdefault("patients", {})
+        index.setdefault("db", {"therapists": {}})
+        return index
+
+    def patient_names(self):
+        """From index.json alone; no patient shard is opened."""
+        with self._lock:
+            index = self._read_index()
+            self._files = dict(index["patients"])
+            return list(self._files)
+
+    def load_patient(self, username):
+        """One patient's dict from its shard, or None."""
+        with self._lock:
+            name = self._files.get(username)
+            if name is None:
+                self.patient_names()
+                name = self._files.get(username)
+            if name is None:
+                return None
+            return self._read_json(self._path(PATIENTS_SUBDIR, name), None)
+
+    def load_db(self):
+        """The database as database.json's dict; db["patients"] is a PatientMap."""
+        with self._lock:
+            index = self._read_index()
+            self._files = dict(index["patients"])
+            self._index_digest = _digest(index)
+            db = dict(index["db"])
+            exercises = self._read_json(self._path(EXERCISES_SHARD), None)
+            self._exercises_digest = _digest(exercises)
+            if exercises is not None:
+                db["exercises"] = exercises
+            db["patients"] = PatientMap(self, list(self._files))
+            return db
+
+    # ----- writes -----
+    def _shard_name(self, username):
+        name = self._files.get(username)
+        if name is None:
+            taken = set(self._files.values())
+            base = name = _safe(username)
+            n = 1
+            while name + ".json" in taken:
+                n += 1
+                name = f"{base}-{n}"
+            name = self._files[username] = name + ".json"
+        return name
+
+    def _write_patient(self, username, p):
+        self._write_json(self._path(PATIENTS_SUBDIR, self._shard_name(username)), p)
+
+    def save_db(self, db):
+        """Writes back a load_db() dict (or any database.json-shaped dict). With a
+        PatientMap only patients that were looked up and changed are rewritten, and
+        patients another process added meanwhile are kept in the index; a plain
+        dict replaces the whole store."""
+        with self._lock:
+            patients = db.get("patients", {})
+            on_disk = self._read_index()["patients"]
+            if isinstance(patients, PatientMap):
+                on_disk.update(self._files)
+                self._files = on_disk
+                removed = [u for u in patients._deleted if u in self._files]
+                patients._deleted.clear()
+                for username, p in list(patients.changed()):
+                    self._write_patient(username, p)
+                    patients.mark_saved(username)
+            else:
+                self._files = on_disk
+                removed = [u for u in self._files if u not in patients]
+                for username, p in patients.items():
+                    self._write_patient(username, p)
+            removed_files = [self._files.pop(u) for u in removed]
+            # patients first in the caller's order, then any another process added
+            # since our load_db() (a plain dict has none left over)
+            index = {"patients": {u: self._files[u] for u in patients if u in self._files},
+                     "db": {k: v for k, v in db.items() if k not in ("patients", "exercises")}}
+            for u, name in self._files.items():
+                index["patients"].setdefault(u, name)
+            digest = _digest(index)
+            if digest != self._index_digest:
+                self._write_json(self._path(INDEX_FILE), index)
+                self._index_digest = digest
+            for name in removed_files:
+                try:
+                    os.remove(self._path(PATIENTS_SUBDIR, name))
+                except FileNotFoundError:
+                    pass
+            exercises = db.get("exercises")
+            digest = _digest(exercises)
+            if digest != self._exercises_digest:
+                if exercises is None:
+                    try:
+                        os.remove(self._path(EXERCISES_SHARD))
+                    except FileNotFoundError:
+                        pass
+                else:
+                    self._write_json(self._path(EXERCISES_SHARD), exercises)
+                self._exercises_digest = digest
+
+# ---------- migration ----------
+def migrate_json(json_path, store):
+    """Splits a database.json into `store` (replacing what it holds)."""
+    with open(json_path, "r") as f:
+        db = json.load(f)
+    store.save_db(db)
+    return db
+
+def export_json(store, json_path):
+    db = store.load_db()
+    db["patients"] = {u: db["patients"][u] for u in db["patients"]}
+    with open(json_path, "w") as f:
+        json.dump(db, f, indent=4)
+
+_store = None
+_store_lock = threading.Lock()
+
+def store_from_env(json_path="database.json"):
+    """The shared ShardedStore when REHABAI_STORAGE=sharded, else None. The shard
+    directory (REHABAI_SHARD_DIR, default db_shards/ next to `json_path`) is
+    created from `json_path` on first use."""
+    global _store
+    if os.environ.get(STORAGE_ENV, "json").lower() != "sharded":
+        return None
+    with _store_lock:
+        if _store is None:
+            directory = os.environ.get(SHARD_DIR_ENV) or os.path.join(os.path.dirname(json_path), SHARD_DIR)
+            fresh = not os.path.exists(os.path.join(directory, INDEX_FILE))
+            _store = ShardedStore(directory, fsync=os.environ.get("REHABAI_DURABILITY", "fsync") != "replace")
+            if fresh and os.path.exists(json_path):
+                migrate_json(json_path, _store)
+        return _store
+
+def main():
+    ap = argparse.ArgumentParser(description="Split database.json into per-patient shards (or join them back).")
+    ap.add_argument("--json", default="database.json")
+    ap.add_argument("--dir", default=SHARD_DIR)
+    ap.add_argument("--export", metavar="OUT_JSON", help="write the shards out as one JSON file instead")
+    args = ap.parse_args()
+    store = ShardedStore(args.dir)
+    if args.export:
+        export_json(store, args.export)
+        print(f"exported {args.dir} -> {args.export}")
+    else:
+        db = migrate_json(args.json, store)
+        sessions = sum(len(h) for p in db.get("patients", {}).values() for h in p.get("angle_stats", {}).values())
+        print(f"migrated {len(db.get('patients', {}))} patients, {sessions} sessions -> {args.dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+# sqlite_store.py
+# SQLite storage for the patient/therapist database (REHABAI_STORAGE=sqlite).
+# load_db() still returns the database.json-shaped dict the pages work on, but
+# patients are read lazily and save_db() only rewrites the patients that changed,
+# so a save costs one patient's rows instead of the whole clinic's history.
+#   python sqlite_store.py [--json database.json] [--sqlite rehabai.sqlite3] [--export out.json]
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+SQLITE_FILE = "rehabai.sqlite3"
+STORAGE_ENV = "REHABAI_STORAGE"
+SQLITE_PATH_ENV = "REHABAI_SQLITE_PATH"
+
+# per-exercise patient dicts kept in the assignments table, in this order
+ASSIGNMENT_FIELDS = ("assigned", "assigned_sets", "sets_completed", "completed", "custom_optimal")
+# patient keys with their own tables; anything else goes to patients.extra
+_PATIENT_TABLE_KEYS = set(ASSIGNMENT_FIELDS) | {"password", "messages", "angle_stats"}
+MESSAGE_DIRECTIONS = ("from_therapist", "from_patient")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS therapists (username TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS exercises (name TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS patients (
+    username TEXT PRIMARY KEY,
+    password TEXT,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS assignments (
+    patient TEXT NOT NULL REFERENCES patients(username) ON DELETE CASCADE,
+    field TEXT NOT NULL,
+    exercise TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (patient, field, exercise)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    patient TEXT NOT NULL REFERENCES patients(username) ON DELETE CASCADE,
+    exercise TEXT NOT NULL,
+    timestamp TEXT,
+    reps INTEGER,
+    deviation_percent REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_patient_exercise_time ON sessions (patient, exercise, timestamp);
+CREATE TABLE IF NOT EXISTS rep_averages (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    value REAL,
+    PRIMARY KEY (session_id, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    patient TEXT NOT NULL REFERENCES patients(username) ON DELETE CASCADE,
+    direction TEXT NOT NULL,
+    timestamp TEXT,
+    text TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_patient_time ON messages (patient, timestamp);
+"""
+
+def _digest(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()
+
+# ---------- lazily loaded patients ----------
+class PatientMap(MutableMapping):
+    """db["patients"] of a loaded SQLite database: the names come from one query
+    and each patient is read the first time it is looked up. Remembers what it
+    loaded so save_db() can tell which patients were changed."""
+    def __init__(self, store, names):
+        self._store = store
+        self._names = dict.fromkeys(names)
+        self._loaded = {}
+        self._digests = {}
+        self._deleted = set()
+
+    def __getitem__(self, username):
+        if username in self._loaded:
+            return self._loaded[username]
+        if username not in self._names:
+            raise KeyError(username)
+        p = self._store.load_patient(username)
+        self._loaded[username] = p
+        self._digests[username] = _digest(p)
+        return p
+
+    def __setitem__(self, username, patient):
+        self._names[username] = None
+        self._loaded[username] = patient
+        self._deleted.discard(username)
+
+    def __delitem__(self, username):
+        del self._names[username]
+        self._loaded.pop(username, None)
+        self._deleted.add(username)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, username):
+        return username in self._names
+
+    def changed(self):
+        """(username, patient) for every patient added or modified since loading."""
+        for u, p in self._loaded.items():
+            if self._digests.get(u) != _digest(p):
+                yield u, p
+
+    def mark_saved(self, username):
+        self._digests[username] = _digest(self._loaded[username])
+
+    def is_saved(self, username):
+        """True if the patient is loaded and unchanged since it was read or saved."""
+        p = self._loaded.get(username)
+        return p is not None and self._digests.get(username) == _digest(p)
+
+# ---------- store ----------
+class SqliteStore:
+    """database.json-compatible storage in one SQLite file (WAL mode)."""
+    def __init__(self, path=SQLITE_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def data_version(self):
+        """Changes whenever another connection (process) commits a write."""
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    # ----- reads -----
+    def patient_names(self):
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT username FROM patients ORDER BY rowid")]
+
+    def load_patient(self, username):
+        """One patient in the database.json shape, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT password, extra FROM patients WHERE username = ?",
+                                     (username,)).fetchone()
+            if row is None:
+                return None
+            p = {"password": row[0]}
+            p.update(json.loads(row[1]))
+            for field in ASSIGNMENT_FIELDS:
+                p[field] = {}
+            for field, ex, value in self._conn.execute(
+                    "SELECT field, exercise, value FROM assignments WHERE patient = ? ORDER BY rowid", (username,)):
+                p.setdefault(field, {})[ex] = json.loads(value)
+            p["messages"] = {d: [] for d in MESSAGE_DIRECTIONS}
+            for direction, ts, text, extra in self._conn.execute(
+                    "SELECT direction, timestamp, text, extra FROM messages WHERE patient = ? ORDER BY id", (username,)):
+                m = {"timestamp": ts, "text": text}
+                if extra:
+                    m.update(json.loads(extra))
+                p["messages"].setdefault(direction, []).append(m)
+            p["angle_stats"] = self._load_sessions(username)
+            return p
+
+    def _load_sessions(self, username):
+        entries = {}
+        stats = {}
+        for sid, ex, data in self._conn.execute(
+                "SELECT id, exercise, data FROM sessions WHERE patient = ? ORDER BY id", (username,)):
+            e = json.loads(data)
+            entries[sid] = e
+            stats.setdefault(ex, []).append(e)
+        for sid, value in self._conn.execute(
+                "SELECT r.session_id, r.value FROM rep_averages r JOIN sessions s ON s.id = r.session_id "
+                "WHERE s.patient = ? ORDER BY r.session_id, r.idx", (username,)):
+            entries[sid]["rep_averages"].append(value)
+        return stats
+
+    def load_db(self):
+        """The whole database as database.json's dict; db["patients"] is a PatientMap."""
+        with self._lock:
+            db = {k: json.loads(v) for k, v in self._conn.execute("SELECT key, value FROM meta ORDER BY rowid")}
+            db["therapists"] = {u: json.loads(d) for u, d in
+                                self._conn.execute("SELECT username, data FROM therapists ORDER BY rowid")}
+            db["patients"] = PatientMap(self, self.patient_names())
+            exercises = {n: json.loads(d) for n, d in
+                         self._conn.execute("SELECT name, data FROM exercises ORDER BY rowid")}
+            if exercises:
+                db["exercises"] = exercises
+            return db
+
+    # ----- writes -----
+    def _write_patient(self, username, p):
+        c = self._conn
+        extra = {k: v for k, v in p.items() if k not in _PATIENT_TABLE_KEYS}
+        c.execute("INSERT INTO patients (username, password, extra) VALUES (?, ?, ?) "
+                  "ON CONFLICT(username) DO UPDATE SET password = excluded.password, extra = excluded.extra",
+                  (username, p.get("password"), json.dumps(extra)))
+        c.execute("DELETE FROM assignments WHERE patient = ?", (username,))
+        c.executemany("INSERT INTO assignments (patient, field, exercise, value) VALUES (?, ?, ?, ?)",
+                      [(username, field, ex, json.dumps(v))
+                       for field in ASSIGNMENT_FIELDS for ex, v in (p.get(field) or {}).items()])
+        c.execute("DELETE FROM messages WHERE patient = ?", (username,))
+        for direction, msgs in (p.get("messages") or {}).items():
+            for m in msgs:
+                self._insert_message(username, direction, m)
+        # rep_averages rows go with their sessions (ON DELETE CASCADE)
+        c.execute("DELETE FROM sessions WHERE patient = ?", (username,))
+        for ex, hist in (p.get("angle_stats") or {}).items():
+            for entry in hist:
+                self._insert_session(username, ex, entry)
+
+    def _insert_message(self, username, direction, m):
+        extra = {k: v for k, v in m.items() if k not in ("timestamp", "text")}
+        self._conn.execute("INSERT INTO messages (patient, direction, timestamp, text, extra) VALUES (?, ?, ?, ?, ?)",
+                           (username, direction, m.get("timestamp"), m.get("text"),
+                            json.dumps(extra) if extra else None))
+
+    def _insert_session(self, username, ex, entry):
+        # rep_averages live in their own table; the JSON keeps an empty list in
+        # their place so the entry's key order survives the round trip
+        reps = entry.get("rep_averages")
+        data = dict(entry)
+        if reps is not None:
+            data["rep_averages"] = []
+        deviation = entry.get("deviation_percent")
+        cur = self._conn.execute(
+            "INSERT INTO sessions (patient, exercise, timestamp, reps, deviation_percent, data) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (username, ex, entry.get("timestamp"), entry.get("reps"),
+             float(deviation) if isinstance(deviation, (int, float)) else None, json.dumps(data)))
+        if reps:
+            self._conn.executemany("INSERT INTO rep_averages (session_id, idx, value) VALUES (?, ?, ?)",
+                                   [(cur.lastrowid, i, v) for i, v in enumerate(reps)])
+
+    def _replace_table(self, table, key, rows):
+        self._conn.execute(f"DELETE FROM {table}")
+        self._conn.executemany(f"INSERT INTO {table} ({key}, data) VALUES (?, ?)",
+                               [(k, json.dumps(v)) for k, v in rows.items()])
+
+    def save_db(self, db):
+        """Writes back a load_db() dict (or any database.json-shaped dict). With a
+        PatientMap only patients that were looked up and changed are rewritten;
+        patients are only deleted when removed from the map."""
+        with self._lock, self._conn:
+            patients = db.get("patients", {})
+            if isinstance(patients, PatientMap):
+                for username in patients._deleted:
+                    self._conn.execute("DELETE FROM patients WHERE username = ?", (username,))
+                patients._deleted.clear()
+                for username, p in list(patients.changed()):
+                    self._write_patient(username, p)
+                    patients.mark_saved(username)
+            else:
+                for username, p in patients.items():
+                    self._write_patient(username, p)
+            self._replace_table("therapists", "username", db.get("therapists", {}))
+            self._replace_table("exercises", "name", db.get("exercises", {}))
+            self._conn.execute("DELETE FROM meta")
+            self._conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                   [(k, json.dumps(v)) for k, v in db.items()
+                                    if k not in ("therapists", "patients", "exercises")])
+
+    def append_session(self, username, ex, entry, counters=None):
+        """Adds one angle_stats entry without touching anything else, plus the
+        exercise's per-patient counters ({field: value}, e.g. completed) if given."""
+        with self._lock, self._conn:
+            self._insert_session(username, ex, entry)
+            self._conn.executemany(
+                "INSERT INTO assignments (patient, field, exercise, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(patient, field, exercise) DO UPDATE SET value = excluded.value",
+                [(username, field, ex, json.dumps(v)) for field, v in (counters or {}).items()])
+
+    def add_message(self, username, direction, message):
+        with self._lock, self._conn:
+            self._insert_message(username, direction, message)
+
+# ---------- migration ----------
+def migrate_json(json_path, store):
+    """Copies a database.json into `store` (replacing what it holds)."""
+    with open(json_path, "r") as f:
+        db = json.load(f)
+    with store._lock, store._conn:
+        store._conn.execute("DELETE FROM patients")
+    store.save_db(db)
+    return db
+
+def export_json(store, json_path):
+    db = store.load_db()
+    db["patients"] = {u: db["patients"][u] for u in db["patients"]}
+    with open(json_path, "w") as f:
+        json.dump(db, f, indent=4)
+
+_store = None
+_store_lock = threading.Lock()
+
+def store_from_env(json_path="database.json"):
+    """The shared SqliteStore when REHABAI_STORAGE=sqlite, else None. A missing
+    SQLite file is created from `json_path` on first use."""
+    global _store
+    if os.environ.get(STORAGE_ENV, "json").lower() != "sqlite":
+        return None
+    with _store_lock:
+        if _store is None:
+            path = os.environ.get(SQLITE_PATH_ENV, SQLITE_FILE)
+            fresh = not os.path.exists(path)
+            _store = SqliteStore(path)
+            if fresh and os.path.exists(json_path):
+                migrate_json(json_path, _store)
+        return _store
+
+def main():
+    ap = argparse.ArgumentParser(description="Migrate database.json into the SQLite store (or back).")
+    ap.add_argument("--json", default="database.json")
+    ap.add_argument("--sqlite", default=SQLITE_FILE)
+    ap.add_argument("--export", metavar="OUT_JSON", help="write the SQLite store out as JSON instead")
+    args = ap.parse_args()
+    store = SqliteStore(args.sqlite)
+    if args.export:
+        export_json(store, args.export)
+        print(f"exported {args.sqlite} -> {args.export}")
+    else:
+        db = migrate_json(args.json, store)
+        sessions = sum(len(h) for p in db.get("patients", {}).values() for h in p.get("angle_stats", {}).values())
+        print(f"migrated {len(db.get('patients', {}))} patients, {sessions} sessions -> {args.sqlite}")
+    store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# stage_timer.py
+import json
+import os
+import threading
+import time
+from array import array
+import numpy as np
+
+# ---------- per-stage frame timing ----------
+# Stages report (name, start) against a frame key (the frame's source timestamp,
+# which every stage of the tracker already has); the frame is closed after it
+# was displayed. Works across the pipelined runner's threads because the key,
+# not the calling thread, identifies the frame.
+STAGES = ("capture", "flip", "color", "pose", "logic", "draw", "wait_key")
+clock = time.perf_counter
+
+class StageTimer:
+    """Collects per-stage durations, end-to-end frame latency and display FPS.
+    `span_path` additionally streams one JSON line per frame."""
+    def __init__(self, span_path=None, fps_smoothing=0.1):
+        self.durations = {s: array("d") for s in STAGES}
+        self.latencies = array("d")
+        self.frames = 0
+        self.fps = 0.0
+        self.fps_smoothing = fps_smoothing
+        self._pending = {}
+        self._last_end = None
+        self._lock = threading.Lock()
+        self._spans = None
+        if span_path:
+            d = os.path.dirname(span_path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            self._spans = open(span_path, "w")
+
+    def add(self, stage, start, key):
+        """Records `stage` as running from `start` (a clock() value) until now."""
+        end = clock()
+        rec = self._pending.get(key)
+        if rec is None:
+            rec = self._pending.setdefault(key, {"start": start})
+        rec[stage] = end - start
+        self.durations[stage].append(end - start)
+        return end
+
+    def end_frame(self, key):
+        """Closes a displayed frame: latency from its first stage to now, FPS, span line."""
+        now = clock()
+        with self._lock:
+            rec = self._pending.pop(key, None)
+            if len(self._pending) > 8:
+                # frames dropped by the pipelined runner never reach the display
+                for k in [k for k in list(self._pending) if k < key]:
+                    del self._pending[k]
+            self.frames += 1
+            if self._last_end is not None and now > self._last_end:
+                inst = 1.0 / (now - self._last_end)
+                self.fps = inst if self.fps == 0.0 else self.fps + self.fps_smoothing * (inst - self.fps)
+            self._last_end = now
+            if rec is None:
+                return
+            latency = now - rec.pop("start")
+            self.latencies.append(latency)
+            if self._spans is not None:
+                span = {"t": key, "latency_ms": round(latency * 1000.0, 3)}
+                span.update((s, round(v * 1000.0, 3)) for s, v in rec.items())
+                self._spans.write(json.dumps(span) + "\n")
+
+    def last_ms(self, stage):
+        d = self.durations[stage]
+        return d[-1] * 1000.0 if d else 0.0
+
+    def overlay_text(self):
+        lat = self.latencies[-1] * 1000.0 if self.latencies else 0.0
+        return f"FPS {self.fps:4.1f}  latency {lat:5.1f} ms  pose {self.last_ms('pose'):5.1f} ms"
+
+    def summary(self):
+        """Per-stage mean/p50/p95/max in milliseconds plus frame latency and FPS."""
+        def describe(values):
+            if not len(values):
+                return None
+            ms = np.frombuffer(values, dtype=np.float64) * 1000.0
+            return {"mean_ms": round(float(ms.mean()), 3), "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                    "p95_ms": round(float(np.percentile(ms, 95)), 3), "max_ms": round(float(ms.max()), 3)}
+        stages = {s: describe(v) for s, v in self.durations.items() if len(v)}
+        return {"frames": int(self.frames), "fps": float(round(self.fps, 2)),
+                "latency": describe(self.latencies), "stages": stages}
+
+    def close(self):
+        if self._spans is not None:
+            self._spans.close()
+            self._spans = None
+
+def make_timer(profile):
+    """StageTimer for start_exercise's `profile` argument (True, a JSONL span path, or a StageTimer)."""
+    if not profile:
+        return None
+    if isinstance(profile, StageTimer):
+        return profile
+    if isinstance(profile, (str, os.PathLike)):
+        return StageTimer(span_path=os.fspath(profile))
+    return StageTimer()
@@ -0,0 +1,46 @@
+# tests/conftest.py
+import copy
+import json
+import os
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _sample_db():
+    with open(os.path.join(REPO_DIR, "database.json"), "r") as f:
+        db = json.load(f)
+    db["patients"]["José K."] = {
+        "password": "pw",
+        "assigned": {"squat": 10},
+        "assigned_sets": {"knee lift": 3},
+        "sets_completed": {"knee lift": 1},
+        "completed": {"squat": 12, "knee lift": 8},
+        "custom_optimal": {"squat": [80, 120], "curl": None},
+        "messages": {
+            "from_therapist": [{"timestamp": "2026-01-02T10:00:00", "text": "Slower reps", "read": False}],
+            "from_patient": [{"timestamp": "2026-01-02T11:00:00", "text": "Ok!"}],
+        },
+        "angle_stats": {
+            "squat": [
+                {"timestamp": "2026-01-02T10:30:00", "reps": 12, "rep_averages": [101.5, 99.25, 97.0],
+                 "overall_avg": 99.25, "opt_range": [80, 120], "deviation_percent": 0.0},
+                {"timestamp": "2026-01-03T10:30:00", "reps": 0, "rep_averages": [],
+                 "overall_avg": None, "opt_range": [80, 120], "deviation_percent": 0.0},
+            ],
+            "knee lift": [
+                {"timestamp": "2026-01-02T10:40:00", "reps": 8, "overall_avg": 45.5, "opt_range": None,
+                 "deviation_percent": 12.5, "assigned_sets": 3, "sets_completed_after": 1},
+            ],
+        },
+        "streak_days": 4,
+    }
+    return db
+
+@pytest.fixture
+def sample_db():
+    """database.json plus a patient with the less common shapes (extra keys,
+    message fields, sessions without rep averages, a non-ASCII name)."""
+    return copy.deepcopy(_SAMPLE)
+
+_SAMPLE = _sample_db()
@@ -0,0 +1,71 @@
+# tests/test_deviation_batch.py
+# compute_deviation_batch against the per-session _compute_deviation_repwise on
+# random ragged inputs, including NaN/inf rep averages, bad ranges and empty sessions.
+#   python -m pytest -q tests
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from deviation_batch import compute_deviation_batch, pack_opt_ranges, pack_ragged, score_sessions
+
+tracker = pytest.importorskip("exercise_tracker")  # needs OpenCV/MediaPipe installed
+
+def random_sessions(rng, m):
+    rep_lists, opt_ranges = [], []
+    for _ in range(m):
+        n = int(rng.choice([0, 0, 1, 2, 3, 4, 5, 8, 13, 30]))
+        if rng.random() < 0.2:
+            # few distinct values, so the IQR is often 0
+            reps = rng.choice([40.0, 90.0, 90.0, 135.5], size=n)
+        else:
+            reps = rng.uniform(-30.0, 210.0, size=n).round(int(rng.integers(0, 4)))
+        special = rng.random(n)
+        reps[special < 0.05] = np.nan
+        reps[(special >= 0.05) & (special < 0.07)] = np.inf
+        reps[(special >= 0.07) & (special < 0.08)] = -np.inf
+        rep_lists.append(reps.tolist())
+
+        kind = rng.random()
+        if kind < 0.05:
+            opt_ranges.append((None, None))
+        elif kind < 0.1:
+            opt_ranges.append((float("nan"), 120.0))
+        elif kind < 0.15:
+            opt_ranges.append((120.0, float("nan")))
+        elif kind < 0.25:
+            lo = float(rng.integers(0, 180))
+            opt_ranges.append((lo, lo - float(rng.integers(0, 30))))  # empty or reversed
+        else:
+            lo = float(rng.uniform(-10.0, 150.0))
+            opt_ranges.append((lo, lo + float(rng.uniform(1.0, 120.0))))
+    return rep_lists, opt_ranges
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("cap", [200.0, 50.0])
+def test_batch_matches_scalar_deviation(seed, cap):
+    rng = np.random.default_rng(seed)
+    rep_lists, opt_ranges = random_sessions(rng, 200)
+    expected = [tracker._compute_deviation_repwise(r, lo, hi, cap) for r, (lo, hi) in zip(rep_lists, opt_ranges)]
+    got = score_sessions(rep_lists, opt_ranges, cap)
+    # bit for bit, not approximately
+    assert got == expected
+
+def test_empty_sessions_and_inputs():
+    assert score_sessions([], []) == []
+    assert score_sessions([[], [], []], [(60, 120)] * 3) == [0.0, 0.0, 0.0]
+    rep_lists = [[], [float("nan")], [], [100.0, 130.0], []]
+    ranges = [(60, 120)] * 5
+    expected = [tracker._compute_deviation_repwise(r, 60, 120) for r in rep_lists]
+    assert score_sessions(rep_lists, ranges) == expected
+
+def test_scalar_bounds_broadcast():
+    rng = np.random.default_rng(99)
+    rep_lists, _ = random_sessions(rng, 50)
+    values, offsets = pack_ragged(rep_lists)
+    got = compute_deviation_batch(values, offsets, 60.0, 120.0)["deviation"].tolist()
+    assert got == [tracker._compute_deviation_repwise(r, 60.0, 120.0) for r in rep_lists]
+    lo, hi = pack_opt_ranges([(60, 120)] * len(rep_lists))
+    assert compute_deviation_batch(values, offsets, lo, hi)["deviation"].tolist() == got
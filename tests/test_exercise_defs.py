@@ -0,0 +1,29 @@
+# tests/test_exercise_defs.py
+# opt_range precedence for a set: patient override, exercise optimal_range, built-in.
+#   python -m pytest -q tests
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from exercise_defs import OPTIMAL_RANGES, resolve_opt_range
+
+def test_precedence():
+    custom = {"optimal_range": {"joint": "LEFT_KNEE", "min": 40, "max": "100"}}
+    assert resolve_opt_range({"custom_optimal": {"squat": [70, 110]}}, "squat", custom) == (70, 110)
+    assert resolve_opt_range({}, "squat", custom) == (40.0, 100.0)
+    assert resolve_opt_range({}, "squat", None) == OPTIMAL_RANGES["squat"]
+    assert resolve_opt_range({}, "my lift", None) == (None, None)
+
+@pytest.mark.parametrize("bad", [
+    {"min": "low", "max": 100},
+    {"min": None, "max": 100},
+    {"min": [1], "max": 100},
+    {"min": 40},
+    "40-100",
+])
+def test_malformed_exercise_range_falls_back(bad):
+    custom = {"optimal_range": bad}
+    assert resolve_opt_range({}, "squat", custom) == OPTIMAL_RANGES["squat"]
+    assert resolve_opt_range({}, "my lift", custom) == (None, None)
@@ -0,0 +1,45 @@
+# tests/test_landmark_log.py
+# Capture switch and retention of per-set landmark files.
+#   python -m pytest -q tests
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from landmark_log import (CAPTURE_ENV, KEEP_CAPTURES, KEEP_ENV, LandmarkWriter, capture_enabled,
+                          captures_to_keep, landmark_capture_path, open_session, prune_captures)
+
+def test_capture_is_off_unless_enabled(monkeypatch):
+    monkeypatch.delenv(CAPTURE_ENV, raising=False)
+    assert not capture_enabled()
+    for value, on in (("1", True), ("yes", True), ("On", True), ("0", False), ("", False), ("no", False)):
+        monkeypatch.setenv(CAPTURE_ENV, value)
+        assert capture_enabled() is on
+
+def test_keep_count_from_env(monkeypatch):
+    monkeypatch.delenv(KEEP_ENV, raising=False)
+    assert captures_to_keep() == KEEP_CAPTURES
+    monkeypatch.setenv(KEEP_ENV, "3")
+    assert captures_to_keep() == 3
+    monkeypatch.setenv(KEEP_ENV, "many")
+    assert captures_to_keep() == KEEP_CAPTURES
+
+def test_prune_keeps_the_newest_captures(tmp_path):
+    base = str(tmp_path / "landmarks")
+    paths = []
+    for i in range(5):
+        path = landmark_capture_path("José K.", "squat", base_dir=base)
+        with LandmarkWriter(path, {"width": 640, "height": 480}) as w:
+            w.append(float(i), np.zeros((33, 4), dtype=np.float32))
+        os.utime(path, ns=(i * 10**9, i * 10**9))
+        paths.append(path)
+    other = landmark_capture_path("bob", "curl", base_dir=base)
+    LandmarkWriter(other).close()
+
+    assert sorted(prune_captures("José K.", keep=2, base_dir=base)) == sorted(paths[:3])
+    assert [os.path.exists(p) for p in paths] == [False, False, False, True, True]
+    assert len(open_session(paths[-1])) == 1
+    assert os.path.exists(other)
+    assert prune_captures("José K.", keep=0, base_dir=base) == []
+    assert prune_captures("nobody", keep=1, base_dir=base) == []
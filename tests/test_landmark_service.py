@@ -0,0 +1,30 @@
+# tests/test_landmark_service.py
+# The ingest service resolves exercises and persists sets through its own database.
+#   python -m pytest -q tests
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from landmark_service import LandmarkService
+
+pytest.importorskip("exercise_tracker")  # _resolve loads the tracker
+
+def test_definition_and_range_come_from_the_services_db(tmp_path, monkeypatch, sample_db):
+    monkeypatch.setenv("REHABAI_FLUSH_DELAY", "0")
+    monkeypatch.delenv("REHABAI_STORAGE", raising=False)
+    sample_db["exercises"] = {"service only lift": {"joints": {"RIGHT_KNEE": [30, 110]},
+                                                    "optimal_range": {"min": 40, "max": 100}}}
+    with open(tmp_path / "clinic.json", "w") as f:
+        json.dump(sample_db, f)
+    service = LandmarkService(str(tmp_path / "clinic.json"))
+    try:
+        joints, primary, opt_range, meta = service._resolve("patient2", "service only lift", None)
+        assert joints == {"RIGHT_KNEE": [30, 110]}
+        assert primary == "RIGHT_KNEE"
+        assert opt_range == (40.0, 100.0)
+        assert meta == sample_db["exercises"]["service only lift"]
+    finally:
+        service.close()
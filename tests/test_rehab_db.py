@@ -0,0 +1,235 @@
+# tests/test_rehab_db.py
+# The JSON Repository on temp databases: debounced writes, merging what another
+# process wrote meanwhile, and failed writes.
+#   python -m pytest -q tests
+import copy
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rehab_db
+from exercise_defs import append_set_result
+from rehab_db import Repository, ensure_patient_structure, merge_db
+from session_log import CURSOR_KEY, SessionLog
+
+def write_json(path, db):
+    with open(path, "w") as f:
+        json.dump(db, f, indent=4)
+
+def read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def new_repo(tmp_path, **kw):
+    kw.setdefault("durability", "replace")
+    log = SessionLog(str(tmp_path / "session_logs"), fsync_interval=0)
+    return Repository(str(tmp_path / "database.json"), log=log, **kw)
+
+def wait_for(cond, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.01)
+
+# ---------- failed writes ----------
+def test_failed_background_write_stays_pending_and_retries(tmp_path, sample_db, monkeypatch, caplog):
+    write_json(tmp_path / "database.json", sample_db)
+    repo = new_repo(tmp_path, flush_delay=0.01, flush_deadline=0.05)
+    real_write = repo._write_file
+    failures = []
+
+    def failing_write(db):
+        if not failures:
+            failures.append(1)
+            raise OSError(28, "No space left on device")
+        real_write(db)
+    monkeypatch.setattr(repo, "_write_file", failing_write)
+
+    repo.patient("patient2")["assigned"]["squat"] = 42
+    repo.save_db()
+    wait_for(lambda: failures)
+    assert "database write to" in caplog.text
+    wait_for(lambda: repo.writes == 1)
+    assert repo.write_error is None and not repo.pending()
+    assert read_json(tmp_path / "database.json")["patients"]["patient2"]["assigned"]["squat"] == 42
+
+def test_explicit_flush_raises_when_the_write_fails(tmp_path, sample_db, monkeypatch):
+    write_json(tmp_path / "database.json", sample_db)
+    repo = new_repo(tmp_path, flush_delay=60, flush_deadline=60)
+    repo.patient("patient2")["assigned"]["squat"] = 42
+    repo.save_db()
+
+    def failing_write(db):
+        raise OSError(13, "Permission denied")
+    monkeypatch.setattr(repo, "_write_file", failing_write)
+    with pytest.raises(OSError):
+        repo.flush()
+    assert repo.pending()
+    monkeypatch.undo()
+    assert repo.flush()
+    assert read_json(tmp_path / "database.json")["patients"]["patient2"]["assigned"]["squat"] == 42
+
+# ---------- three-way merge ----------
+def msg(text):
+    return {"timestamp": "2026-01-06T12:00:00", "text": text}
+
+def test_merge_keeps_both_sides_changes(sample_db):
+    base = sample_db
+    ours, theirs = copy.deepcopy(base), copy.deepcopy(base)
+    ours["patients"]["patient1"]["assigned"]["squat"] = 30
+    ours["patients"]["patient2"]["messages"]["from_therapist"].append(msg("ours"))
+    theirs["patients"]["patient1"]["assigned_sets"]["flex"] = 4
+    theirs["patients"]["patient2"]["messages"]["from_therapist"].append(msg("theirs"))
+    theirs["patients"]["dave"] = {"password": "d"}
+    del theirs["patients"]["José K."]["streak_days"]
+
+    merged = merge_db(ours, theirs, base)
+    assert merged["patients"]["patient1"]["assigned"]["squat"] == 30
+    assert merged["patients"]["patient1"]["assigned_sets"]["flex"] == 4
+    assert merged["patients"]["patient2"]["messages"]["from_therapist"][-2:] == [msg("ours"), msg("theirs")]
+    assert merged["patients"]["dave"] == {"password": "d"}
+    assert "streak_days" not in merged["patients"]["José K."]
+    assert list(merged["patients"])[:3] == list(base["patients"])
+
+def test_merge_conflict_keeps_ours(sample_db):
+    ours, theirs = copy.deepcopy(sample_db), copy.deepcopy(sample_db)
+    ours["patients"]["patient1"]["assigned"]["squat"] = 1
+    theirs["patients"]["patient1"]["assigned"]["squat"] = 2
+    assert merge_db(ours, theirs, sample_db)["patients"]["patient1"]["assigned"]["squat"] == 1
+
+def test_merge_with_missing_base_key_keeps_both_lists(sample_db):
+    base = copy.deepcopy(sample_db)
+    del base["patients"]["patient2"]["messages"]["from_patient"]
+    ours, theirs = copy.deepcopy(base), copy.deepcopy(base)
+    ours["patients"]["patient2"]["messages"]["from_patient"] = [msg("a")]
+    theirs["patients"]["patient2"]["messages"]["from_patient"] = [msg("b")]
+    assert merge_db(ours, theirs, base)["patients"]["patient2"]["messages"]["from_patient"] == [msg("a"), msg("b")]
+
+def test_merge_takes_log_results_from_the_side_that_folded_more(sample_db):
+    base = copy.deepcopy(sample_db)
+    base[CURSOR_KEY] = {"José K.": 10}
+    ours, theirs = copy.deepcopy(base), copy.deepcopy(base)
+    stats = ours["patients"]["José K."]["angle_stats"]["squat"]
+    stats.append(dict(stats[0], timestamp="2026-01-07T10:00:00"))
+    ours["patients"]["José K."]["completed"]["squat"] += 12
+    ours[CURSOR_KEY]["José K."] = 11
+    theirs["patients"]["José K."]["assigned"]["squat"] = 15
+
+    for merged in (merge_db(ours, theirs, base), merge_db(theirs, ours, base)):
+        p = merged["patients"]["José K."]
+        assert p["angle_stats"] == ours["patients"]["José K."]["angle_stats"]
+        assert p["completed"]["squat"] == 24
+        assert p["assigned"]["squat"] == 15
+        assert merged[CURSOR_KEY]["José K."] == 11
+
+# ---------- concurrent processes ----------
+def test_external_writes_survive_save_db(tmp_path, sample_db):
+    write_json(tmp_path / "database.json", sample_db)
+    # two Repositories on one file behave like the patient and therapist processes
+    patient_side = new_repo(tmp_path, flush_delay=60, flush_deadline=60)
+    therapist_side = new_repo(tmp_path, flush_delay=0)
+
+    patient_side.add_message("patient2", "from_patient", msg("hello"))
+    therapist_side.add_message("patient2", "from_therapist", msg("hi"))
+    therapist_side.patient("patient1")["assigned"]["curl"] = 9
+    therapist_side.save_db()
+    time.sleep(0.01)  # a distinct mtime for the next write
+    patient_side.patient("patient1")["custom_optimal"]["raise"] = [20, 80]
+    patient_side.save_db()
+    assert patient_side.flush()
+
+    p = read_json(tmp_path / "database.json")["patients"]
+    assert p["patient2"]["messages"]["from_patient"][-1] == msg("hello")
+    assert p["patient2"]["messages"]["from_therapist"][-1] == msg("hi")
+    assert p["patient1"]["assigned"]["curl"] == 9
+    assert p["patient1"]["custom_optimal"]["raise"] == [20, 80]
+
+def test_logged_sets_survive_an_external_write(tmp_path, sample_db):
+    write_json(tmp_path / "database.json", sample_db)
+    patient_side = new_repo(tmp_path, flush_delay=60, flush_deadline=60)
+    therapist_side = new_repo(tmp_path, flush_delay=0)
+    stats = {"reps": 6, "rep_averages": [100.0], "overall_avg": 100.0, "opt_range": [80, 120],
+             "deviation_percent": 0.0, "timestamp": "2026-01-08T09:00:00"}
+    sets_before = len(sample_db["patients"]["José K."]["angle_stats"]["squat"])
+
+    patient_side.record_set("José K.", "squat", stats)
+    patient_side.patient("José K.")["custom_optimal"]["curl"] = [50, 150]
+    patient_side.save_db()
+    therapist_side.patient("José K.")["assigned"]["squat"] = 20
+    therapist_side.save_db()
+    patient_side.record_set("José K.", "squat", dict(stats, timestamp="2026-01-08T09:05:00"))
+    patient_side.flush()
+    therapist_side.flush()
+
+    fresh = new_repo(tmp_path).patient("José K.")
+    assert len(fresh["angle_stats"]["squat"]) == sets_before + 2
+    assert fresh["completed"]["squat"] == sample_db["patients"]["José K."]["completed"]["squat"] + 12
+    assert fresh["assigned"]["squat"] == 20
+    assert fresh["custom_optimal"]["curl"] == [50, 150]
+
+def test_load_db_sees_external_writes_while_pending(tmp_path, sample_db):
+    write_json(tmp_path / "database.json", sample_db)
+    patient_side = new_repo(tmp_path, flush_delay=60, flush_deadline=60)
+    therapist_side = new_repo(tmp_path, flush_delay=0)
+    patient_side.add_message("patient2", "from_patient", msg("hello"))
+    time.sleep(0.01)
+    therapist_side.add_message("patient2", "from_therapist", msg("hi"))
+
+    msgs = patient_side.patient("patient2")["messages"]
+    assert msgs["from_therapist"][-1] == msg("hi")
+    assert msgs["from_patient"][-1] == msg("hello")
+
+# ---------- per-patient views ----------
+def test_patient_views_match_the_whole_db(tmp_path, sample_db):
+    write_json(tmp_path / "database.json", sample_db)
+    repo = new_repo(tmp_path, flush_delay=0)
+    assert repo.patient_names() == list(sample_db["patients"])
+    p = repo.patient("patient2")
+    assert p is repo.load_db()["patients"]["patient2"]
+    expected = copy.deepcopy(sample_db)
+    assert p == ensure_patient_structure(expected, "patient2")
+
+    p["assigned"]["raise"] = 6
+    repo.save_db()
+    assert new_repo(tmp_path).patient("patient2")["assigned"]["raise"] == 6
+
+def test_record_set_matches_saving_the_whole_db(tmp_path, sample_db):
+    write_json(tmp_path / "database.json", sample_db)
+    repo = new_repo(tmp_path, flush_delay=0)
+    stats = {"reps": 4, "rep_averages": [70.0, 72.5], "overall_avg": 71.25, "opt_range": [60, 120],
+             "deviation_percent": 0.0, "timestamp": "2026-01-09T10:00:00"}
+    entry = repo.record_set("patient1", "flex", stats, {"default_sets": 3}, custom=True)
+
+    # the pages' previous path: the whole DB, append_set_result, save_db
+    expected = copy.deepcopy(sample_db)
+    ensure_patient_structure(expected, "patient1")
+    assert entry == append_set_result(expected, "patient1", "flex", stats, {"default_sets": 3}, custom=True)
+    for view in (repo.load_db(), new_repo(tmp_path).load_db()):
+        view = copy.deepcopy(view)
+        view.pop(CURSOR_KEY)
+        assert view == expected
+
+def test_use_repository_swaps_the_shared_one(tmp_path, sample_db):
+    write_json(tmp_path / "database.json", sample_db)
+    scratch = new_repo(tmp_path, flush_delay=0)
+    previous = rehab_db.use_repository(scratch)
+    try:
+        assert rehab_db.repository() is scratch
+        assert rehab_db.patient_names() == list(sample_db["patients"])
+    finally:
+        assert rehab_db.use_repository(previous) is scratch
+
+def test_close_compacts_the_session_log(tmp_path, sample_db):
+    write_json(tmp_path / "database.json", sample_db)
+    repo = new_repo(tmp_path, flush_delay=60, flush_deadline=60)
+    stats = {"reps": 3, "rep_averages": [95.0], "overall_avg": 95.0, "opt_range": [80, 120],
+             "deviation_percent": 0.0, "timestamp": "2026-01-10T10:00:00"}
+    entry = repo.record_set("patient2", "squat", stats)
+    repo.close()
+
+    assert read_json(tmp_path / "database.json")["patients"]["patient2"]["angle_stats"]["squat"] == [entry]
+    assert repo.log.patients() == []
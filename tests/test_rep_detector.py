@@ -0,0 +1,136 @@
+# tests/test_rep_detector.py
+# Rep counts from rep_detector against the hand-written chains it replaced
+# (exercise_tracker.py before the data-driven detector), on synthetic angle streams.
+#   python -m pytest -q tests
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rep_detector import detector_for
+
+FPS = 30.0
+COOLDOWN = 0.4
+
+# ---------- the previous logic ----------
+def legacy_builtin_count(ex, angles, times):
+    counter = 0
+    stage = None
+    last_time = times[0]
+    for angle_value, now in zip(angles, times):
+        if ex == "squat" or ex == "pushup":
+            reset, down = (160, 95) if ex == "squat" else (150, 90)
+            if angle_value > reset:
+                stage = "up"
+            if angle_value < down and stage == "up":
+                stage = "down"
+            if angle_value > 140 and stage == "down" and (now - last_time) > COOLDOWN:
+                counter += 1
+                last_time = now
+                stage = "up"
+        elif ex == "curl":
+            if angle_value > 150:
+                stage = "down"
+            if angle_value < 60 and stage == "down" and (now - last_time) > COOLDOWN:
+                counter += 1
+                last_time = now
+                stage = "up"
+        elif ex == "raise":
+            if angle_value < 30:
+                stage = "down"
+            if angle_value > 75 and stage == "down" and (now - last_time) > COOLDOWN:
+                counter += 1
+                last_time = now
+                stage = "up"
+    return counter
+
+def legacy_custom_count(angles, times, lim_min, lim_max):
+    counter = 0
+    stage = None
+    last_time = times[0]
+    for angle_value, now in zip(angles, times):
+        if angle_value > (lim_max - 5):
+            if stage == "down":
+                stage = "up"
+        if angle_value < (lim_min + 5):
+            if stage == "up":
+                if (now - last_time) > COOLDOWN:
+                    counter += 1
+                    last_time = now
+                stage = "down"
+        if stage is None:
+            mid = (lim_min + lim_max) / 2.0
+            stage = "up" if angle_value > mid else "down"
+    return counter
+
+def detector_count(detector, angles, times):
+    detector.start(times[0])
+    counted = sum(1 for a, t in zip(angles, times) if detector.update(float(a), t))
+    assert counted == detector.count
+    return detector.count
+
+# ---------- synthetic streams ----------
+def stream(lo, hi, period, seconds, start_high, noise=0.0, seed=0):
+    """Cosine sweep between lo and hi with optional Gaussian jitter, sampled at FPS."""
+    times = np.arange(0.0, seconds, 1.0 / FPS)
+    phase = 0.0 if start_high else np.pi
+    angles = lo + (hi - lo) * (1.0 + np.cos(2.0 * np.pi * times / period + phase)) / 2.0
+    if noise:
+        angles = angles + np.random.default_rng(seed).normal(0.0, noise, len(angles))
+    return np.clip(angles, 0.0, 180.0).tolist(), times.tolist()
+
+STREAMS = [
+    # (period s, seconds, noise deg, seed); 0.3 s reps run into the cooldown
+    (2.0, 20.0, 0.0, 0),
+    (1.2, 15.0, 3.0, 1),
+    (0.3, 6.0, 0.0, 2),
+    (0.7, 12.0, 8.0, 3),
+]
+
+@pytest.mark.parametrize("period,seconds,noise,seed", STREAMS)
+def test_squat_matches_previous_logic(period, seconds, noise, seed):
+    angles, times = stream(80, 175, period, seconds, start_high=True, noise=noise, seed=seed)
+    expected = legacy_builtin_count("squat", angles, times)
+    assert detector_count(detector_for("squat"), angles, times) == expected
+    if period >= 1.0:
+        assert expected > 0
+
+@pytest.mark.parametrize("period,seconds,noise,seed", STREAMS)
+def test_curl_matches_previous_logic(period, seconds, noise, seed):
+    angles, times = stream(40, 170, period, seconds, start_high=True, noise=noise, seed=seed)
+    expected = legacy_builtin_count("curl", angles, times)
+    assert detector_count(detector_for("curl"), angles, times) == expected
+    if period >= 1.0:
+        assert expected > 0
+
+@pytest.mark.parametrize("period,seconds,noise,seed", STREAMS)
+def test_raise_matches_previous_logic(period, seconds, noise, seed):
+    angles, times = stream(15, 95, period, seconds, start_high=False, noise=noise, seed=seed)
+    expected = legacy_builtin_count("raise", angles, times)
+    assert detector_count(detector_for("lateral raise"), angles, times) == expected
+
+@pytest.mark.parametrize("start_high", [True, False])
+@pytest.mark.parametrize("period,seconds,noise,seed", STREAMS)
+def test_custom_matches_previous_logic(period, seconds, noise, seed, start_high):
+    lim_min, lim_max = 35, 120
+    angles, times = stream(30, 125, period, seconds, start_high=start_high, noise=noise, seed=seed)
+    expected = legacy_custom_count(angles, times, lim_min, lim_max)
+    detector = detector_for("my custom", {"joints": ["RIGHT_KNEE"]}, "RIGHT_KNEE",
+                            {"RIGHT_KNEE": [lim_min, lim_max]})
+    assert detector.joint == "RIGHT_KNEE"
+    assert detector_count(detector, angles, times) == expected
+    if period >= 1.0:
+        assert expected > 0
+
+def test_custom_rep_spec_overrides_joint_limits():
+    spec = {"joint": "LEFT_KNEE", "rest": "high", "reset": 160, "peak": 95, "return": 140, "count_on": "return"}
+    detector = detector_for("my custom", {"rep_spec": spec}, "RIGHT_KNEE", {"RIGHT_KNEE": [35, 120]})
+    angles, times = stream(80, 175, 2.0, 20.0, start_high=True)
+    assert detector.joint == "LEFT_KNEE"
+    assert detector_count(detector, angles, times) == legacy_builtin_count("squat", angles, times)
+
+def test_unknown_exercise_has_no_detector():
+    assert detector_for("unknown") is None
+    assert detector_for("my custom", {}, "RIGHT_KNEE", {}) is None
@@ -0,0 +1,50 @@
+# tests/test_replay.py
+# Which captured sets replay re-scores from their landmarks.
+#   python -m pytest -q tests
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from landmark_log import LandmarkWriter
+
+replay = pytest.importorskip("replay")  # imports the tracker (OpenCV/MediaPipe)
+
+def capture(path, adaptive):
+    meta = {"exercise": "squat", "width": 640, "height": 480, "mirrored": True, "adaptive": adaptive}
+    rng = np.random.default_rng(0)
+    with LandmarkWriter(str(path), meta) as w:
+        for i in range(30):
+            w.append(i / 30.0, rng.random((33, 4), dtype=np.float32))
+    return str(path)
+
+def entry_for(path):
+    return {"reps": 7, "rep_averages": [100.0, 120.0], "opt_range": [80, 120], "deviation_percent": 0.0,
+            "landmark_file": path}
+
+def test_plain_capture_is_replayed(tmp_path):
+    path = capture(tmp_path / "plain.lmk", adaptive=False)
+    assert replay.has_capture(entry_for(path))
+    stats = replay.replay_file(path, "squat", (80, 120))
+    assert set(replay.REPLAYED_FIELDS) <= set(stats)
+
+def test_adaptive_capture_is_not_replayed(tmp_path):
+    path = capture(tmp_path / "adaptive.lmk", adaptive=True)
+    entry = entry_for(path)
+    assert not replay.has_capture(entry)
+    with pytest.raises(ValueError):
+        replay.replay_file(path, "squat", (80, 120))
+
+    # re-scored from the stored rep averages; the live rep count is kept
+    replay.rescore_entry(entry, "squat", (90, 130))
+    assert entry["reps"] == 7
+    assert entry["opt_range"] == (90, 130)
+    assert entry["deviation_percent"] == replay._compute_deviation_repwise([100.0, 120.0], 90, 130)
+
+def test_missing_or_unreadable_capture_falls_back(tmp_path):
+    assert not replay.has_capture(entry_for(str(tmp_path / "gone.lmk")))
+    junk = tmp_path / "junk.lmk"
+    junk.write_bytes(b"not a capture")
+    assert not replay.has_capture(entry_for(str(junk)))
@@ -0,0 +1,127 @@
+# tests/test_session_log.py
+# The append-only session log on a temp directory.
+#   python -m pytest -q tests
+import copy
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from exercise_defs import apply_set_entry
+from session_log import CURSOR_KEY, SessionLog, compact
+
+def entry(n):
+    return {"reps": n, "avg_angle": 100.0 + n, "deviation_percent": 0.0, "timestamp": f"2026-01-01T00:00:{n:02d}"}
+
+def new_log(tmp_path):
+    return SessionLog(str(tmp_path / "session_logs"), fsync_interval=0)
+
+# ---------- torn writes ----------
+def test_append_after_torn_write_drops_the_fragment(tmp_path):
+    log = new_log(tmp_path)
+    first = log.append("alice", "squat", entry(1))
+    # a crash mid-append leaves half a record without its newline
+    with open(log.path("alice"), "a") as f:
+        f.write(json.dumps({"seq": first + 1, "patient": "alice", "ex": "squat", "entry": entry(2)})[:25])
+    second = log.append("alice", "curl", entry(3))
+
+    with open(log.path("alice"), "rb") as f:
+        lines = f.read().split(b"\n")
+    assert lines[-1] == b""
+    assert [json.loads(line)["seq"] for line in lines[:-1]] == [first, second]
+    assert [(rec["ex"], rec["entry"]["reps"]) for rec, _ in log.iter_records("alice")] == [("squat", 1), ("curl", 3)]
+
+def test_torn_write_without_any_complete_line(tmp_path):
+    log = new_log(tmp_path)
+    os.makedirs(log.directory)
+    with open(log.path("bob"), "w") as f:
+        f.write('{"seq": 12, "pat')
+    seq = log.append("bob", "squat", entry(1))
+    assert [rec["seq"] for rec, _ in log.iter_records("bob")] == [seq]
+
+def test_undecodable_line_is_skipped(tmp_path):
+    log = new_log(tmp_path)
+    first = log.append("alice", "squat", entry(1))
+    # what a torn write followed by an unrepaired append used to leave behind
+    with open(log.path("alice"), "a") as f:
+        f.write('{"seq": 5, "pat{"seq": 6}\n')
+    second = log.append("alice", "squat", entry(2))
+    assert second > first
+    assert [rec["seq"] for rec, _ in log.iter_records("alice")] == [first, second]
+
+    db = {"therapists": {}, "patients": {}}
+    assert log.fold_into(db, "alice") == 2
+    assert db["patients"]["alice"]["completed"]["squat"] == 3
+    assert len(db["patients"]["alice"]["angle_stats"]["squat"]) == 2
+
+# ---------- seq ordering ----------
+def test_seqs_increase_across_processes(tmp_path):
+    # two SessionLog objects on one directory behave like two processes
+    a, b = new_log(tmp_path), new_log(tmp_path)
+    seqs = [log.append("alice", "squat", entry(i)) for i, log in enumerate([a, b, a, a, b, b, a])]
+    assert seqs == sorted(set(seqs))
+    assert [rec["seq"] for rec, _ in a.iter_records("alice")] == seqs
+
+def test_iter_records_resumes_from_offset(tmp_path):
+    log = new_log(tmp_path)
+    log.append("alice", "squat", entry(1))
+    (rec, offset), = list(log.iter_records("alice"))
+    later = log.append("alice", "squat", entry(2))
+    assert [r["seq"] for r, _ in log.iter_records("alice", offset)] == [later]
+
+# ---------- folding / compaction ----------
+def direct(db, records):
+    """What saving the same sets straight into the DB gives (the pre-log path)."""
+    for username, ex, e, custom in records:
+        apply_set_entry(db, username, ex, copy.deepcopy(e), custom)
+    return db
+
+RECORDS = [("alice", "squat", entry(1), False), ("bob", "knee lift", entry(2), True),
+           ("alice", "knee lift", entry(3), True), ("alice", "squat", entry(4), False)]
+
+def test_fold_matches_direct_saves_and_is_idempotent(tmp_path, sample_db):
+    log = new_log(tmp_path)
+    for username, ex, e, custom in RECORDS:
+        log.append(username, ex, e, custom=custom)
+    db = copy.deepcopy(sample_db)
+    assert log.fold_pending(db) == len(RECORDS)
+    assert log.fold_pending(db) == 0
+    cursors = db.pop(CURSOR_KEY)
+    assert set(cursors) == {"alice", "bob"}
+    assert db == direct(copy.deepcopy(sample_db), RECORDS)
+
+def test_fold_skips_already_applied_seqs(tmp_path):
+    log = new_log(tmp_path)
+    db = {"therapists": {}, "patients": {}}
+    e = apply_set_entry(db, "alice", "squat", entry(1))
+    seq = log.append("alice", "squat", e)
+    assert log.fold_into(db, "alice", applied=(seq,)) == 0
+    assert db[CURSOR_KEY]["alice"] == seq
+    assert len(db["patients"]["alice"]["angle_stats"]["squat"]) == 1
+
+def test_compact_writes_the_db_and_empties_the_logs(tmp_path, sample_db):
+    db_file = tmp_path / "database.json"
+    with open(db_file, "w") as f:
+        json.dump(sample_db, f)
+    log = new_log(tmp_path)
+    for username, ex, e, custom in RECORDS:
+        log.append(username, ex, e, custom=custom)
+
+    assert compact(str(db_file), log) == len(RECORDS)
+    with open(db_file) as f:
+        written = json.load(f)
+    written.pop(CURSOR_KEY)
+    assert written == direct(copy.deepcopy(sample_db), RECORDS)
+    assert log.patients() == []
+    assert compact(str(db_file), log) == 0
+
+def test_discard_keeps_records_the_db_does_not_have(tmp_path):
+    log = new_log(tmp_path)
+    log.append("alice", "squat", entry(1))
+    db = {"therapists": {}, "patients": {}}
+    log.fold_pending(db)
+    later = log.append("alice", "squat", entry(2))
+    log.discard_folded(db)
+    assert [rec["seq"] for rec, _ in log.iter_records("alice")] == [later]
+    assert log.fold_pending(db) == 1
+    assert len(db["patients"]["alice"]["angle_stats"]["squat"]) == 2
@@ -0,0 +1,69 @@
+# tests/test_session_stats.py
+# StreamingAngleStats against the exact list-based statistics it replaced.
+#   python -m pytest -q tests
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from session_stats import BIN_WIDTH, StreamingAngleStats
+
+# ---------- the previous exact path (sorted list + np.mean) ----------
+def range_average_low_high(samples, low_pct=0.3):
+    n = len(samples)
+    if n == 0:
+        return 0.0, 0.0
+    k = max(1, int(np.ceil(n * low_pct)))
+    s_sorted = sorted(samples)
+    low_group = s_sorted[:k]
+    high_group = s_sorted[-k:]
+    avg_low = float(np.mean(low_group)) if low_group else float(np.min(samples))
+    avg_high = float(np.mean(high_group)) if high_group else float(np.max(samples))
+    return avg_low, avg_high
+
+def angle_stream(seed, n):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / 30.0
+    angles = 110.0 + 60.0 * np.sin(2.0 * np.pi * t / rng.uniform(1.0, 4.0)) + rng.normal(0.0, 4.0, n)
+    if seed % 3 == 0:
+        angles = np.round(angles)  # many ties
+    return np.clip(np.mod(angles, 180.0), 0.0, 180.0)
+
+@pytest.mark.parametrize("seed,n", [(0, 1), (1, 2), (2, 7), (3, 100), (4, 901), (5, 5000), (6, 12345)])
+@pytest.mark.parametrize("low_pct", [0.3, 0.1, 0.5])
+def test_low_high_averages_within_one_bin(seed, n, low_pct):
+    angles = angle_stream(seed, n)
+    st = StreamingAngleStats(low_pct=low_pct)
+    for a in angles.tolist():
+        st.add(a)
+    low, high = st.low_high_averages()
+    ref_low, ref_high = range_average_low_high(angles.tolist(), low_pct)
+    assert abs(low - ref_low) < BIN_WIDTH
+    assert abs(high - ref_high) < BIN_WIDTH
+    assert st.mean() == pytest.approx(float(np.mean(angles)), abs=1e-9)
+    assert (st.min, st.max) == (float(angles.min()), float(angles.max()))
+
+def test_empty():
+    st = StreamingAngleStats()
+    assert st.low_high_averages() == range_average_low_high([]) == (0.0, 0.0)
+    assert st.mean() == 0.0 and st.pending_rep_average() is None
+
+def test_add_many_matches_add():
+    angles = angle_stream(7, 2000)
+    breaks = [150, 420, 421, 1300]
+    one = StreamingAngleStats()
+    for i, a in enumerate(angles.tolist()):
+        if i in breaks:
+            one.close_rep()
+        one.add(a)
+    bulk = StreamingAngleStats()
+    bulk.add_many(angles, breaks)
+
+    assert bulk.count == one.count and bulk.bin_counts == one.bin_counts
+    assert bulk.low_high_averages() == pytest.approx(one.low_high_averages(), abs=1e-9)
+    assert bulk.rep_averages == pytest.approx(one.rep_averages, abs=1e-9)
+    assert bulk.pending_rep_average() == pytest.approx(one.pending_rep_average(), abs=1e-9)
+    segments = np.split(angles, breaks)
+    assert one.rep_averages == pytest.approx([float(np.mean(s)) for s in segments[:-1] if s.size], abs=1e-9)
@@ -0,0 +1,98 @@
+# tests/test_sharded_store.py
+# Per-patient JSON shards on a temp directory: migrate -> load -> save -> export
+# must give the database back unchanged, and a save only rewrites what changed.
+#   python -m pytest -q tests
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sharded_store import ShardedStore, export_json, migrate_json
+
+def write_json(path, db):
+    with open(path, "w") as f:
+        json.dump(db, f, indent=4)
+
+def read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def new_store(tmp_path):
+    return ShardedStore(str(tmp_path / "db_shards"), fsync=False)
+
+def plain(db):
+    db = dict(db)
+    db["patients"] = {u: db["patients"][u] for u in db["patients"]}
+    return db
+
+def count_writes(store, monkeypatch):
+    written = []
+    real = store._write_json
+
+    def write(path, obj):
+        written.append(os.path.relpath(path, store.directory))
+        real(path, obj)
+    monkeypatch.setattr(store, "_write_json", write)
+    return written
+
+def test_migrate_load_save_export_round_trip(tmp_path, sample_db):
+    write_json(tmp_path / "database.json", sample_db)
+    store = new_store(tmp_path)
+    migrate_json(str(tmp_path / "database.json"), store)
+
+    db = store.load_db()
+    assert list(db["patients"]) == list(sample_db["patients"])
+    store.save_db(db)
+    export_json(store, str(tmp_path / "out.json"))
+    assert read_json(tmp_path / "out.json") == sample_db
+    assert plain(new_store(tmp_path).load_db()) == sample_db
+
+def test_save_rewrites_only_changed_shards(tmp_path, sample_db, monkeypatch):
+    write_json(tmp_path / "database.json", sample_db)
+    store = new_store(tmp_path)
+    migrate_json(str(tmp_path / "database.json"), store)
+    written = count_writes(store, monkeypatch)
+
+    db = store.load_db()
+    db["patients"]["patient1"]  # looked up but left alone
+    store.save_db(db)
+    assert written == []
+
+    db["patients"]["José K."]["assigned"]["squat"] = 11
+    store.save_db(db)
+    assert len(written) == 1 and written[0].startswith("patients" + os.sep)
+    assert new_store(tmp_path).load_patient("José K.")["assigned"]["squat"] == 11
+
+def test_patients_another_process_added_are_kept(tmp_path, sample_db):
+    write_json(tmp_path / "database.json", sample_db)
+    a = new_store(tmp_path)
+    migrate_json(str(tmp_path / "database.json"), a)
+    b = new_store(tmp_path)
+    db_a, db_b = a.load_db(), b.load_db()
+    db_b["patients"]["dave"] = {"password": "d"}
+    b.save_db(db_b)
+    db_a["patients"]["patient2"]["assigned"]["curl"] = 3
+    a.save_db(db_a)
+
+    db = plain(new_store(tmp_path).load_db())
+    assert list(db["patients"]) == list(sample_db["patients"]) + ["dave"]
+    assert db["patients"]["dave"] == {"password": "d"}
+    assert db["patients"]["patient2"]["assigned"]["curl"] == 3
+
+def test_deleted_patient_loses_its_shard(tmp_path, sample_db):
+    write_json(tmp_path / "database.json", sample_db)
+    store = new_store(tmp_path)
+    migrate_json(str(tmp_path / "database.json"), store)
+    db = store.load_db()
+    del db["patients"]["patient2"]
+    store.save_db(db)
+
+    assert "patient2" not in new_store(tmp_path).patient_names()
+    assert sorted(os.listdir(tmp_path / "db_shards" / "patients")) == sorted(store._files.values())
+
+def test_colliding_file_names_get_their_own_shards(tmp_path):
+    store = new_store(tmp_path)
+    store.save_db({"therapists": {}, "patients": {"a b": {"n": 1}, "a_b": {"n": 2}, "a/b": {"n": 3}}})
+    assert len(set(store._files.values())) == 3
+    db = plain(new_store(tmp_path).load_db())
+    assert db["patients"] == {"a b": {"n": 1}, "a_b": {"n": 2}, "a/b": {"n": 3}}
@@ -0,0 +1,138 @@
+# tests/test_sqlite_store.py
+# SQLite storage on temp files: migrate -> load -> save -> export must give the
+# database back unchanged, and only patients that changed are rewritten.
+#   python -m pytest -q tests
+import copy
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from exercise_defs import append_set_result
+from rehab_db import Repository
+from sqlite_store import PatientMap, SqliteStore, export_json, migrate_json
+
+def complete(db):
+    """`db` with every patient's per-exercise dicts and message lists present:
+    the SQLite tables always give them back, empty or not."""
+    db = copy.deepcopy(db)
+    for p in db["patients"].values():
+        for field in ("assigned", "assigned_sets", "sets_completed", "completed", "custom_optimal", "angle_stats"):
+            p.setdefault(field, {})
+        p.setdefault("messages", {})
+        p["messages"].setdefault("from_therapist", [])
+        p["messages"].setdefault("from_patient", [])
+    return db
+
+def write_json(path, db):
+    with open(path, "w") as f:
+        json.dump(db, f, indent=4)
+
+def read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def plain(db):
+    """A load_db() dict with its PatientMap read into a plain dict."""
+    db = dict(db)
+    db["patients"] = {u: db["patients"][u] for u in db["patients"]}
+    return db
+
+def session_ids(store, username):
+    return [r[0] for r in store._conn.execute("SELECT id FROM sessions WHERE patient = ? ORDER BY id", (username,))]
+
+def test_migrate_load_save_export_round_trip(tmp_path, sample_db):
+    write_json(tmp_path / "database.json", sample_db)
+    store = SqliteStore(str(tmp_path / "rehabai.sqlite3"))
+    migrate_json(str(tmp_path / "database.json"), store)
+
+    db = store.load_db()
+    assert isinstance(db["patients"], PatientMap)
+    assert list(db["patients"]) == list(sample_db["patients"])
+    store.save_db(db)
+    export_json(store, str(tmp_path / "out.json"))
+    store.close()
+
+    assert read_json(tmp_path / "out.json") == complete(sample_db)
+
+def test_save_rewrites_only_changed_patients(tmp_path, sample_db):
+    write_json(tmp_path / "database.json", sample_db)
+    store = SqliteStore(str(tmp_path / "rehabai.sqlite3"))
+    migrate_json(str(tmp_path / "database.json"), store)
+    before = session_ids(store, "patient1")
+
+    db = store.load_db()
+    db["patients"]["patient1"]  # looked up but left alone
+    db["patients"]["José K."]["messages"]["from_patient"].append({"timestamp": "2026-01-04T09:00:00", "text": "Done"})
+    assert [u for u, _ in db["patients"].changed()] == ["José K."]
+    store.save_db(db)
+    assert list(db["patients"].changed()) == []
+    assert session_ids(store, "patient1") == before
+
+    expected = complete(sample_db)
+    expected["patients"]["José K."]["messages"]["from_patient"].append({"timestamp": "2026-01-04T09:00:00", "text": "Done"})
+    other = SqliteStore(str(tmp_path / "rehabai.sqlite3"))
+    assert plain(other.load_db()) == expected
+    other.close()
+    store.close()
+
+def test_patient_map_digest_tracks_changes(tmp_path, sample_db):
+    write_json(tmp_path / "database.json", sample_db)
+    store = SqliteStore(str(tmp_path / "rehabai.sqlite3"))
+    migrate_json(str(tmp_path / "database.json"), store)
+    patients = store.load_db()["patients"]
+
+    assert not patients.is_saved("patient2")  # not loaded yet
+    p = patients["patient2"]
+    assert patients.is_saved("patient2")
+    p["assigned"]["curl"] = p["assigned"].get("curl", 0)
+    p["assigned"]["curl"] += 1
+    assert not patients.is_saved("patient2")
+    p["assigned"]["curl"] -= 1
+    assert patients.is_saved("patient2")  # back to what was read
+    patients["new"] = {"password": "x"}
+    assert [u for u, _ in patients.changed()] == ["new"]
+    del patients["patient2"]
+    assert "patient2" not in patients and patients._deleted == {"patient2"}
+    store.close()
+
+def test_concurrent_connections_keep_each_others_patients(tmp_path, sample_db):
+    write_json(tmp_path / "database.json", sample_db)
+    path = str(tmp_path / "rehabai.sqlite3")
+    a = SqliteStore(path)
+    migrate_json(str(tmp_path / "database.json"), a)
+    b = SqliteStore(path)
+    db_a, db_b = a.load_db(), b.load_db()
+    db_a["patients"]["patient1"]["assigned"]["squat"] = 99
+    db_b["patients"]["patient2"]["assigned"]["squat"] = 7
+    a.save_db(db_a)
+    b.save_db(db_b)
+
+    db = plain(SqliteStore(path).load_db())
+    assert db["patients"]["patient1"]["assigned"]["squat"] == 99
+    assert db["patients"]["patient2"]["assigned"]["squat"] == 7
+    a.close()
+    b.close()
+
+def test_row_writes_match_a_full_rewrite(tmp_path, sample_db):
+    write_json(tmp_path / "database.json", sample_db)
+    store = SqliteStore(str(tmp_path / "rehabai.sqlite3"))
+    migrate_json(str(tmp_path / "database.json"), store)
+    repo = Repository(str(tmp_path / "database.json"), store=store)
+    stats = {"reps": 5, "rep_averages": [88.5, 91.0], "overall_avg": 89.75, "opt_range": [80, 120],
+             "deviation_percent": 0.0, "timestamp": "2026-01-05T08:00:00"}
+    message = {"timestamp": "2026-01-05T08:05:00", "text": "Nice", "read": False}
+
+    repo.load_db()["patients"]["José K."]  # loaded and unchanged: the row path
+    repo.record_set("José K.", "knee lift", stats, {"default_sets": 2}, custom=True)
+    repo.add_message("José K.", "from_therapist", message)
+
+    expected = complete(sample_db)
+    entry = append_set_result(expected, "José K.", "knee lift", stats, {"default_sets": 2}, custom=True)
+    expected["patients"]["José K."]["messages"]["from_therapist"].append(message)
+    other = SqliteStore(str(tmp_path / "rehabai.sqlite3"))
+    got = plain(other.load_db())
+    assert got["patients"]["José K."]["angle_stats"]["knee lift"][-1] == entry
+    assert got == expected
+    other.close()
+    store.close()
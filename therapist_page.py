@@ -3,35 +3,13 @@ import tkinter as tk
 from tkinter import messagebox, scrolledtext, simpledialog
 import json
 from datetime import datetime
-from exercise_tracker import OPTIMAL_RANGES, record_custom_exercise, load_custom_exercises, pick_primary_joint_from_limits
+from exercise_defs import OPTIMAL_RANGES, load_custom_exercises, pick_primary_joint_from_limits, release_tracker_session, \
+    invalidate_exercise_cache
+from rehab_db import load_db, save_db, flush as flush_db, add_message, patient as patient_data, patient_names
 import os
 
-DB = "database.json"
 EX_FILE = "exercises.json"
 
-def load_db():
-    if not os.path.exists(DB):
-        with open(DB, "w") as f:
-            json.dump({"therapists": {}, "patients": {}}, f, indent=4)
-    with open(DB, "r") as f:
-        return json.load(f)
-
-def save_db(db):
-    with open(DB, "w") as f:
-        json.dump(db, f, indent=4)
-
-def _ensure_patient_structure(db, username):
-    p = db["patients"].setdefault(username, {})
-    p.setdefault("messages", {})
-    p["messages"].setdefault("from_therapist", [])
-    p["messages"].setdefault("from_patient", [])
-    p.setdefault("assigned", {})
-    p.setdefault("assigned_sets", {})
-    p.setdefault("sets_completed", {})
-    p.setdefault("completed", {})
-    p.setdefault("angle_stats", {})
-    return p
-
 def load_exercises_file():
     if not os.path.exists(EX_FILE):
         with open(EX_FILE, "w") as f:
@@ -55,6 +33,7 @@ def save_exercises_file(data):
             db["exercises"][k]["optimal_range"] = v.get("optimal_range")
         db["exercises"][k]["created"] = v.get("created")
     save_db(db)
+    invalidate_exercise_cache()
 
 class ScrollableFrame(tk.Frame):
     """A vertically scrollable frame that expands to the width of its container."""
@@ -97,7 +76,6 @@ def therapist_window(username, login_window):
     except Exception:
         pass
 
-    db = load_db()
     win = tk.Tk()
     win.title(f"Therapist - {username}")
     # start slightly larger to show many sections; user can resize
@@ -115,7 +93,7 @@ def therapist_window(username, login_window):
 
     tk.Label(top_frame, text="Select patient:", font=("Arial", 12)).pack(side="left")
 
-    patients = list(db["patients"].keys())
+    patients = patient_names()
     if not patients:
         tk.Label(top_frame, text=" (No patients found)", fg="red").pack(side="left", padx=6)
 
@@ -148,20 +126,21 @@ def therapist_window(username, login_window):
         rep_entries[ex] = e
 
     def assign_reps():
-        db2 = load_db()
         patient = sel.get()
         if not patient:
             messagebox.showwarning("No patient", "No patient selected.")
             return
-        _ensure_patient_structure(db2, patient)
+        # validate everything first: patient_data() hands out the shared cached dict
+        assigned = {}
         for ex in exercises:
             val = rep_entries[ex].get().strip()
             if val.isdigit():
-                db2["patients"][patient]["assigned"][ex] = int(val)
+                assigned[ex] = int(val)
             else:
                 messagebox.showwarning("Invalid", f"Invalid number for {ex}")
                 return
-        save_db(db2)
+        patient_data(patient)["assigned"].update(assigned)
+        save_db()
         messagebox.showinfo("Saved", "Assignments updated.")
 
     tk.Button(assign_frame, text="Assign Reps", command=assign_reps, width=20).pack(pady=6)
@@ -189,16 +168,15 @@ def therapist_window(username, login_window):
         range_entries[ex] = (e_min, e_max)
 
     def load_patient_custom():
-        db2 = load_db()
         patient = sel.get()
         if not patient:
             return
-        _ensure_patient_structure(db2, patient)
-        assigned = db2["patients"][patient].get("assigned", {})
+        pdata = patient_data(patient)
+        assigned = pdata.get("assigned", {})
         for ex in exercises:
             rep_entries[ex].delete(0, tk.END)
             rep_entries[ex].insert(0, str(assigned.get(ex, 0)))
-        custom = db2["patients"][patient].get("custom_optimal", {})
+        custom = pdata.get("custom_optimal", {})
         for ex in exercises:
             e_min, e_max = range_entries[ex]
             c = custom.get(ex)
@@ -212,13 +190,11 @@ def therapist_window(username, login_window):
                 e_max.delete(0, tk.END)
 
     def save_ranges_for_patient():
-        db2 = load_db()
         patient = sel.get()
         if not patient:
             messagebox.showwarning("No patient", "No patient selected.")
             return
-        _ensure_patient_structure(db2, patient)
-        custom = db2["patients"][patient].setdefault("custom_optimal", {})
+        custom = {}
         for ex in exercises:
             mode = radio_vars[ex].get()
             e_min, e_max = range_entries[ex]
@@ -242,11 +218,26 @@ def therapist_window(username, login_window):
                     messagebox.showwarning("Invalid", f"For {ex}, min must be less than max.")
                     return
                 custom[ex] = [min_i, max_i]
-        save_db(db2)
+        patient_data(patient).setdefault("custom_optimal", {}).update(custom)
+        save_db()
         messagebox.showinfo("Saved", "Patient optimal ranges updated (defaults saved if chosen).")
 
     tk.Button(ranges_frame, text="Save Optimal Ranges for Patient", command=save_ranges_for_patient, width=36).pack(pady=8)
 
+    def rescore_past_sessions():
+        patient = sel.get()
+        if not patient:
+            messagebox.showwarning("No patient", "No patient selected.")
+            return
+        db2 = load_db()
+        from replay import rescore_patient  # pulls in the tracker (OpenCV/MediaPipe)
+        seen, changed = rescore_patient(db2, patient)
+        if changed:
+            save_db(db2)
+        messagebox.showinfo("Re-scored", f"Re-scored {seen} past sessions with the current ranges ({changed} updated).")
+
+    tk.Button(ranges_frame, text="Re-score Past Sessions", command=rescore_past_sessions, width=36).pack(pady=(0,8))
+
     # --- Custom exercise creation ---
     custom_frame = tk.LabelFrame(sf.inner, text="Custom Exercises (Create / Manage)", padx=8, pady=8)
     custom_frame.pack(pady=4, fill="x")
@@ -261,6 +252,7 @@ def therapist_window(username, login_window):
         if not name:
             return
         messagebox.showinfo("Recording", "Recording will start AFTER a 3-second countdown displayed on the camera window.\nPress ESC to finish when done.")
+        from exercise_tracker import record_custom_exercise
         joint_limits = record_custom_exercise(name, countdown_seconds=3)
         if not joint_limits:
             messagebox.showerror("Failed", "No joint data collected. Make sure the person is visible and try again.")
@@ -335,10 +327,8 @@ def therapist_window(username, login_window):
             tk.Label(sets_frame, text="(No custom exercises available)").pack(anchor="w")
             return
         patient = sel.get()
-        db2 = load_db()
         if patient:
-            _ensure_patient_structure(db2, patient)
-            assigned_sets = db2["patients"][patient].get("assigned_sets", {})
+            assigned_sets = patient_data(patient).get("assigned_sets", {})
         else:
             assigned_sets = {}
         # recreate entries mapping
@@ -356,12 +346,11 @@ def therapist_window(username, login_window):
         tk.Button(sets_frame, text="Save Assigned Sets", command=save_assigned_sets, width=28).pack(pady=6)
 
     def save_assigned_sets():
-        db2 = load_db()
         patient = sel.get()
         if not patient:
             messagebox.showwarning("No patient", "No patient selected.")
             return
-        _ensure_patient_structure(db2, patient)
+        assigned_sets = {}
         for name, ent in sets_entries.items():
             val = ent.get().strip()
             if val == "":
@@ -370,8 +359,9 @@ def therapist_window(username, login_window):
             if not val.isdigit():
                 messagebox.showwarning("Invalid", f"Invalid sets value for {name}. Enter a non-negative integer.")
                 return
-            db2["patients"][patient].setdefault("assigned_sets", {})[name] = int(val)
-        save_db(db2)
+            assigned_sets[name] = int(val)
+        patient_data(patient).setdefault("assigned_sets", {}).update(assigned_sets)
+        save_db()
         messagebox.showinfo("Saved", "Assigned sets updated for patient.")
         # update progress area if visible
         refresh_progress_display()
@@ -394,15 +384,14 @@ def therapist_window(username, login_window):
     def load_messages_into_display():
         chat_display.configure(state='normal')
         chat_display.delete('1.0', tk.END)
-        db = load_db()
         patient = sel.get()
         if not patient:
             chat_display.insert(tk.END, "(No patient selected)\n")
             chat_display.configure(state='disabled')
             return
-        _ensure_patient_structure(db, patient)
-        msgs_t = db["patients"][patient]["messages"].get("from_therapist", [])
-        msgs_p = db["patients"][patient]["messages"].get("from_patient", [])
+        messages = patient_data(patient)["messages"]
+        msgs_t = messages.get("from_therapist", [])
+        msgs_p = messages.get("from_patient", [])
         combined = []
         for m in msgs_t:
             combined.append(("Therapist", m.get("timestamp", ""), m.get("text", "")))
@@ -418,15 +407,12 @@ def therapist_window(username, login_window):
         text = therapist_msg_ent.get().strip()
         if not text:
             return
-        db = load_db()
         patient = sel.get()
         if not patient:
             messagebox.showwarning("No patient", "No patient selected.")
             return
-        _ensure_patient_structure(db, patient)
         entry = {"timestamp": datetime.utcnow().isoformat(), "text": text}
-        db["patients"][patient]["messages"]["from_therapist"].append(entry)
-        save_db(db)
+        add_message(patient, "from_therapist", entry)
         therapist_msg_ent.delete(0, tk.END)
         load_messages_into_display()
         messagebox.showinfo("Sent", f"Message sent to {patient}.")
@@ -441,7 +427,6 @@ def therapist_window(username, login_window):
     progress_text.pack(fill="both", expand=True, padx=6, pady=(0,6))
 
     def refresh_progress_display():
-        db3 = load_db()
         patient = sel.get()
         progress_text.configure(state='normal')
         progress_text.delete('1.0', tk.END)
@@ -449,17 +434,17 @@ def therapist_window(username, login_window):
             progress_text.insert(tk.END, "(No patient selected)\n")
             progress_text.configure(state='disabled')
             return
-        _ensure_patient_structure(db3, patient)
-        comp = db3["patients"][patient].get("completed", {})
-        assigned = db3["patients"][patient].get("assigned", {})
-        assigned_sets = db3["patients"][patient].get("assigned_sets", {})
-        sets_completed = db3["patients"][patient].get("sets_completed", {})
+        pdata = patient_data(patient)
+        comp = pdata.get("completed", {})
+        assigned = pdata.get("assigned", {})
+        assigned_sets = pdata.get("assigned_sets", {})
+        sets_completed = pdata.get("sets_completed", {})
         text = ""
         for ex in exercises:
             a = assigned.get(ex, 0)
             c = comp.get(ex, 0)
             text += f"{ex.capitalize()}: Assigned reps={a}  Completed reps={c}\n"
-            hist = db3["patients"][patient].get("angle_stats", {}).get(ex, [])
+            hist = pdata.get("angle_stats", {}).get(ex, [])
             if hist:
                 last = hist[-1]
                 text += f"  Last session ({last.get('timestamp','')}): reps={last.get('reps',0)}, deviation={last.get('deviation_percent',0.0)}%\n"
@@ -473,8 +458,8 @@ def therapist_window(username, login_window):
             for name, meta in custom_exs.items():
                 a_sets = assigned_sets.get(name, meta.get("default_sets", 0))
                 s_comp = sets_completed.get(name, 0)
-                text += f"{name}: Assigned sets (patient-level) = {db3['patients'][patient].get('assigned_sets', {}).get(name, 'none')} | Default sets (exercise) = {meta.get('default_sets', 0)} | Sets completed = {s_comp}\n"
-                hist = db3['patients'][patient].get("angle_stats", {}).get(name, [])
+                text += f"{name}: Assigned sets (patient-level) = {assigned_sets.get(name, 'none')} | Default sets (exercise) = {meta.get('default_sets', 0)} | Sets completed = {s_comp}\n"
+                hist = pdata.get("angle_stats", {}).get(name, [])
                 if hist:
                     last = hist[-1]
                     text += f"  Last set ({last.get('timestamp','')}): reps={last.get('reps',0)}, deviation={last.get('deviation_percent',0.0)}%, opt_range={meta.get('optimal_range')}\n"
@@ -521,8 +506,7 @@ def therapist_window(username, login_window):
         for widget in top_frame.winfo_children():
             widget.destroy()
         tk.Label(top_frame, text="Select patient:", font=("Arial", 12)).pack(side="left")
-        db2 = load_db()
-        patients_new = list(db2["patients"].keys())
+        patients_new = patient_names()
         if not patients_new:
             tk.Label(top_frame, text=" (No patients found)", fg="red").pack(side="left", padx=6)
             sel.set("")
@@ -559,6 +543,12 @@ def therapist_window(username, login_window):
 
     # Logout button and close behavior
     def logout():
+        release_tracker_session()
+        try:
+            flush_db()
+        except OSError as e:
+            messagebox.showerror("Save failed", f"The latest changes could not be saved:\n{e}\n\nPlease try again.")
+            return
         win.destroy()
         try:
             import login
@@ -0,0 +1,316 @@
+# tracker_bench.py
+# Camera-free benchmark of the tracker hot path: a stub Pose replays synthetic
+# landmark streams through start_exercise / record_custom_exercise and through
+# each stage in isolation. Prints (or writes) one JSON report.
+#   python tracker_bench.py [--exercise squat curl raise] [--seconds 20] [--fps 30]
+#                           [--noise 2.0] [--dropout 0.05] [--seed 0] [--json out.json]
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+import cv2
+from mediapipe.framework.formats import landmark_pb2
+import exercise_tracker as et
+import rehab_db
+from frame_sources import IterableSource
+from rep_detector import detector_for
+
+FRAME_W, FRAME_H = 640, 480
+
+# rough standing pose (normalized x, y) used for every landmark the trajectory does not move
+_BASE_POSE = np.array([
+    (0.50, 0.12), (0.49, 0.10), (0.48, 0.10), (0.47, 0.10), (0.51, 0.10), (0.52, 0.10), (0.53, 0.10),
+    (0.45, 0.11), (0.55, 0.11), (0.49, 0.14), (0.51, 0.14), (0.42, 0.25), (0.58, 0.25), (0.40, 0.38),
+    (0.60, 0.38), (0.39, 0.50), (0.61, 0.50), (0.38, 0.53), (0.62, 0.53), (0.38, 0.53), (0.62, 0.53),
+    (0.39, 0.52), (0.61, 0.52), (0.45, 0.52), (0.55, 0.52), (0.45, 0.70), (0.55, 0.70), (0.45, 0.88),
+    (0.55, 0.88), (0.44, 0.91), (0.56, 0.91), (0.46, 0.93), (0.54, 0.93)])
+
+# exercise -> (JOINT_TRIPLES key whose angle moves, (min, max) degrees, seconds per rep)
+TRAJECTORIES = {
+    "squat": ("LEFT_KNEE", (80.0, 175.0), 2.5),
+    "curl": ("LEFT_ELBOW", (30.0, 165.0), 2.0),
+    "raise": ("LEFT_SHOULDER", (10.0, 100.0), 2.5),
+}
+
+# ---------- synthetic landmark streams ----------
+def synthetic_stream(exercise, seconds=20.0, fps=30.0, noise=2.0, dropout=0.05, seed=0):
+    """List of NormalizedLandmarkList (None for dropped frames) whose tracked joint
+    follows a cosine between the exercise's min and max angle plus Gaussian noise."""
+    joint, (lo, hi), period = TRAJECTORIES[exercise]
+    j = et.JOINT_INDEX[joint]
+    ia, ib, ic = int(et.TRIPLE_A[j]), int(et.TRIPLE_B[j]), int(et.TRIPLE_C[j])
+    rng = np.random.default_rng(seed)
+    n = int(seconds * fps)
+    t = np.arange(n) / fps
+    angles = (lo + hi) / 2.0 + (hi - lo) / 2.0 * np.cos(2.0 * math.pi * t / period) + rng.normal(0.0, noise, n)
+    dropped = rng.random(n) < dropout
+    jitter = rng.normal(0.0, 0.002, (n, len(_BASE_POSE), 2))
+
+    seg = 0.18 * FRAME_H
+    stream = []
+    for i in range(n):
+        if dropped[i]:
+            stream.append(None)
+            continue
+        px = (_BASE_POSE + jitter[i]) * (FRAME_W, FRAME_H)
+        b = px[ib]
+        r = math.radians(angles[i])
+        px[ia] = b + (0.0, -seg)
+        px[ic] = b + (seg * math.sin(r), -seg * math.cos(r))
+        lm = landmark_pb2.NormalizedLandmarkList()
+        for x, y in (px / (FRAME_W, FRAME_H)).tolist():
+            lm.landmark.add(x=x, y=y, z=0.0, visibility=0.99)
+        stream.append(lm)
+    return stream
+
+def raw_frame_stream(stream):
+    """The same stream as the model would report it on the unflipped camera frame
+    (x -> 1 - x, left/right swapped): what headless sets feed the tracker, since
+    they mirror landmarks instead of pixels."""
+    out = []
+    for lm in stream:
+        if lm is None:
+            out.append(None)
+            continue
+        raw = landmark_pb2.NormalizedLandmarkList()
+        for i in et.MIRROR_INDEX:
+            p = lm.landmark[i]
+            raw.landmark.add(x=1.0 - p.x, y=p.y, z=p.z, visibility=p.visibility)
+        out.append(raw)
+    return out
+
+class _Result:
+    __slots__ = ("pose_landmarks",)
+
+    def __init__(self, pose_landmarks):
+        self.pose_landmarks = pose_landmarks
+
+class StubPose:
+    """Stands in for mp_pose.Pose: returns the next precomputed landmark set per call."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.i = 0
+
+    def process(self, rgb):
+        lm = self.stream[self.i % len(self.stream)]
+        self.i += 1
+        return _Result(lm)
+
+    def reset(self):
+        self.i = 0
+
+    def close(self):
+        pass
+
+class StubSession:
+    """Duck-typed TrackerSession so start_exercise / record_custom_exercise use StubPose."""
+    def __init__(self, stream):
+        self.pose = StubPose(stream)
+
+    @contextmanager
+    def use(self, camera=True):
+        yield self.pose, None
+
+class _TimedSource(IterableSource):
+    """Records the wall time of every read so loop iterations can be timed end to end.
+    Claims its frames like a camera does, so the tracker may flip and draw in place."""
+    owns_frames = True
+
+    def __init__(self, frames, fps):
+        super().__init__(frames, fps)
+        self.read_ns = []
+
+    def read(self):
+        self.read_ns.append(time.perf_counter_ns())
+        return super().read()
+
+def _blank_frames(n, fps):
+    frame = np.zeros((FRAME_H, FRAME_W, 3), dtype=np.uint8)
+    return ((frame, i / fps) for i in range(n))
+
+# ---------- measurement ----------
+def _summary(ns):
+    ns = np.asarray(ns, dtype=np.float64)
+    if not ns.size:
+        return {"frames": 0}
+    us = ns / 1000.0
+    total = ns.sum() / 1e9
+    return {
+        "frames": int(ns.size),
+        "fps": round(float(ns.size / total), 1) if total else None,
+        "p50_us": round(float(np.percentile(us, 50)), 2),
+        "p95_us": round(float(np.percentile(us, 95)), 2),
+        "p99_us": round(float(np.percentile(us, 99)), 2),
+        "max_us": round(float(us.max()), 2),
+    }
+
+def _allocations(fn, frames):
+    """Peak and net traced bytes (per frame) of one extra, untimed run of `fn`."""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        fn()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"alloc_peak_kb": round((peak - base) / 1024.0, 2),
+            "alloc_net_bytes_per_frame": round((current - base) / max(1, frames), 2)}
+
+def _time_each(items, step):
+    perf = time.perf_counter_ns
+    out = []
+    for item in items:
+        t0 = perf()
+        step(item)
+        out.append(perf() - t0)
+    return out
+
+def _stage(items, make_step):
+    """Times make_step()(item) per item; make_step gives stateful stages a fresh instance per run."""
+    report = _summary(_time_each(items, make_step()))
+    step = make_step()
+    report.update(_allocations(lambda: [step(it) for it in items], len(items)))
+    return report
+
+# ---------- stages ----------
+def bench_stages(exercise, stream, fps):
+    joint = TRAJECTORIES[exercise][0]
+    a, b, c = et.JOINT_TRIPLES[joint]
+    detected = [lm.landmark for lm in stream if lm is not None]
+    ts = [i / fps for i, lm in enumerate(stream) if lm is not None]
+    engine = et.JointAngleEngine()
+    angles = [float(engine.compute(lm, FRAME_W, FRAME_H)[et.JOINT_INDEX[joint]]) for lm in detected]
+    frames = list(zip(angles, ts))
+    stages = {}
+
+    def px(lm, name):
+        p = et._land(lm, name)
+        return (p[0] * FRAME_W, p[1] * FRAME_H)
+
+    def angle_scalar(lm):
+        et._angle(px(lm, a), px(lm, b), px(lm, c))
+    stages["_angle"] = _stage(detected, lambda: angle_scalar)
+    stages["angle_engine"] = _stage(detected, lambda: lambda lm: engine.compute(lm, FRAME_W, FRAME_H))
+
+    def rep_state_machine():
+        det = detector_for(exercise)
+        det.start(0.0)
+        return lambda f: det.update(f[0], f[1])
+    stages["rep_state_machine"] = _stage(frames, rep_state_machine)
+
+    tracker = et.RepTracker(exercise, opt_range=et.OPTIMAL_RANGES.get(exercise, (None, None)))
+    stages["feedback"] = _stage(angles, lambda: tracker._limit_feedback)
+
+    canvas = np.zeros((FRAME_H, FRAME_W, 3), dtype=np.uint8)
+    views = [(lm, et.TrackerView(exercise, i // 40, ang, f"{tracker.label}: {int(ang)}", "Good form!"))
+             for i, (lm, ang) in enumerate(zip([lm for lm in stream if lm is not None], angles))]
+    stages["overlay"] = _stage(views, lambda: lambda v: et._draw_tracker_overlay(canvas, v[0], v[1]))
+
+    lo, hi = et.OPTIMAL_RANGES.get(exercise, (0, 180))
+    sessions = [np.clip(np.random.default_rng(i).normal((lo + hi) / 2, 25, 15), 0, 180).tolist() for i in range(200)]
+    stages["_compute_deviation_repwise"] = _stage(
+        sessions, lambda: lambda reps: et._compute_deviation_repwise(reps, lo, hi, cap_percent=200.0))
+    return stages
+
+# ---------- end to end ----------
+def _run_loop(fn, stream, fps):
+    # `stream` is what the stub model returns per frame
+    src = _TimedSource(_blank_frames(len(stream), fps), fps)
+    t0 = time.perf_counter()
+    result = fn(src, StubSession(stream))
+    wall = time.perf_counter() - t0
+    report = _summary(np.diff(src.read_ns))
+    report["wall_s"] = round(wall, 3)
+    report.update(_allocations(lambda: fn(_TimedSource(_blank_frames(len(stream), fps), fps), StubSession(stream)),
+                               len(stream)))
+    return report, result
+
+def bench_end_to_end(exercise, stream, fps):
+    report = {}
+    raw = raw_frame_stream(stream)
+    report["start_exercise"], stats = _run_loop(
+        lambda src, sess: et.start_exercise(exercise, source=src, headless=True, session=sess), raw, fps)
+    report["start_exercise"]["reps"] = stats["reps"]
+    report["start_exercise_drawn"], _ = _run_loop(
+        lambda src, sess: _drawn(et.start_exercise, exercise, source=src, session=sess), stream, fps)
+
+    # recording writes exercises.json / database.json, so run it in a scratch directory
+    # against a throwaway repository (the shared one holds the real database.json)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        scratch = rehab_db.Repository(os.path.join(tmp, et.DB_FILE))
+        previous = rehab_db.use_repository(scratch)
+        try:
+            report["record_custom_exercise"], limits = _run_loop(
+                lambda src, sess: et.record_custom_exercise("bench " + exercise, countdown_seconds=0,
+                                                            source=src, headless=True, session=sess),
+                raw, fps)
+            report["record_custom_exercise"]["joints"] = len(limits)
+        finally:
+            scratch.flush()
+            rehab_db.use_repository(previous)
+            os.chdir(cwd)
+    return report
+
+def _drawn(fn, *args, **kwargs):
+    """Runs fn with overlay drawing enabled but no window (imshow/waitKey stubbed)."""
+    imshow, wait, destroy = cv2.imshow, cv2.waitKey, cv2.destroyAllWindows
+    cv2.imshow, cv2.waitKey, cv2.destroyAllWindows = (lambda *a: None), (lambda *a: -1), (lambda: None)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        cv2.imshow, cv2.waitKey, cv2.destroyAllWindows = imshow, wait, destroy
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+def run_benchmarks(exercises=("squat", "curl", "raise"), seconds=20.0, fps=30.0, noise=2.0, dropout=0.05, seed=0):
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "params": {"seconds": seconds, "fps": fps, "noise_deg": noise, "dropout": dropout, "seed": seed,
+                   "frame": [FRAME_W, FRAME_H]},
+        "exercises": {},
+    }
+    for ex in exercises:
+        stream = synthetic_stream(ex, seconds, fps, noise, dropout, seed)
+        report["exercises"][ex] = {"stages": bench_stages(ex, stream, fps),
+                                   "end_to_end": bench_end_to_end(ex, stream, fps)}
+    return report
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the tracker hot path on synthetic landmark streams.")
+    ap.add_argument("--exercise", nargs="+", default=list(TRAJECTORIES), choices=list(TRAJECTORIES))
+    ap.add_argument("--seconds", type=float, default=20.0)
+    ap.add_argument("--fps", type=float, default=30.0)
+    ap.add_argument("--noise", type=float, default=2.0, help="angle noise (degrees, std dev)")
+    ap.add_argument("--dropout", type=float, default=0.05, help="fraction of frames with no detection")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", help="write the report to this file instead of stdout")
+    args = ap.parse_args()
+
+    report = run_benchmarks(args.exercise, args.seconds, args.fps, args.noise, args.dropout, args.seed)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
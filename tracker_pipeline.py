@@ -0,0 +1,146 @@
+# tracker_pipeline.py
+import queue
+import threading
+import time
+import cv2
+from stage_timer import clock
+
+# ---------- frame loop runners ----------
+# Both runners split a tracker loop into three stages:
+#   capture: src.read() + mirror flip (in place when the source owns its frames)
+#   infer(frame, ts) -> item      (pose model + rep/feedback logic, in frame order)
+#   render(item) -> bool          (overlay + display; False stops the loop)
+# run_frames() runs them one after another on the calling thread;
+# run_pipelined() gives capture and inference their own threads joined by
+# bounded queues, while render stays on the calling thread (HighGUI needs that).
+
+_END = object()
+
+class DropOldestQueue(queue.Queue):
+    """Bounded queue whose put() evicts the oldest entry instead of blocking
+    when `drop` is set, so a slow consumer always sees the freshest frame."""
+    def __init__(self, maxsize=2, drop=True):
+        super().__init__(maxsize)
+        self.drop = drop
+        self.dropped = 0
+
+    def put(self, item, block=True, timeout=None):
+        if not self.drop or item is _END:
+            return super().put(item, block, timeout)
+        with self.mutex:
+            while self.maxsize > 0 and self._qsize() >= self.maxsize:
+                self._get()
+                self.dropped += 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+def _put_until(q, item, stop):
+    # blocking put that still notices a stop request
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _timed_read(src, timer):
+    # src.read() (+ "capture" stage); timer is a StageTimer or None
+    if timer is None:
+        return src.read()
+    t0 = clock()
+    ret, frame, ts = src.read()
+    if ret:
+        timer.add("capture", t0, ts)
+    return ret, frame, ts
+
+def _mirror(frame, ts, timer, in_place):
+    t0 = clock()
+    frame = cv2.flip(frame, 1, dst=frame if in_place else None)
+    if timer is not None:
+        timer.add("flip", t0, ts)
+    return frame
+
+def run_frames(src, infer, render, mirror=True, timer=None):
+    in_place = getattr(src, "owns_frames", False)
+    while src.isOpened():
+        ret, frame, ts = _timed_read(src, timer)
+        if not ret:
+            break
+        if mirror:
+            frame = _mirror(frame, ts, timer, in_place)
+        if not render(infer(frame, ts)):
+            break
+
+def run_pipelined(src, infer, render, mirror=True, queue_size=2, pace=None, timer=None):
+    """Pipelined variant of run_frames(). Live sources drop the oldest queued
+    frame when a stage falls behind; recorded sources never drop and, when
+    `pace` is set (frames/sec), are fed at that rate instead of as fast as possible.
+    `timer` (a StageTimer) records the capture and flip stages."""
+    drop = bool(getattr(src, "live", False))
+    in_place = getattr(src, "owns_frames", False)
+    frames_q = DropOldestQueue(queue_size, drop=drop)
+    results_q = DropOldestQueue(queue_size, drop=drop)
+    stop = threading.Event()
+    errors = []
+
+    def capture():
+        t0 = None
+        try:
+            while not stop.is_set() and src.isOpened():
+                ret, frame, ts = _timed_read(src, timer)
+                if not ret:
+                    break
+                if pace and not drop:
+                    if t0 is None:
+                        t0 = time.monotonic() - ts
+                    delay = (t0 + ts) - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                if mirror:
+                    frame = _mirror(frame, ts, timer, in_place)
+                if not _put_until(frames_q, (frame, ts), stop):
+                    break
+        except Exception as e:
+            errors.append(e)
+        finally:
+            _put_until(frames_q, _END, stop)
+
+    def inference():
+        try:
+            while not stop.is_set():
+                try:
+                    item = frames_q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _END:
+                    break
+                if not _put_until(results_q, infer(*item), stop):
+                    break
+        except Exception as e:
+            errors.append(e)
+        finally:
+            _put_until(results_q, _END, stop)
+
+    workers = [threading.Thread(target=capture, name="tracker-capture", daemon=True),
+               threading.Thread(target=inference, name="tracker-inference", daemon=True)]
+    for t in workers:
+        t.start()
+    try:
+        while True:
+            try:
+                item = results_q.get(timeout=0.1)
+            except queue.Empty:
+                if not any(t.is_alive() for t in workers):
+                    break
+                continue
+            if item is _END or not render(item):
+                break
+    finally:
+        stop.set()
+        for t in workers:
+            t.join(timeout=2.0)
+    if errors:
+        raise errors[0]
+    return {"dropped_frames": frames_q.dropped, "dropped_results": results_q.dropped}